@@ -0,0 +1,61 @@
+"""
+Сравнение хранения сумм: DECIMAL(10, 2) против BIGINT копеек (MoneyField).
+
+    python -m benchmarks.amounts --rows 1000000
+
+Для сравнения «до» создается временная таблица с прежним DecimalField,
+заполненная теми же суммами.
+"""
+from benchmarks.common import (
+    parse_args, seed_cashflows, seed_reference, setup_django, timed
+)
+
+
+def main():
+    args = parse_args(__doc__)
+    setup_django(args.db)
+
+    from django.db import connection, models
+    from django.db.models import Sum
+    from cash_flow.models import CashFlow
+
+    class LegacyAmount(models.Model):
+        amount = models.DecimalField(max_digits=10, decimal_places=2)
+
+        class Meta:
+            app_label = 'cash_flow'
+            db_table = 'bench_legacy_amount'
+            managed = False
+
+    status_ids, hierarchy = seed_reference()
+    seed_cashflows(args.rows, status_ids, hierarchy)
+    with connection.schema_editor() as editor:
+        editor.create_model(LegacyAmount)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO bench_legacy_amount (id, amount) '
+            'SELECT id, amount / 100.0 FROM cash_flow_cashflow'
+        )
+
+    results = {}
+    rows = args.rows
+    print(f'Строк: {rows:,}')
+    for label, model in (('DECIMAL', LegacyAmount), ('BIGINT', CashFlow)):
+        with timed(f'{label}: чтение и декодирование amount', results, rows):
+            values = list(
+                model.objects.order_by().values_list('amount', flat=True)
+            )
+        with timed(f'{label}: сумма в Python', results, rows):
+            python_total = sum(values)
+        with timed(f'{label}: SUM в БД', results, rows):
+            db_total = model.objects.aggregate(total=Sum('amount'))['total']
+        print(f'{label}: итог {db_total} (Python: {python_total})')
+
+    for metric in ('чтение и декодирование amount', 'SUM в БД'):
+        before = results[f'DECIMAL: {metric}']
+        after = results[f'BIGINT: {metric}']
+        print(f'Ускорение ({metric}): x{before / after:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Поиск дублей и выбросов (cash_flow.anomalies) на большой таблице.
+
+    python -m benchmarks.anomalies --rows 1000000
+
+Поверх случайных записей вставляются 1000 дублей и 100 записей с
+необычной суммой; замеряются полный поиск (с загрузкой снимка и без
+нее) и инкрементальный после вставки еще 1000 записей.
+"""
+from benchmarks.common import (
+    parse_args, seed_cashflows, seed_reference, setup_django, timed
+)
+
+
+def main():
+    args = parse_args(__doc__)
+    setup_django(args.db)
+
+    import datetime
+    import random
+    from decimal import Decimal
+    from cash_flow import analytics, anomalies
+    from cash_flow.models import CashFlow, CashFlowFlag
+
+    status_ids, hierarchy = seed_reference()
+    seed_cashflows(args.rows, status_ids, hierarchy)
+    print(f'Строк: {args.rows:,}, NumPy: {"да" if analytics.numpy else "нет"}')
+
+    rng = random.Random(7)
+
+    def copy(source):
+        return CashFlow(
+            date_created=source.date_created + datetime.timedelta(
+                days=rng.randrange(3)
+            ),
+            status_id=source.status_id, type_id=source.type_id,
+            category_id=source.category_id,
+            subcategory_id=source.subcategory_id,
+            amount=source.amount, comment=source.comment,
+        )
+
+    copies = [copy(source) for source in CashFlow.objects.order_by('?')[:1000]]
+    type_id, category_id, subcategory_id = hierarchy[0]
+    outliers = [
+        CashFlow(
+            date_created=datetime.date(2020, 1, 1), status_id=status_ids[0],
+            type_id=type_id, category_id=category_id,
+            subcategory_id=subcategory_id, amount=Decimal('9000000.00'),
+        )
+        for _ in range(100)
+    ]
+    CashFlow.objects.bulk_create(copies + outliers)
+
+    results = {}
+    with timed('Полный поиск (с загрузкой снимка)', results, args.rows):
+        found = anomalies.detect()
+    print(f'  {found}')
+    with timed('Полный поиск (снимок в памяти)', results, args.rows):
+        found = anomalies.detect()
+    print(f'  {found}')
+
+    CashFlow.objects.bulk_create([copy(cashflow) for cashflow in copies])
+    with timed('Инкрементальный поиск (1000 новых записей)', results):
+        found = anomalies.detect(since=found['last_seq'])
+    print(f'  {found}')
+    print(f'Отметок всего: {CashFlowFlag.objects.count()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Объем и время загрузки статики страницы списка при первом и повторном
+открытии.
+
+    python -m benchmarks.assets --rows 1000 --repeat 5
+
+Собирает статику (collectstatic) во временный STATIC_ROOT, поднимает
+многопоточный WSGI-сервер (как benchmarks.load) и загружает страницу
+списка со всеми CSS, JS и шрифтами иконок из нее так, как это делает
+браузер:
+
+- первая загрузка — пустой кеш: страница и все файлы;
+- повторная — файлы с Cache-Control immutable берутся из кеша без
+  запроса, остальные перепроверяются по ETag (304 без тела).
+
+Сравниваются ответы без сжатия (Accept-Encoding: identity) и со сжатыми
+копиями (gzip и br, если установлен brotli). «Байт» — заголовки и тело
+ответов, как они идут по сети; время — медиана по --repeat прогонам.
+"""
+import gzip
+import http.client
+import re
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import parse_args, seed_cashflows, seed_reference, setup_django
+from benchmarks.load import start_server
+
+
+ASSET_LINK = re.compile(r'(?:href|src)="(/static/[^"]+)"')
+CSS_URL = re.compile(r'url\(["\']?([^"\')]+\.woff2)')
+
+
+class Browser:
+    """Последовательная загрузка по одному соединению с простым HTTP-кешем."""
+
+    def __init__(self, port, accept_encoding):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port)
+        self.accept_encoding = accept_encoding
+        self.cache = {}
+        self.requests = 0
+        self.bytes = 0
+
+    def get(self, path):
+        cached = self.cache.get(path)
+        if cached and 'immutable' in cached['cache_control']:
+            return cached['body']
+        headers = {'Accept-Encoding': self.accept_encoding}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        self.connection.request('GET', path, headers=headers)
+        response = self.connection.getresponse()
+        body = response.read()
+        self.requests += 1
+        self.bytes += len(body) + sum(
+            len(name) + len(value) + 4 for name, value in response.getheaders()
+        ) + 17
+        if response.status == 304:
+            return cached['body']
+        if response.status != 200:
+            raise RuntimeError(f'{path}: {response.status}')
+        encoding = response.getheader('Content-Encoding')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'br':
+            from cash_flow.assets import brotli
+            body = brotli.decompress(body)
+        if path.startswith('/static/'):
+            self.cache[path] = {
+                'body': body,
+                'etag': response.getheader('ETag'),
+                'cache_control': response.getheader('Cache-Control') or '',
+            }
+        return body
+
+    def load(self, page):
+        """Загружает страницу и ее статику; возвращает (запросы, байты, секунды)."""
+        requests, transferred = self.requests, self.bytes
+        started = time.perf_counter()
+        html = self.get(page).decode()
+        for path in dict.fromkeys(ASSET_LINK.findall(html)):
+            body = self.get(path)
+            if path.endswith('.css'):
+                # Шрифты иконок, на которые ссылается CSS (верхняя оценка:
+                # браузер грузит только используемые начертания).
+                base = path.rsplit('/', 1)[0]
+                for font in dict.fromkeys(CSS_URL.findall(body.decode())):
+                    self.get(normalize(f'{base}/{font}'))
+        return (
+            self.requests - requests,
+            self.bytes - transferred,
+            time.perf_counter() - started,
+        )
+
+
+def normalize(path):
+    parts = []
+    for part in path.split('/'):
+        if part == '..':
+            parts.pop()
+        elif part != '.':
+            parts.append(part)
+    return '/'.join(parts)
+
+
+def main():
+    args = parse_args(
+        __doc__, default_rows=1000, repeat={'type': int, 'default': 5}
+    )
+    setup_django(args.db)
+
+    from django.conf import settings
+    from django.core.management import call_command
+    from cash_flow import assets
+
+    status_ids, hierarchy = seed_reference()
+    seed_cashflows(args.rows, status_ids, hierarchy)
+
+    settings.STATIC_ROOT = tempfile.mkdtemp(prefix='cashflow-static-')
+    started = time.perf_counter()
+    call_command('collectstatic', interactive=False, verbosity=0)
+    print(f'collectstatic со сжатием: {(time.perf_counter() - started) * 1000:.0f} мс'
+          f' (brotli: {"да" if assets.brotli else "нет"})')
+
+    server = start_server()
+    port = server.server_address[1]
+    page = '/cash_flow/cashflow/'
+    modes = [('identity', 'без сжатия'), ('gzip', 'gzip')]
+    if assets.brotli is not None:
+        modes.append(('br, gzip', 'br'))
+
+    print(f'{"Режим":<14}{"Загрузка":<12}{"Запросов":>10}{"КБ":>12}{"мс":>10}')
+    try:
+        for accept_encoding, label in modes:
+            first, repeat = [], []
+            for _ in range(args.repeat):
+                browser = Browser(port, accept_encoding)
+                first.append(browser.load(page))
+                repeat.append(browser.load(page))
+                browser.connection.close()
+            for name, runs in (('первая', first), ('повторная', repeat)):
+                requests, transferred, _ = runs[0]
+                elapsed = statistics.median(run[2] for run in runs)
+                print(f'{label:<14}{name:<12}{requests:>10}'
+                      f'{transferred / 1024:>12.1f}{elapsed * 1000:>10.1f}')
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
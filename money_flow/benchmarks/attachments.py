@@ -0,0 +1,158 @@
+"""
+Загрузка и отдача вложений: время и пик памяти Python (tracemalloc).
+
+    python -m benchmarks.attachments --size-mb 64 --repeat 3
+
+Файл --size-mb МБ загружается в POST /api/cashflows/{id}/attachments/
+прямо через WSGI-обработчик; тело запроса генерируется при чтении, так
+что в памяти его нет. Загрузка сравнивается со стандартными
+обработчиками Django (файл в памяти до 2,5 МБ, затем во временном файле,
+хеш и перенос в хранилище — отдельным проходом). Затем замеряется отдача
+всего файла, диапазона в 1 МБ из середины и повторная загрузка того же
+содержимого (дедупликация).
+"""
+import io
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import parse_args, seed_cashflows, seed_reference, setup_django
+
+
+BOUNDARY = 'benchmarkboundary'
+
+
+class GeneratedBody(io.RawIOBase):
+    """multipart-тело с файлом size байт из повторяющегося блока."""
+
+    def __init__(self, size, block):
+        self.parts = [
+            (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; '
+             f'filename="scan.pdf"\r\nContent-Type: application/pdf\r\n\r\n').encode(),
+            None,
+            f'\r\n--{BOUNDARY}--\r\n'.encode(),
+        ]
+        self.size = size
+        self.block = block
+        self.length = len(self.parts[0]) + size + len(self.parts[2])
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        head, _, tail = self.parts
+        offset = self.position
+        if offset < len(head):
+            chunk = head[offset:]
+        elif offset < len(head) + self.size:
+            offset -= len(head)
+            chunk = self.block[offset % len(self.block):][:self.size - offset]
+        else:
+            chunk = tail[offset - len(head) - self.size:]
+        chunk = chunk[:len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+
+def main():
+    args = parse_args(
+        __doc__, default_rows=1,
+        size_mb={'type': int, 'default': 64},
+        repeat={'type': int, 'default': 3},
+    )
+    setup_django(args.db)
+
+    import json
+    from django.conf import settings
+    from django.test import Client
+    from django.test.client import ClientHandler
+    from cash_flow import attachments
+    from cash_flow.models import Attachment, CashFlow, StoredFile
+
+    settings.ALLOWED_HOSTS = ['*']
+    settings.CASH_FLOW_ATTACHMENTS_ROOT = tempfile.mkdtemp(prefix='cashflow-attachments-')
+    settings.CASH_FLOW_ATTACHMENT_MAX_SIZE = (args.size_mb + 1) * 2 ** 20
+    status_ids, hierarchy = seed_reference(types=1, categories=1, subcategories=1)
+    seed_cashflows(max(args.rows, 1), status_ids, hierarchy)
+    row = CashFlow.objects.first()
+    size = args.size_mb * 2 ** 20
+    handler = ClientHandler()
+    client = Client()
+
+    def upload(block):
+        body = GeneratedBody(size, block)
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': f'/api/cashflows/{row.pk}/attachments/',
+            'QUERY_STRING': '',
+            'CONTENT_TYPE': f'multipart/form-data; boundary={BOUNDARY}',
+            'CONTENT_LENGTH': str(body.length),
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+            'HTTP_HOST': 'localhost', 'HTTP_ACCEPT': 'application/json',
+            'wsgi.input': io.BufferedReader(body),
+            'wsgi.url_scheme': 'http', 'wsgi.errors': io.StringIO(),
+        }
+        response = handler(environ)
+        assert response.status_code == 201, response.content
+        return json.loads(response.content)
+
+    def measure(run):
+        timings, peaks = [], []
+        for _ in range(args.repeat):
+            tracemalloc.start()
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        return statistics.median(timings), max(peaks)
+
+    def report(label, result, size=size):
+        seconds, peak = result
+        print(f'{label:<36}{seconds * 1000:>9.0f} мс{size / 2 ** 20 / seconds:>9.0f} МБ/с'
+              f'{peak / 2 ** 20:>9.2f} МБ')
+
+    def clear():
+        Attachment.objects.all().delete()
+        StoredFile.objects.all().delete()
+        attachments.collect_garbage(grace_seconds=-1)
+
+    print(f'Файл: {args.size_mb} МБ')
+    print(f'{"":<36}{"время":>12}{"скорость":>13}{"пик памяти":>12}')
+
+    standard = attachments.upload_handlers
+    attachments.upload_handlers = lambda request: request.upload_handlers
+    try:
+        report('Загрузка: обработчики Django', measure(
+            lambda: (clear(), upload(os.urandom(100_003)))
+        ))
+    finally:
+        attachments.upload_handlers = standard
+    report('Загрузка: HashingUploadHandler', measure(
+        lambda: (clear(), upload(os.urandom(100_003)))
+    ))
+
+    block = os.urandom(100_003)
+    clear()
+    url = upload(block)['url']
+    report('Повторная загрузка того же файла', measure(lambda: upload(block)))
+
+    def download(**headers):
+        response = client.get(url, **headers)
+        for _ in response.streaming_content:
+            pass
+        response.close()
+
+    report('Отдача файла целиком', measure(download))
+    middle = size // 2
+    report('Отдача диапазона 1 МБ', measure(
+        lambda: download(HTTP_RANGE=f'bytes={middle}-{middle + 2 ** 20 - 1}')
+    ), size=2 ** 20)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Пакетные действия списка: время и пик памяти Python (tracemalloc) при
+выборе всех записей по фильтру.
+
+    python -m benchmarks.batch --rows 1000000
+
+Запросы идут через тест-клиент в CashFlowBatchView: сводка выборки
+(GET), смена статуса, смена категории и удаление (POST). Для сравнения
+смена категории сохраняется формой записи по одной (как при правке через
+страницу записи) на --per-row записях.
+"""
+import time
+import tracemalloc
+
+from benchmarks.common import parse_args, seed_cashflows, seed_reference, setup_django
+
+
+def main():
+    args = parse_args(
+        __doc__, default_rows=1_000_000,
+        per_row={'type': int, 'default': 200},
+    )
+    setup_django(args.db)
+
+    from django.conf import settings
+    from django.db import connection
+    from django.db.models import Count, Max
+    from django.test import Client
+    from django.urls import reverse
+    from cash_flow.forms import CashFlowForm
+    from cash_flow.models import CashFlow, Subcategory
+    from benchmarks.common import default_tenant_id
+
+    settings.ALLOWED_HOSTS = ['*']
+    tenant_id = default_tenant_id()
+    status_ids, hierarchy = seed_reference()
+    seed_cashflows(args.rows, status_ids, hierarchy)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    subcategory = Subcategory.objects.for_tenant(tenant_id).select_related(
+        'category'
+    ).last()
+    client = Client()
+    url = reverse('cashflow_batch')
+
+    def measure(label, run):
+        tracemalloc.start()
+        started = time.perf_counter()
+        rows = run()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{label:<40}{rows:>10,}{elapsed * 1000:>10.0f} мс'
+              f'{rows / elapsed:>14,.0f} строк/с{peak / 2 ** 20:>9.2f} МБ')
+
+    def selected(params):
+        """Число записей и наибольший номер изменения, как на странице сводки."""
+        return CashFlow.objects.for_tenant(tenant_id).filter_by_params(
+            params
+        ).aggregate(count=Count('pk'), last_seq=Max('change_seq'))
+
+    def batch(method, data):
+        def run():
+            summary = selected(data)
+            response = getattr(client, method)(url, {
+                **data, 'confirmed_count': summary['count'],
+                'confirmed_seq': summary['last_seq'],
+            })
+            assert response.status_code == (200 if method == 'get' else 302), (
+                response.status_code
+            )
+            return summary['count']
+        return run
+
+    by_status = {'select_all': '1', 'status': status_ids[0]}
+    half = {'select_all': '1', 'start_date': '2015-01-01', 'end_date': '2019-12-31'}
+    categorize = {
+        'action': 'categorize', 'new_subcategory': subcategory.pk, **half,
+    }
+    print(f'Записей: {args.rows:,}')
+    print(f'{"":<40}{"записей":>10}{"время":>13}{"скорость":>20}{"пик":>9}')
+    measure('Сводка выборки (GET)', batch(
+        'get', {'action': 'status', **by_status}
+    ))
+    measure('Смена статуса по фильтру', batch('post', {
+        'action': 'status', 'new_status': status_ids[1], **by_status,
+    }))
+    measure('Смена категории по фильтру', batch('post', categorize))
+
+    sample = CashFlow.objects.for_tenant(tenant_id).order_by('pk')[:args.per_row]
+
+    def per_row():
+        for row in sample:
+            form = CashFlowForm({
+                'date_created': row.date_created, 'status': row.status_id,
+                'type': subcategory.category.type_id,
+                'category': subcategory.category_id,
+                'subcategory': subcategory.pk, 'amount': row.amount,
+                'currency': row.currency, 'comment': row.comment,
+            }, instance=row, tenant_id=tenant_id)
+            assert form.is_valid(), form.errors
+            form.save()
+        return len(sample)
+
+    measure('Смена категории формой по одной', per_row)
+    measure('Удаление по фильтру', batch('post', {'action': 'delete', **half}))
+
+
+if __name__ == '__main__':
+    main()
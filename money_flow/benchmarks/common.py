@@ -0,0 +1,146 @@
+"""
+Общая подготовка окружения для бенчмарков.
+
+Бенчмарки запускаются из каталога money_flow, например:
+
+    python -m benchmarks.amounts --rows 1000000
+
+и работают с отдельной временной SQLite-базой, не затрагивая db.sqlite3.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django(db_path=None):
+    """Настраивает Django на временную базу и применяет миграции."""
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'money_flow.settings')
+
+    import django
+    from django.conf import settings
+
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='cashflow-bench-'), 'bench.sqlite3')
+    settings.DATABASES['default']['NAME'] = db_path
+    settings.DEBUG = False
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    return db_path
+
+
+def parse_args(description, default_rows=1_000_000, **extra):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--rows', type=int, default=default_rows)
+    parser.add_argument('--db', default=None, help='путь к SQLite-базе')
+    for name, options in extra.items():
+        parser.add_argument(f'--{name.replace("_", "-")}', **options)
+    return parser.parse_args()
+
+
+def default_tenant_id():
+    from django.conf import settings
+    return settings.CASH_FLOW_DEFAULT_TENANT
+
+
+def seed_reference(types=2, categories=10, subcategories=5, statuses=3,
+                   tenant_id=None):
+    """
+    Создает справочники организации tenant_id (по умолчанию
+    CASH_FLOW_DEFAULT_TENANT) и возвращает списки их id.
+    """
+    from cash_flow.models import Status, Type, Category, Subcategory
+
+    tenant_id = tenant_id or default_tenant_id()
+    status_ids = [
+        Status.objects.create(name=f'Статус {i}', tenant_id=tenant_id).pk
+        for i in range(statuses)
+    ]
+    hierarchy = []
+    for t in range(types):
+        type_obj = Type.objects.create(name=f'Тип {t}', tenant_id=tenant_id)
+        for c in range(categories):
+            category = Category.objects.create(name=f'Категория {t}.{c}', type=type_obj)
+            for s in range(subcategories):
+                subcategory = Subcategory.objects.create(
+                    name=f'Подкатегория {t}.{c}.{s}', category=category
+                )
+                hierarchy.append((type_obj.pk, category.pk, subcategory.pk))
+    return status_ids, hierarchy
+
+
+def seed_cashflows(rows, status_ids, hierarchy, batch=50_000, seed=42,
+                   start_ordinal=None, days=3650, extra_columns=None,
+                   tenant_id=None):
+    """
+    Быстро заполняет cash_flow_cashflow через executemany записями
+    организации tenant_id (по умолчанию CASH_FLOW_DEFAULT_TENANT).
+
+    extra_columns — словарь {колонка: функция(rng) -> значение} для полей,
+    добавленных поверх базовой схемы.
+    """
+    import datetime
+    from django.db import connection, transaction
+    from cash_flow.models import CashFlow, ChangeCounter
+
+    rng = random.Random(seed)
+    tenant_id = tenant_id or default_tenant_id()
+    counter = ChangeCounter.objects.filter(pk=1).first()
+    first_seq = counter.value if counter else 0
+    if start_ordinal is None:
+        start_ordinal = datetime.date(2015, 1, 1).toordinal()
+    extra_columns = {'currency': lambda rng: 'RUB', **(extra_columns or {})}
+    columns = [
+        'date_created', 'status_id', 'type_id', 'category_id',
+        'subcategory_id', 'amount', 'comment', 'change_seq', 'tenant_id',
+        *extra_columns,
+    ]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        CashFlow._meta.db_table,
+        ', '.join(columns),
+        ', '.join(['%s'] * len(columns)),
+    )
+    done = 0
+    with transaction.atomic():
+        while done < rows:
+            size = min(batch, rows - done)
+            params = []
+            for i in range(size):
+                type_id, category_id, subcategory_id = rng.choice(hierarchy)
+                params.append((
+                    datetime.date.fromordinal(
+                        start_ordinal + rng.randrange(days)
+                    ).isoformat(),
+                    rng.choice(status_ids),
+                    type_id, category_id, subcategory_id,
+                    rng.randrange(1, 10_000_000),
+                    f'платеж {rng.randrange(100000)}',
+                    first_seq + done + i + 1, tenant_id,
+                    *(make(rng) for make in extra_columns.values()),
+                ))
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, params)
+            done += size
+        ChangeCounter.objects.update_or_create(
+            pk=1, defaults={'value': first_seq + done}
+        )
+
+
+@contextmanager
+def timed(label, results, rows=None):
+    """Замеряет блок и печатает время и пропускную способность."""
+    started = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started
+    results[label] = elapsed
+    rate = f', {rows / elapsed:,.0f} строк/с' if rows else ''
+    print(f'{label:<45} {elapsed * 1000:10.1f} мс{rate}')
@@ -0,0 +1,63 @@
+"""
+Пересчет сумм в валюту отчетности по таблице курсов.
+
+    python -m benchmarks.currency --rows 1000000
+
+Записи в RUB/USD/EUR за 10 лет, курсы USD и EUR к RUB на каждый день.
+Замеряются итог, итоги по типам и полный проход с converted_amount.
+"""
+import datetime
+import random
+from decimal import Decimal
+
+from benchmarks.common import (
+    parse_args, seed_cashflows, seed_reference, setup_django, timed
+)
+
+
+def main():
+    args = parse_args(__doc__)
+    setup_django(args.db)
+
+    from cash_flow.models import CashFlow, ExchangeRate
+
+    status_ids, hierarchy = seed_reference()
+    seed_cashflows(
+        args.rows, status_ids, hierarchy,
+        extra_columns={
+            'currency': lambda rng: rng.choice(('RUB', 'RUB', 'USD', 'EUR')),
+        },
+    )
+    rng = random.Random(1)
+    start = datetime.date(2015, 1, 1)
+    rates = [
+        ExchangeRate(
+            date=start + datetime.timedelta(days=day),
+            base_currency=currency,
+            quote_currency='RUB',
+            rate=Decimal(rng.randrange(6000, 11000)) / 100,
+        )
+        for currency in ('USD', 'EUR')
+        for day in range(3650)
+    ]
+    ExchangeRate.objects.bulk_create(rates, batch_size=5000)
+
+    results = {}
+    rows = args.rows
+    print(f'Строк: {rows:,}, курсов: {len(rates):,}')
+    with timed('SUM(amount) без пересчета', results, rows):
+        CashFlow.objects.total()
+    with timed('Итог с пересчетом в RUB', results, rows):
+        total = CashFlow.objects.converted_total('RUB')
+    print(f'  итог {total["total"]}, без курса {total["missing"]}')
+    with timed('Итоги по типам с пересчетом', results, rows):
+        list(CashFlow.objects.converted_totals_by('type__name', currency='RUB'))
+    with timed('Чтение всех строк с converted_amount', results, rows):
+        for _ in CashFlow.objects.order_by().with_converted_amount(
+            'RUB'
+        ).values_list('converted_amount', flat=True).iterator(chunk_size=10000):
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+"""
+Нагрузочный тест веб-интерфейса и REST API.
+
+    python -m benchmarks.load --rows 100000 --concurrency 1,4,16 --duration 20
+    python -m benchmarks.load --save-baseline load-baseline.json
+    python -m benchmarks.load --baseline load-baseline.json --max-regression 0.2
+
+Поднимает в отдельном потоке многопоточный WSGI-сервер Django (как
+runserver, один процесс) на временной заполненной базе и гоняет через
+него смесь сценариев:
+
+- list   — список с фильтрами и дальними страницами;
+- form   — форма создания записи: GET формы, AJAX-запросы категорий и
+  подкатегорий, POST формы;
+- api    — список /api/cashflows/ с фильтрами и страницами;
+- create — POST /api/cashflows/;
+- admin  — список записей в админке под суперпользователем.
+
+Для каждого уровня конкурентности печатаются пропускная способность,
+p50/p95/p99 и доля ошибок по каждому запросу. Результаты можно сохранить
+как базовые и сравнить с ними следующий прогон.
+"""
+import http.client
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+from benchmarks.common import parse_args, seed_cashflows, seed_reference, setup_django
+
+
+DEFAULT_MIX = {'list': 4, 'form': 1, 'api': 3, 'create': 1, 'admin': 1}
+ADMIN_USERNAME = 'load'
+ADMIN_PASSWORD = 'load-test-password'
+
+CSRF_INPUT = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def start_server():
+    """Запускает многопоточный WSGI-сервер Django на свободном порту."""
+    from django.core.servers.basehttp import (
+        ThreadedWSGIServer, WSGIRequestHandler
+    )
+    from django.core.wsgi import get_wsgi_application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+class Client:
+    """HTTP-клиент одного виртуального пользователя с cookies."""
+
+    def __init__(self, port, recorder):
+        self.port = port
+        self.recorder = recorder
+        self.cookies = {}
+
+    def request(self, label, method, path, body=None, headers=None,
+                expect=(200,)):
+        headers = dict(headers or {})
+        if method != 'GET' and 'csrftoken' in self.cookies:
+            # DRF проверяет CSRF для запросов с сессией (после входа в админку).
+            headers['X-CSRFToken'] = self.cookies['csrftoken']
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                f'{name}={value}' for name, value in self.cookies.items()
+            )
+        if isinstance(body, dict):
+            body = urllib.parse.urlencode(body)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        started = time.perf_counter()
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            content = response.read()
+            status = response.status
+            for header in response.headers.get_all('Set-Cookie') or ():
+                name, _, rest = header.partition('=')
+                self.cookies[name.strip()] = rest.split(';', 1)[0]
+        except (OSError, http.client.HTTPException):
+            content, status = b'', None
+        finally:
+            connection.close()
+        self.recorder.record(
+            label, time.perf_counter() - started, status in expect
+        )
+        return status, content
+
+    def csrf_token(self, content):
+        match = CSRF_INPUT.search(content.decode('utf-8', 'replace'))
+        return match.group(1) if match else self.cookies.get('csrftoken', '')
+
+    def login_admin(self):
+        _, content = self.request('admin login', 'GET', '/admin/login/')
+        self.request('admin login', 'POST', '/admin/login/?next=/admin/', {
+            'csrfmiddlewaretoken': self.csrf_token(content),
+            'username': ADMIN_USERNAME,
+            'password': ADMIN_PASSWORD,
+            'next': '/admin/',
+        }, expect=(302,))
+
+
+class Recorder:
+    """Собирает длительности и ошибки запросов по меткам."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, label, elapsed, ok):
+        with self.lock:
+            self.samples[label].append(elapsed)
+            if not ok:
+                self.errors[label] += 1
+
+
+class Scenarios:
+    """Сценарии пользователей; данные о справочниках берутся из базы."""
+
+    def __init__(self, rows, page_size=10):
+        from django.contrib import admin
+        from django.db.models import Count
+        from cash_flow.models import CashFlow, Status, Subcategory
+
+        self.status_ids = list(Status.objects.values_list('pk', flat=True))
+        self.hierarchy = list(Subcategory.objects.values_list(
+            'category__type_id', 'category_id', 'pk'
+        ))
+        self.pages = max(rows // page_size, 1)
+        # Число записей по статусам: номер страницы админки не должен
+        # выходить за выборку, иначе Django перенаправляет на ?e=1.
+        self.rows = rows
+        self.status_rows = dict(
+            CashFlow.objects.order_by().values_list('status').annotate(Count('pk'))
+        )
+        self.admin_per_page = admin.site._registry[CashFlow].list_per_page
+
+    def filters(self, rng):
+        """Случайный набор фильтров, как в форме списка."""
+        type_id, category_id, subcategory_id = rng.choice(self.hierarchy)
+        params = {}
+        if rng.random() < 0.5:
+            params['status'] = rng.choice(self.status_ids)
+        if rng.random() < 0.5:
+            params['type'] = type_id
+            if rng.random() < 0.5:
+                params['category'] = category_id
+        if rng.random() < 0.3:
+            year = rng.randrange(2015, 2025)
+            params['start_date'] = f'{year}-01-01'
+            params['end_date'] = f'{year}-12-31'
+        return params
+
+    def page(self, rng, params):
+        # Без фильтров — в том числе дальние страницы.
+        if params or rng.random() < 0.5:
+            return rng.randrange(1, 4)
+        return rng.randrange(1, self.pages + 1)
+
+    def list(self, client, rng):
+        params = self.filters(rng)
+        params['page'] = self.page(rng, params)
+        client.request(
+            'list', 'GET',
+            f'/cash_flow/cashflow/?{urllib.parse.urlencode(params)}',
+            expect=(200, 404)
+        )
+
+    def form(self, client, rng):
+        type_id, category_id, subcategory_id = rng.choice(self.hierarchy)
+        _, content = client.request(
+            'form GET', 'GET', '/cash_flow/cashflow/create/'
+        )
+        client.request(
+            'ajax categories', 'GET',
+            f'/cash_flow/ajax/categories/?type_id={type_id}'
+        )
+        client.request(
+            'ajax subcategories', 'GET',
+            f'/cash_flow/ajax/subcategories/?category_id={category_id}'
+        )
+        client.request('form POST', 'POST', '/cash_flow/cashflow/create/', {
+            'csrfmiddlewaretoken': client.csrf_token(content),
+            'date_created': '2024-06-01',
+            'status': rng.choice(self.status_ids),
+            'type': type_id,
+            'category': category_id,
+            'subcategory': subcategory_id,
+            'amount': f'{rng.randrange(1, 100000) / 100:.2f}',
+            'currency': 'RUB',
+            'comment': 'нагрузочный тест',
+        }, expect=(302,))
+
+    def api(self, client, rng):
+        params = self.filters(rng)
+        params.pop('start_date', None)
+        params.pop('end_date', None)
+        params['page'] = self.page(rng, params)
+        client.request(
+            'api list', 'GET',
+            f'/api/cashflows/?{urllib.parse.urlencode(params)}',
+            expect=(200, 404)
+        )
+
+    def create(self, client, rng):
+        type_id, category_id, subcategory_id = rng.choice(self.hierarchy)
+        client.request('api create', 'POST', '/api/cashflows/', json.dumps({
+            'date_created': '2024-06-01',
+            'status': rng.choice(self.status_ids),
+            'type': type_id,
+            'category': category_id,
+            'subcategory': subcategory_id,
+            'amount': f'{rng.randrange(1, 100000) / 100:.2f}',
+        }), headers={'Content-Type': 'application/json'}, expect=(201,))
+
+    def admin(self, client, rng):
+        if 'sessionid' not in client.cookies:
+            client.login_admin()
+        params = {}
+        rows = self.rows
+        if rng.random() < 0.5:
+            params['status__id__exact'] = rng.choice(self.status_ids)
+            rows = self.status_rows.get(params['status__id__exact'], 0)
+        pages = max(-(-rows // self.admin_per_page), 1)
+        params['p'] = rng.randrange(1, min(pages, 5) + 1)
+        client.request(
+            'admin changelist', 'GET',
+            f'/admin/cash_flow/cashflow/?{urllib.parse.urlencode(params)}'
+        )
+
+
+def run_level(port, scenarios, mix, concurrency, duration, seed):
+    """Гоняет смесь сценариев в concurrency потоках duration секунд."""
+    recorder = Recorder()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    deadline = time.perf_counter() + duration
+
+    def user(number):
+        rng = random.Random(seed * 1000 + number)
+        client = Client(port, recorder)
+        while time.perf_counter() < deadline:
+            scenario = rng.choices(names, weights)[0]
+            getattr(scenarios, scenario)(client, rng)
+
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=user, args=(number,))
+        for number in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return summarize(recorder, elapsed)
+
+
+def percentile(values, fraction):
+    """Перцентиль по ближайшему рангу; values отсортированы."""
+    index = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    total = errors = 0
+    for label, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        total += len(samples)
+        errors += recorder.errors[label]
+        endpoints[label] = {
+            'requests': len(samples),
+            'rps': len(samples) / elapsed,
+            'errors': recorder.errors[label] / len(samples),
+            'p50': percentile(samples, 0.50) * 1000,
+            'p95': percentile(samples, 0.95) * 1000,
+            'p99': percentile(samples, 0.99) * 1000,
+        }
+    return {
+        'elapsed': elapsed,
+        'requests': total,
+        'rps': total / elapsed if elapsed else 0,
+        'errors': errors / total if total else 0,
+        'endpoints': endpoints,
+    }
+
+
+def print_level(concurrency, result, baseline=None):
+    print(
+        f'\nКонкурентность {concurrency}: {result["requests"]} запросов, '
+        f'{result["rps"]:.1f} запр/с, ошибок {result["errors"]:.1%}'
+        + _delta(result['rps'], baseline and baseline['rps'], higher=True)
+    )
+    print(f'{"запрос":<22}{"запр/с":>9}{"p50 мс":>10}{"p95 мс":>10}'
+          f'{"p99 мс":>10}{"ошибки":>9}')
+    for label, row in result['endpoints'].items():
+        base = (baseline or {}).get('endpoints', {}).get(label)
+        print(
+            f'{label:<22}{row["rps"]:>9.1f}{row["p50"]:>10.1f}'
+            f'{row["p95"]:>10.1f}{row["p99"]:>10.1f}{row["errors"]:>9.1%}'
+            + _delta(row['p95'], base and base['p95'], higher=False, label='p95')
+        )
+
+
+def _delta(value, base, higher, label=''):
+    if not base:
+        return ''
+    change = (value - base) / base
+    worse = change < 0 if higher else change > 0
+    mark = ' хуже' if worse and abs(change) > 0.05 else ''
+    return f'  ({label + " " if label else ""}{change:+.0%} к базовому{mark})'
+
+
+def regressions(results, baseline, limit):
+    """Список ухудшений пропускной способности и p95 больше limit."""
+    found = []
+    for level, result in results.items():
+        base = baseline.get(level)
+        if not base:
+            continue
+        if result['rps'] < base['rps'] * (1 - limit):
+            found.append(f'конкурентность {level}: запр/с {base["rps"]:.1f} -> {result["rps"]:.1f}')
+        for label, row in result['endpoints'].items():
+            base_row = base['endpoints'].get(label)
+            if base_row and row['p95'] > base_row['p95'] * (1 + limit):
+                found.append(
+                    f'конкурентность {level}, {label}: p95 '
+                    f'{base_row["p95"]:.1f} -> {row["p95"]:.1f} мс'
+                )
+    return found
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f'Неизвестный сценарий: {name}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    args = parse_args(
+        __doc__, default_rows=100_000,
+        concurrency={'default': '1,4,16', 'help': 'уровни через запятую'},
+        duration={'type': float, 'default': 15.0, 'help': 'секунд на уровень'},
+        mix={'default': None, 'help': 'веса сценариев, например list=4,api=2'},
+        seed={'type': int, 'default': 1},
+        baseline={'default': None, 'help': 'JSON с базовыми результатами'},
+        save_baseline={'default': None, 'help': 'сохранить результаты в JSON'},
+        max_regression={
+            'type': float, 'default': None,
+            'help': 'доля ухудшения, при которой прогон завершается ошибкой'
+        },
+    )
+    setup_django(args.db)
+
+    from django.contrib.auth import get_user_model
+
+    status_ids, hierarchy = seed_reference()
+    seed_cashflows(args.rows, status_ids, hierarchy)
+    get_user_model().objects.create_superuser(
+        ADMIN_USERNAME, 'load@example.com', ADMIN_PASSWORD
+    )
+    server = start_server()
+    port = server.server_address[1]
+    scenarios = Scenarios(args.rows)
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as source:
+            baseline = json.load(source)
+
+    print(f'Строк: {args.rows:,}, сервер 127.0.0.1:{port}, смесь: {mix}')
+    results = {}
+    try:
+        for level in [int(value) for value in args.concurrency.split(',')]:
+            result = run_level(
+                port, scenarios, mix, level, args.duration, args.seed
+            )
+            results[str(level)] = result
+            print_level(level, result, baseline.get(str(level)))
+    finally:
+        server.shutdown()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as target:
+            json.dump(results, target, ensure_ascii=False, indent=2)
+        print(f'\nБазовые результаты сохранены в {args.save_baseline}')
+    if baseline and args.max_regression is not None:
+        found = regressions(results, baseline, args.max_regression)
+        if found:
+            print('\nУхудшения сверх допустимого:')
+            for line in found:
+                print(f'  {line}')
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Сводные таблицы: агрегат ORM против колоночного снимка в памяти.
+
+    python -m benchmarks.pivot --rows 1000000
+
+Сравниваются сводные «месяц x тип» и «категория x статус» (сумма и число)
+через GROUP BY в БД и через analytics.LedgerSnapshot; отдельно замеряются
+загрузка снимка и догрузка изменений после вставки 1000 записей.
+"""
+from benchmarks.common import (
+    parse_args, seed_cashflows, seed_reference, setup_django, timed
+)
+
+
+def main():
+    args = parse_args(__doc__)
+    setup_django(args.db)
+
+    import datetime
+    from decimal import Decimal
+    from django.db.models import Count, Sum
+    from django.db.models.functions import TruncMonth
+    from cash_flow import analytics
+    from cash_flow.models import CashFlow
+
+    status_ids, hierarchy = seed_reference()
+    seed_cashflows(args.rows, status_ids, hierarchy)
+
+    results = {}
+    rows = args.rows
+    print(f'Строк: {rows:,}, NumPy: {"да" if analytics.numpy else "нет"}')
+    pivots = {
+        'месяц x тип': (('month', 'type'), ('month', 'type_id')),
+        'категория x статус': (('category', 'status'), ('category_id', 'status_id')),
+    }
+    queryset = CashFlow.objects.filter(currency='RUB').annotate(
+        month=TruncMonth('date_created')
+    ).order_by()
+    for label, (_, fields) in pivots.items():
+        with timed(f'ORM: {label}', results, rows):
+            orm = list(queryset.values(*fields).annotate(
+                total=Sum('amount'), count=Count('pk')
+            ))
+        print(f'  групп: {len(orm)}')
+
+    snapshot = analytics.LedgerSnapshot()
+    with timed('Снимок: загрузка', results, rows):
+        snapshot.load()
+    for label, (dimensions, _) in pivots.items():
+        with timed(f'Снимок: {label}', results, rows):
+            groups = snapshot.pivot(dimensions, 'RUB')
+        print(f'  групп: {len(groups)}')
+
+    type_id, category_id, subcategory_id = hierarchy[0]
+    CashFlow.objects.bulk_create([
+        CashFlow(
+            date_created=datetime.date(2024, 1, 1), status_id=status_ids[0],
+            type_id=type_id, category_id=category_id,
+            subcategory_id=subcategory_id, amount=Decimal('1.00'),
+        )
+        for _ in range(1000)
+    ])
+    with timed('Снимок: догрузка 1000 новых записей', results):
+        snapshot.refresh()
+
+    for label in pivots:
+        before = results[f'ORM: {label}']
+        after = results[f'Снимок: {label}']
+        print(f'Ускорение ({label}): x{before / after:.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Сверка банковской выписки (cash_flow.reconciliation) на большой таблице.
+
+    python -m benchmarks.reconcile --rows 1000000 --lines 100000
+
+Учет заполняется записями за 10 лет, выписка — из случайных записей за
+последние дни (сколько нужно на --lines строк): 70% строк совпадают
+точно, 20% — со сдвигом даты до двух дней, 10% не имеют пары. Замеряются
+этапы сверки и назначение статуса сопоставленным.
+"""
+from benchmarks.common import (
+    default_tenant_id, parse_args, seed_cashflows, seed_reference, setup_django, timed
+)
+
+
+def main():
+    args = parse_args(__doc__, lines={'type': int, 'default': 100_000})
+    setup_django(args.db)
+
+    import datetime
+    import io
+    import random
+    from cash_flow import reconciliation
+    from cash_flow.models import CashFlow, Status
+
+    status_ids, hierarchy = seed_reference()
+    seed_cashflows(args.rows, status_ids, hierarchy)
+    tenant_id = default_tenant_id()
+    reconciled = Status.objects.create(name='Сверено', tenant_id=tenant_id).pk
+
+    rng = random.Random(11)
+    # Период выписки — последние дни, в которые набирается lines записей.
+    days = args.lines * 10 * 365 // args.rows + 1
+    since = datetime.date(2025, 1, 1) - datetime.timedelta(days=days)
+    sample = CashFlow.objects.filter(date_created__gte=since).order_by(
+        '?'
+    ).values_list('date_created', 'amount')[:args.lines]
+    out = io.StringIO()
+    out.write('date,amount,currency,description\n')
+    for number, (date, amount) in enumerate(sample):
+        kind = rng.random()
+        if kind >= 0.9:
+            amount += 1
+        elif kind >= 0.7:
+            date += datetime.timedelta(days=rng.choice((-2, -1, 1, 2)))
+        out.write(f'{date.isoformat()},-{amount},RUB,платеж {number}\n')
+    statement = out.getvalue()
+    print(f'Записей: {args.rows:,}, строк выписки: {args.lines:,}')
+
+    results = {}
+    tolerance = reconciliation.DEFAULT_TOLERANCE_DAYS
+    with timed('Разбор выписки', results, args.lines):
+        entries, errors = reconciliation.parse_statement(io.StringIO(statement))
+    with timed('Окно учета (один запрос)', results):
+        ledger = reconciliation.ledger_window(
+            entries, tolerance, reconciled, tenant_id=tenant_id
+        )
+    print(f'  записей в окне: {len(ledger):,}')
+    with timed('Сопоставление', results, args.lines):
+        matches, lines, rows = reconciliation.match(entries, ledger, tolerance)
+    kinds = [kind for _, _, kind in matches]
+    print(
+        f"  точно: {kinds.count('exact'):,}, по дате: {kinds.count('fuzzy'):,}, "
+        f'без пары: {len(lines):,}'
+    )
+    with timed('Назначение статуса', results, len(matches)):
+        reconciliation.mark_matched([pk for _, pk, _ in matches], reconciled)
+    total = sum(results.values())
+    print(f'Итого: {total:.2f} с, {args.lines / total:,.0f} строк выписки/с')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Кеш результатов списка и API (cash_flow.resultcache): время ответа при
+промахе и попадании и доля попаданий при смешанной нагрузке с записью.
+
+    python -m benchmarks.resultcache --rows 1000000 --requests 2000 --write-every 20
+
+Сценарии — частые фильтры: текущий месяц, тип, статус, подкатегория за
+месяц. В смешанной нагрузке каждый --write-every запрос добавляет одну
+запись движения ДС в случайную подкатегорию и месяц, что сбрасывает
+только результаты, которые могли ее включать.
+"""
+import random
+import statistics
+import time
+
+from benchmarks.common import parse_args, seed_cashflows, seed_reference, setup_django
+
+
+def main():
+    args = parse_args(
+        __doc__,
+        requests={'type': int, 'default': 2000},
+        write_every={'type': int, 'default': 20},
+        repeat={'type': int, 'default': 5},
+    )
+    setup_django(args.db)
+
+    import datetime
+    from decimal import Decimal
+    from django.conf import settings
+    from django.core.cache import caches
+    from django.test import Client
+    from cash_flow import metrics, resultcache
+    from cash_flow.models import CashFlow
+
+    settings.ALLOWED_HOSTS = ['*']
+    status_ids, hierarchy = seed_reference()
+    seed_cashflows(args.rows, status_ids, hierarchy)
+    print(f'Строк: {args.rows:,}')
+
+    type_id, category_id, subcategory_id = hierarchy[0]
+    month = {'start_date': '2024-03-01', 'end_date': '2024-03-31'}
+    scenarios = [
+        ('Список: месяц', '/cash_flow/cashflow/', month),
+        ('Список: месяц и тип', '/cash_flow/cashflow/', {**month, 'type': type_id}),
+        ('API: месяц', '/api/cashflows/', month),
+        ('API: тип', '/api/cashflows/', {'type': type_id}),
+        ('API: статус', '/api/cashflows/', {'status': status_ids[0]}),
+        ('API: подкатегория за месяц', '/api/cashflows/',
+         {**month, 'subcategory': subcategory_id}),
+    ]
+    client = Client()
+    cache = caches[settings.CASH_FLOW_RESULT_CACHE]
+
+    def elapsed(path, params):
+        started = time.perf_counter()
+        response = client.get(path, params)
+        assert response.status_code == 200, response.status_code
+        return time.perf_counter() - started
+
+    print(f'{"Сценарий":<30}{"промах, мс":>12}{"попадание, мс":>16}')
+    for label, path, params in scenarios:
+        misses, hits = [], []
+        for _ in range(args.repeat):
+            cache.clear()
+            misses.append(elapsed(path, params))
+            hits.append(elapsed(path, params))
+        print(f'{label:<30}{statistics.median(misses) * 1000:>12.1f}'
+              f'{statistics.median(hits) * 1000:>16.2f}')
+
+    rng = random.Random(1)
+    cache.clear()
+    metrics.reset()
+    started = time.perf_counter()
+    for i in range(args.requests):
+        if args.write_every and i % args.write_every == args.write_every - 1:
+            type_id, category_id, subcategory_id = rng.choice(hierarchy)
+            CashFlow.objects.create(
+                date_created=datetime.date(2015 + rng.randrange(10), rng.randrange(1, 13), 1),
+                status_id=rng.choice(status_ids), type_id=type_id,
+                category_id=category_id, subcategory_id=subcategory_id,
+                amount=Decimal('100.00'),
+            )
+        _, path, params = rng.choice(scenarios)
+        elapsed(path, params)
+    total = time.perf_counter() - started
+    print(f'\nСмешанная нагрузка: {args.requests} запросов, запись каждые '
+          f'{args.write_every}, {total:.1f} с')
+    for scope, ratio in resultcache.hit_ratios().items():
+        print(f'  {scope}: {ratio}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Категоризация по правилам: скомпилированный набор против проверки
+правил по одному и применение правил к истории.
+
+    python -m benchmarks.rules --rows 1000000 --rules 1000
+
+Создается --rules правил с ключевыми словами (каждое десятое — с
+регулярным выражением и диапазоном суммы). Сначала в памяти
+классифицируются --rows комментариев вида банковских строк: уникальных и
+повторяющихся (из 5000 разных), RuleMatcher сравнивается с перебором
+правил по приоритету с поиском подстроки (на десятой части строк). Затем
+apply_rules переназначает категории --rows записям в базе пакетами.
+"""
+import random
+from decimal import Decimal
+
+from benchmarks.common import parse_args, seed_cashflows, seed_reference, setup_django, timed
+
+
+def comment(rng, rules, unique):
+    merchant = f'm{rng.randrange(rules * 2)}x'
+    suffix = f' {rng.randrange(10 ** 6)}' if unique else ''
+    return f'Оплата картой *1234 {merchant} MOSCOW RU{suffix}'
+
+
+def main():
+    args = parse_args(
+        __doc__, default_rows=1_000_000,
+        rules={'type': int, 'default': 1000},
+        batch_size={'type': int, 'default': 2000},
+    )
+    setup_django(args.db)
+
+    from django.db import connection
+    from cash_flow import rules
+    from cash_flow.models import CashFlow, CategorizationRule, Subcategory
+    from benchmarks.common import default_tenant_id
+
+    tenant_id = default_tenant_id()
+    status_ids, hierarchy = seed_reference()
+    subcategories = list(Subcategory.objects.for_tenant(tenant_id))
+    rng = random.Random(7)
+    CategorizationRule.objects.bulk_create([
+        CategorizationRule(
+            tenant_id=tenant_id, name=f'Правило {i}', priority=i,
+            keyword=f'm{i}x', subcategory=rng.choice(subcategories),
+            pattern=r'moscow\s+ru' if i % 10 == 0 else '',
+            min_amount=Decimal('1.00') if i % 10 == 0 else None,
+        )
+        for i in range(args.rules)
+    ])
+    results = {}
+    with timed('Компиляция правил', results):
+        compiled = rules.matcher(tenant_id)
+    ordered = compiled.rules
+    amount = Decimal('100.00')
+
+    def naive(text):
+        lowered = text.lower()
+        for rule in ordered:
+            if rule.keyword.lower() not in lowered:
+                continue
+            if rule.min_amount is not None and amount < rule.min_amount:
+                continue
+            if rule.pattern and rules.re.search(rule.pattern, text, rules.re.IGNORECASE) is None:
+                continue
+            return rule
+        return None
+
+    print(f'Правил: {args.rules}, строк: {args.rows:,}')
+    for unique in (True, False):
+        pool = [comment(rng, args.rules, unique) for _ in range(
+            args.rows if unique else 5000
+        )]
+        texts = pool if unique else [rng.choice(pool) for _ in range(args.rows)]
+        label = 'уникальные' if unique else 'повторяющиеся'
+        compiled._candidates.clear()
+        with timed(f'RuleMatcher, {label}', results, args.rows):
+            matched = sum(compiled.match(text, amount) is not None for text in texts)
+        sample = texts[:args.rows // 10]
+        with timed(f'Перебор правил, {label} (1/10)', results, len(sample)):
+            expected = [naive(text) for text in sample]
+        assert expected == [compiled.match(text, amount) for text in sample]
+        print(f'  совпало: {matched / len(texts):.0%}')
+
+    seed_cashflows(args.rows, status_ids, hierarchy)
+    table = CashFlow._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} SET comment = 'Оплата картой *1234 m' "
+            f"|| (id % {args.rules * 2}) || 'x MOSCOW RU'"
+        )
+        # Без статистики SQLite читает пакеты по индексу организации с
+        # сортировкой, а не по первичному ключу.
+        cursor.execute('ANALYZE')
+    with timed('apply_rules по базе', results, args.rows):
+        result = rules.apply_rules(
+            CashFlow.objects.for_tenant(tenant_id), compiled,
+            batch_size=args.batch_size,
+        )
+    print(f"  проверено: {result['checked']:,}, изменено: {result['changed']:,}")
+
+
+if __name__ == '__main__':
+    main()
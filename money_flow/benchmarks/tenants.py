@@ -0,0 +1,102 @@
+"""
+Время запросов одной организации при росте числа организаций в базе.
+
+    python -m benchmarks.tenants --rows 20000 --tenants 1,10,100
+
+У каждой организации свои справочники и --rows записей. Для каждого
+числа организаций замеряются (медиана по --repeat запросам к случайным
+организациям, кеш результатов выключен) первая страница /api/cashflows/,
+страница за месяц и сумма записей организации за год. В конце те же
+запросы повторяются с прежним индексом (date_created, id) вместо
+cashflow_tenant_date_id_idx: без организации первым полем индекса время
+растет вместе с объемом чужих данных.
+"""
+import random
+import statistics
+import time
+
+from benchmarks.common import parse_args, seed_cashflows, seed_reference, setup_django
+
+
+def main():
+    args = parse_args(
+        __doc__, default_rows=20_000,
+        tenants={'default': '1,10,100'},
+        repeat={'type': int, 'default': 30},
+    )
+    setup_django(args.db)
+
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from django.test import Client
+    from cash_flow.models import CashFlow, Tenant
+
+    settings.ALLOWED_HOSTS = ['*']
+    settings.CASH_FLOW_RESULT_CACHE = None
+    admin = get_user_model().objects.create_superuser('bench')
+    client = Client()
+    client.force_login(admin)
+    rng = random.Random(3)
+    tenant_ids = []
+
+    def add_tenants(count):
+        while len(tenant_ids) < count:
+            tenant = Tenant.objects.get_or_create(
+                pk=settings.CASH_FLOW_DEFAULT_TENANT if not tenant_ids else None,
+                defaults={'name': f'Организация {len(tenant_ids)}'},
+            )[0]
+            status_ids, hierarchy = seed_reference(
+                types=2, categories=5, subcategories=3, tenant_id=tenant.pk
+            )
+            seed_cashflows(
+                args.rows, status_ids, hierarchy, seed=len(tenant_ids),
+                tenant_id=tenant.pk,
+            )
+            tenant_ids.append(tenant.pk)
+
+    def api(tenant_id, params):
+        response = client.get('/api/cashflows/', params, HTTP_X_TENANT=str(tenant_id))
+        assert response.status_code == 200, response.status_code
+
+    def total(tenant_id, params):
+        CashFlow.objects.for_tenant(tenant_id).filter(
+            date_created__range=(params['start_date'], params['end_date'])
+        ).total()
+
+    scenarios = [
+        ('API: первая страница', api, {}),
+        ('API: месяц', api, {'start_date': '2024-03-01', 'end_date': '2024-03-31'}),
+        ('Сумма за год', total, {'start_date': '2024-01-01', 'end_date': '2024-12-31'}),
+    ]
+
+    def measure(label):
+        print(label)
+        for name, run, params in scenarios:
+            timings = []
+            for _ in range(args.repeat):
+                tenant_id = rng.choice(tenant_ids)
+                started = time.perf_counter()
+                run(tenant_id, params)
+                timings.append(time.perf_counter() - started)
+            print(f'  {name:<25}{statistics.median(timings) * 1000:>10.2f} мс')
+
+    counts = [int(value) for value in args.tenants.split(',')]
+    for count in counts:
+        add_tenants(count)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        measure(f'Организаций: {count}, строк: {count * args.rows:,}')
+
+    table = CashFlow._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute('DROP INDEX cashflow_tenant_date_id_idx')
+        cursor.execute(
+            f'CREATE INDEX cashflow_date_id_idx ON {table} (date_created, id)'
+        )
+        cursor.execute('ANALYZE')
+    measure(f'Прежний индекс (date_created, id), организаций: {counts[-1]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Первый запрос после старта процесса: без прогрева и с прогревом
+(cash_flow.warmup).
+
+    python -m benchmarks.warmup --rows 100000 --repeat 5
+
+Каждый замер — новый процесс Python: импорт money_flow.wsgi (с
+CASH_FLOW_WARMUP или без), затем первый и второй запрос к списку, API и
+списку записей в админке под суперпользователем прямо через WSGI-
+приложение, без сети. Печатаются медианы: время старта, первого запроса
+без прогрева и с ним и установившееся время (второй запрос).
+
+С прогревом первые страницы списка и API уже лежат в кеше результатов;
+--no-result-cache выключает кеш, чтобы сравнить только инициализацию.
+"""
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import BASE_DIR, parse_args, seed_cashflows, seed_reference, setup_django
+
+
+PATHS = (
+    ('Список', '/cash_flow/cashflow/'),
+    ('API', '/api/cashflows/'),
+    ('Админка', '/admin/cash_flow/cashflow/'),
+)
+
+
+def child(db, session, warm, result_cache):
+    """Замер в свежем процессе; результат — JSON в stdout."""
+    started = time.perf_counter()
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'money_flow.settings')
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = db
+    settings.DEBUG = False
+    settings.CASH_FLOW_WARMUP = warm
+    if not result_cache:
+        settings.CASH_FLOW_RESULT_CACHE = None
+    from money_flow.wsgi import application
+    startup = time.perf_counter() - started
+
+    def get(path):
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+            'HTTP_HOST': 'localhost', 'HTTP_COOKIE': f'sessionid={session}',
+            'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+        }
+        statuses = []
+        request_started = time.perf_counter()
+        body = application(environ, lambda status, headers: statuses.append(status))
+        b''.join(body)
+        body.close()
+        assert statuses[0].startswith('200'), (path, statuses[0])
+        return time.perf_counter() - request_started
+
+    first = {path: get(path) for _, path in PATHS}
+    second = {path: get(path) for _, path in PATHS}
+    print(json.dumps({'startup': startup, 'first': first, 'second': second}))
+
+
+def measure(db, session, warm, result_cache):
+    command = [
+        sys.executable, '-m', 'benchmarks.warmup', '--child',
+        '--db', db, '--session', session,
+    ]
+    if warm:
+        command.append('--warm')
+    if not result_cache:
+        command.append('--no-result-cache')
+    output = subprocess.run(
+        command, cwd=BASE_DIR, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args(
+        __doc__, default_rows=100_000,
+        repeat={'type': int, 'default': 5},
+        child={'action': 'store_true'},
+        session={'default': ''},
+        warm={'action': 'store_true'},
+        no_result_cache={'action': 'store_true'},
+    )
+    if args.child:
+        child(args.db, args.session, args.warm, not args.no_result_cache)
+        return
+
+    db = setup_django(args.db)
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+
+    status_ids, hierarchy = seed_reference()
+    seed_cashflows(args.rows, status_ids, hierarchy)
+    client = Client()
+    client.force_login(get_user_model().objects.create_superuser('warmup'))
+    session = client.cookies['sessionid'].value
+    result_cache = not args.no_result_cache
+    print(f'Строк: {args.rows:,}, кеш результатов: {"да" if result_cache else "нет"}')
+
+    runs = {False: [], True: []}
+    for _ in range(args.repeat):
+        for warm in runs:
+            runs[warm].append(measure(db, session, warm, result_cache))
+
+    def median(warm, key, path=None):
+        values = [
+            run[key] if path is None else run[key][path] for run in runs[warm]
+        ]
+        return statistics.median(values) * 1000
+
+    print(f'Старт процесса: без прогрева {median(False, "startup"):.0f} мс, '
+          f'с прогревом {median(True, "startup"):.0f} мс')
+    print(f'{"Первый запрос":<16}{"без прогрева":>14}{"с прогревом":>14}'
+          f'{"второй запрос":>16}')
+    for label, path in PATHS:
+        print(f'{label:<16}{median(False, "first", path):>11.1f} мс'
+              f'{median(True, "first", path):>11.1f} мс'
+              f'{median(False, "second", path):>13.1f} мс')
+
+
+if __name__ == '__main__':
+    main()
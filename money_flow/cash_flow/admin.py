@@ -1,40 +1,187 @@
+from django import forms
 from django.contrib import admin
-from .models import Status, Type, Category, Subcategory, CashFlow
+from django.contrib.admin.widgets import AutocompleteSelect
+
+from .models import (
+    Tenant, Status, Type, Category, Subcategory, CashFlow, ExchangeRate,
+    CategorizationRule
+)
+from .paginators import EstimatedCountPaginator
+from .tenancy import TenantAdminMixin
+
+
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    """
+    Фильтр по внешнему ключу с поиском через autocomplete.
+
+    В отличие от стандартного RelatedFieldListFilter не загружает все строки
+    связанной таблицы в боковую панель: выбор выполняется через
+    autocomplete-представление админки, а из БД читается только выбранный
+    объект.
+    """
+    template = 'admin/cash_flow/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.model_admin_site = model_admin.admin_site
+        # Как в TenantRelatedFilter: сотрудник не должен видеть названия
+        # справочников других организаций, подставив их id в адрес.
+        self.tenant_id = model_admin._tenant_id(request)
+        super().__init__(
+            field, request, params, model, model_admin, field_path
+        )
+
+    def field_choices(self, field, request, model_admin):
+        if not self.lookup_val:
+            return []
+        selected = self.related_queryset().filter(pk__in=self.lookup_val)
+        return [(obj.pk, str(obj)) for obj in selected]
+
+    def related_queryset(self):
+        queryset = self.field.remote_field.model._default_manager.all()
+        if self.tenant_id is not None:
+            queryset = queryset.filter(tenant_id=self.tenant_id)
+        return queryset
+
+    def has_output(self):
+        return True
+
+    def get_facet_counts(self, pk_attname, filtered_qs):
+        return {}
+
+    def choices(self, changelist):
+        self.base_query_string = changelist.get_query_string(
+            remove=[self.lookup_kwarg, self.lookup_kwarg_isnull]
+        )
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': self.base_query_string,
+            'display': 'Все',
+        }
+
+    def widget(self):
+        """Отрисовывает select2-виджет с текущим выбранным значением."""
+        form_field = forms.ModelChoiceField(
+            queryset=self.related_queryset(),
+            widget=AutocompleteSelect(
+                self.field, self.model_admin_site,
+                attrs={
+                    'data-autocomplete-filter': self.lookup_kwarg,
+                    'data-base-url': self.base_query_string,
+                    'style': 'width: 100%',
+                },
+            ),
+        )
+        value = self.lookup_val[-1] if self.lookup_val else None
+        return form_field.widget.render(self.lookup_kwarg, value)
+
+
+class TenantRelatedFilter(admin.RelatedFieldListFilter):
+    """
+    Фильтр по справочнику: сотруднику в боковой панели показываются
+    только значения его организации.
+    """
+
+    def field_choices(self, field, request, model_admin):
+        tenant_id = model_admin._tenant_id(request)
+        if tenant_id is None:
+            return super().field_choices(field, request, model_admin)
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        return field.get_choices(
+            include_blank=False, ordering=ordering,
+            limit_choices_to={'tenant_id': tenant_id},
+        )
+
+
+@admin.register(Tenant)
+class TenantAdmin(admin.ModelAdmin):
+    list_display = ('name',)
+    search_fields = ('^name',)
+    filter_horizontal = ('users',)
 
 
 @admin.register(Status)
-class StatusAdmin(admin.ModelAdmin):
+class StatusAdmin(TenantAdminMixin, admin.ModelAdmin):
     list_display = ('name',)
-    search_fields = ('name',)
+    search_fields = ('^name',)
 
 
 @admin.register(Type)
-class TypeAdmin(admin.ModelAdmin):
+class TypeAdmin(TenantAdminMixin, admin.ModelAdmin):
     list_display = ('name',)
-    search_fields = ('name',)
+    search_fields = ('^name',)
 
 
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(TenantAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'type')
-    list_filter = ('type',)
-    search_fields = ('name',)
+    list_filter = (('type', TenantRelatedFilter),)
+    list_select_related = ('type',)
+    search_fields = ('^name',)
 
 
 @admin.register(Subcategory)
-class SubcategoryAdmin(admin.ModelAdmin):
+class SubcategoryAdmin(TenantAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'category')
-    list_filter = ('category', 'category__type')
-    search_fields = ('name',)
+    list_filter = (
+        ('category', TenantRelatedFilter),
+        ('category__type', TenantRelatedFilter),
+    )
+    list_select_related = ('category', 'category__type')
+    search_fields = ('^name',)
 
 
 @admin.register(CashFlow)
-class CashFlowAdmin(admin.ModelAdmin):
+class CashFlowAdmin(TenantAdminMixin, admin.ModelAdmin):
     list_display = (
         'date_created', 'status',
         'type', 'category',
-        'subcategory', 'amount'
+        'subcategory', 'amount', 'currency'
     )
-    list_filter = ('date_created', 'status', 'type', 'category', 'subcategory')
+    list_filter = (
+        'date_created', 'currency',
+        ('status', TenantRelatedFilter),
+        ('type', TenantRelatedFilter),
+        ('category', AutocompleteFilter),
+        ('subcategory', AutocompleteFilter),
+    )
+    # category и subcategory выводятся через __str__, который обращается
+    # к category.type, поэтому подтягиваем всю цепочку одним JOIN.
+    list_select_related = (
+        'status', 'type', 'category__type', 'subcategory__category__type'
+    )
+    autocomplete_fields = ('status', 'type', 'category', 'subcategory')
     search_fields = ('comment',)
     date_hierarchy = 'date_created'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        autocomplete = AutocompleteSelect(
+            CashFlow._meta.get_field('category'), self.admin_site
+        )
+        return (
+            super().media
+            + autocomplete.media
+            + forms.Media(js=['js/admin_autocomplete_filter.js'])
+        )
+
+
+@admin.register(CategorizationRule)
+class CategorizationRuleAdmin(TenantAdminMixin, admin.ModelAdmin):
+    list_display = (
+        'name', 'priority', 'keyword', 'pattern', 'min_amount', 'max_amount',
+        'currency', 'subcategory', 'is_active'
+    )
+    list_editable = ('priority', 'is_active')
+    list_filter = ('is_active', ('subcategory__category', TenantRelatedFilter))
+    list_select_related = ('subcategory__category__type',)
+    autocomplete_fields = ('subcategory',)
+    search_fields = ('name', 'keyword', 'pattern')
+
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('date', 'base_currency', 'quote_currency', 'rate')
+    list_filter = ('base_currency', 'quote_currency')
+    date_hierarchy = 'date'
@@ -0,0 +1,406 @@
+"""
+Колоночный снимок движений ДС в памяти процесса для сводных таблиц.
+
+Снимок хранит по записи только коды: id, порядковый номер даты, номер
+месяца, id справочников, сумму в копейках и индекс валюты — в массивах
+array (около 40 байт на запись). Группировка выполняется векторно через
+NumPy, если он установлен, иначе — циклом по массивам.
+
+Снимок догружает изменения по номерам ленты изменений (change_seq и
+CashFlowTombstone), поэтому после первой загрузки запрос сводной таблицы
+читает из БД только новые строки.
+
+Сводные таблицы API строятся по снимку своей организации (по индексам
+с организацией впереди), поэтому их время не зависит от объема данных
+других организаций. Снимок без организации (tenant_id=None) содержит
+все записи — им пользуется поиск дублей и выбросов.
+"""
+import datetime
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_left
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db.models import BigIntegerField, ExpressionWrapper, F
+
+from .models import CashFlow, CashFlowTombstone, ChangeCounter, Currency
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - зависит от окружения
+    numpy = None
+
+
+DIMENSIONS = ('day', 'month', 'year', 'status', 'type', 'category', 'subcategory')
+REFERENCE_DIMENSIONS = ('status', 'type', 'category', 'subcategory')
+MEASURES = ('sum', 'count', 'avg')
+
+# Доля удаленных записей, после которой снимок перезагружается целиком.
+COMPACT_RATIO = 0.25
+# Группировка через bincount, пока число возможных ключей не больше этого.
+DENSE_KEYS_LIMIT = 1 << 24
+
+CURRENCIES = list(Currency.values)
+
+
+class PivotError(ValueError):
+    """Неверные параметры сводной таблицы."""
+
+
+class LedgerSnapshot:
+    """Колоночная копия таблицы CashFlow (записей организации tenant_id)."""
+
+    load_batch_size = 50000
+
+    def __init__(self, using='default', tenant_id=None):
+        self.using = using
+        self.tenant_id = tenant_id
+        # Удерживается на время обновления и чтения снимка.
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.ids = array('q')
+        self.days = array('i')
+        self.months = array('i')
+        self.status = array('i')
+        self.type = array('i')
+        self.category = array('i')
+        self.subcategory = array('i')
+        self.amounts = array('q')
+        self.currencies = array('b')
+        self.alive = array('b')
+        self.deleted = 0
+        self.last_seq = None
+
+    def __len__(self):
+        return len(self.ids) - self.deleted
+
+    def _queryset(self, model):
+        queryset = model.objects.using(self.using)
+        if self.tenant_id is not None:
+            queryset = queryset.filter(tenant_id=self.tenant_id)
+        return queryset
+
+    def _rows(self):
+        return self._queryset(CashFlow).order_by('pk').annotate(
+            amount_minor=ExpressionWrapper(
+                F('amount'), output_field=BigIntegerField()
+            )
+        ).values_list(
+            'pk', 'date_created', 'status_id', 'type_id', 'category_id',
+            'subcategory_id', 'amount_minor', 'currency'
+        )
+
+    def _current_seq(self):
+        return ChangeCounter.objects.using(self.using).filter(
+            pk=1
+        ).values_list('value', flat=True).first() or 0
+
+    def refresh(self):
+        """
+        Догружает изменения с прошлого обновления. Если счетчик изменений
+        меньше запомненного (база пересоздана) или удаленных записей
+        слишком много, снимок загружается заново.
+        """
+        seq = self._current_seq()
+        if self.last_seq is not None and seq == self.last_seq:
+            return
+        if (self.last_seq is None or seq < self.last_seq
+                or self.deleted > COMPACT_RATIO * max(len(self.ids), 1)):
+            self.load(seq)
+            return
+        rows = self._rows().filter(change_seq__gt=self.last_seq).order_by(
+            'change_seq'
+        )
+        if not all([self._upsert(row) for row in rows]):
+            self.load(seq)
+            return
+        deleted = self._queryset(CashFlowTombstone).filter(
+            seq__gt=self.last_seq
+        ).values_list('object_id', flat=True)
+        for pk in deleted:
+            position = self._position(pk)
+            if position is not None and self.alive[position]:
+                self.alive[position] = 0
+                self.deleted += 1
+        self.last_seq = seq
+
+    def load(self, seq=None):
+        """
+        Загружает таблицу пакетами по ключу. Номер изменений читается до
+        загрузки, поэтому записи, измененные во время нее, будут догружены
+        при следующем refresh.
+        """
+        if seq is None:
+            seq = self._current_seq()
+        self.clear()
+        last_pk = 0
+        while True:
+            batch = list(
+                self._rows().filter(pk__gt=last_pk)[:self.load_batch_size]
+            )
+            if not batch:
+                break
+            for row in batch:
+                self._append(row)
+            last_pk = batch[-1][0]
+        self.last_seq = seq
+
+    def _append(self, row):
+        pk, date, status, type_, category, subcategory, amount, currency = row
+        self.ids.append(pk)
+        self.days.append(date.toordinal())
+        self.months.append(date.year * 12 + date.month - 1)
+        self.status.append(status)
+        self.type.append(type_)
+        self.category.append(category)
+        self.subcategory.append(subcategory)
+        self.amounts.append(amount)
+        self.currencies.append(CURRENCIES.index(currency))
+        self.alive.append(1)
+
+    def _position(self, pk):
+        position = bisect_left(self.ids, pk)
+        if position < len(self.ids) and self.ids[position] == pk:
+            return position
+        return None
+
+    def positions(self, pks):
+        """Позиции в массивах для существующих записей из pks."""
+        result = []
+        for pk in pks:
+            position = self._position(pk)
+            if position is not None and self.alive[position]:
+                result.append(position)
+        return result
+
+    def _upsert(self, row):
+        """
+        Добавляет или обновляет запись. Возвращает False для новой записи
+        с id меньше последнего (явно заданный id): такой случай редок, и
+        снимок проще перезагрузить, чем сдвигать все массивы.
+        """
+        pk = row[0]
+        if not self.ids or pk > self.ids[-1]:
+            self._append(row)
+            return True
+        position = self._position(pk)
+        if position is None:
+            return False
+        _, date, status, type_, category, subcategory, amount, currency = row
+        self.days[position] = date.toordinal()
+        self.months[position] = date.year * 12 + date.month - 1
+        self.status[position] = status
+        self.type[position] = type_
+        self.category[position] = category
+        self.subcategory[position] = subcategory
+        self.amounts[position] = amount
+        self.currencies[position] = CURRENCIES.index(currency)
+        if not self.alive[position]:
+            self.alive[position] = 1
+            self.deleted -= 1
+        return True
+
+    def pivot(self, dimensions, currency, filters=None):
+        """
+        Группирует записи в валюте currency по dimensions (не более двух
+        из DIMENSIONS). filters — {поле справочника: id, 'start_date',
+        'end_date': date}. Возвращает список (ключ, число, сумма в копейках).
+        """
+        filters = filters or {}
+        if not self.ids:
+            return []
+        if numpy is not None:
+            return self._pivot_numpy(dimensions, currency, filters)
+        return self._pivot_python(dimensions, currency, filters)
+
+    def _pivot_numpy(self, dimensions, currency, filters):
+        mask = numpy.frombuffer(self.alive, dtype=numpy.int8).astype(bool)
+        mask &= numpy.frombuffer(self.currencies, dtype=numpy.int8) == (
+            CURRENCIES.index(currency)
+        )
+        days = numpy.frombuffer(self.days, dtype=numpy.int32)
+        if filters.get('start_date'):
+            mask &= days >= filters['start_date'].toordinal()
+        if filters.get('end_date'):
+            mask &= days <= filters['end_date'].toordinal()
+        for field in REFERENCE_DIMENSIONS:
+            if filters.get(field) is not None:
+                column = numpy.frombuffer(getattr(self, field), dtype=numpy.int32)
+                mask &= column == filters[field]
+
+        amounts = numpy.frombuffer(self.amounts, dtype=numpy.int64)[mask]
+        if not len(amounts):
+            return []
+        columns = [self._numpy_column(name, mask) for name in dimensions]
+
+        # Ключ группы — смешанное число из смещенных значений измерений.
+        code = numpy.zeros(len(amounts), dtype=numpy.int64)
+        bases = []
+        size = 1
+        for column in columns:
+            low = int(column.min())
+            span = int(column.max()) - low + 1
+            code = code * span + (column - low)
+            bases.append((low, span))
+            size *= span
+        if size <= DENSE_KEYS_LIMIT:
+            counts = numpy.bincount(code, minlength=size)
+            sums = numpy.bincount(code, weights=amounts, minlength=size)
+            keys = numpy.nonzero(counts)[0]
+            counts, sums = counts[keys], sums[keys]
+        else:
+            keys, inverse = numpy.unique(code, return_inverse=True)
+            counts = numpy.bincount(inverse)
+            sums = numpy.bincount(inverse, weights=amounts)
+
+        result = []
+        for key, count, total in zip(keys.tolist(), counts.tolist(), sums.tolist()):
+            parts = []
+            for low, span in reversed(bases):
+                key, offset = divmod(key, span)
+                parts.append(low + offset)
+            result.append((tuple(reversed(parts)), count, int(round(total))))
+        return result
+
+    def _numpy_column(self, name, mask):
+        """Значения измерения name у отобранных строк (int64)."""
+        source = self.days if name == 'day' else (
+            self.months if name in ('month', 'year') else getattr(self, name)
+        )
+        column = numpy.frombuffer(source, dtype=numpy.int32)[mask].astype(
+            numpy.int64
+        )
+        return column // 12 if name == 'year' else column
+
+    def _pivot_python(self, dimensions, currency, filters):
+        code = CURRENCIES.index(currency)
+        start = filters.get('start_date')
+        end = filters.get('end_date')
+        start = start.toordinal() if start else None
+        end = end.toordinal() if end else None
+        selected = [
+            (getattr(self, field), filters[field])
+            for field in REFERENCE_DIMENSIONS
+            if filters.get(field) is not None
+        ]
+        sources = {'day': self.days, 'month': self.months, 'year': self.months}
+        columns = [
+            sources[name] if name in sources else getattr(self, name)
+            for name in dimensions
+        ]
+        groups = {}
+        for i in range(len(self.ids)):
+            if not self.alive[i] or self.currencies[i] != code:
+                continue
+            if start is not None and self.days[i] < start:
+                continue
+            if end is not None and self.days[i] > end:
+                continue
+            if any(column[i] != value for column, value in selected):
+                continue
+            key = tuple(
+                column[i] // 12 if name == 'year' else column[i]
+                for name, column in zip(dimensions, columns)
+            )
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [1, self.amounts[i]]
+            else:
+                group[0] += 1
+                group[1] += self.amounts[i]
+        return [
+            (key, count, total)
+            for key, (count, total) in sorted(groups.items())
+        ]
+
+
+# Снимки по (база, организация) от давно использованных к недавним;
+# _lock защищает только сам словарь.
+_snapshots = OrderedDict()
+_lock = threading.Lock()
+
+
+def pivot(dimensions, measure='sum', currency=Currency.RUB, filters=None,
+          using='default', tenant_id=None):
+    """
+    Сводная таблица по снимку базы using (записей организации tenant_id):
+    обновляет снимок и возвращает ячейки
+    [{'key': [...], 'count': n, 'value': Decimal или int}].
+    """
+    dimensions = list(dimensions)
+    if not 1 <= len(dimensions) <= 2:
+        raise PivotError('Нужно одно или два измерения.')
+    unknown = [name for name in dimensions if name not in DIMENSIONS]
+    if unknown:
+        raise PivotError(f'Неизвестное измерение: {", ".join(unknown)}.')
+    if measure not in MEASURES:
+        raise PivotError(f'Неизвестная мера: {measure}.')
+    if currency not in CURRENCIES:
+        raise PivotError(f'Неизвестная валюта: {currency}.')
+
+    with current_snapshot(using, tenant_id) as snapshot:
+        groups = snapshot.pivot(dimensions, currency, filters)
+        as_of = snapshot.last_seq
+
+    amount_field = CashFlow._meta.get_field('amount')
+    cells = []
+    for key, count, total in groups:
+        if measure == 'count':
+            value = count
+        elif measure == 'sum':
+            value = amount_field.from_minor(total)
+        else:
+            value = amount_field.from_minor(
+                (Decimal(total) / count).to_integral_value(ROUND_HALF_UP)
+            )
+        cells.append({
+            'key': [_label(name, part) for name, part in zip(dimensions, key)],
+            'count': count,
+            'value': value,
+        })
+    return {'as_of': as_of, 'cells': cells}
+
+
+@contextmanager
+def current_snapshot(using='default', tenant_id=None):
+    """
+    Обновленный снимок базы using (записей организации tenant_id или всех
+    записей). Снимок общий для процесса, поэтому читать его можно только
+    внутри блока with, пока удерживается его блокировка; снимки других
+    организаций в это время доступны.
+
+    В памяти держится не больше CASH_FLOW_SNAPSHOT_LIMIT снимков: давно не
+    использованные вытесняются и при следующем запросе загружаются заново.
+    """
+    key = (using, tenant_id)
+    limit = getattr(settings, 'CASH_FLOW_SNAPSHOT_LIMIT', 16)
+    with _lock:
+        snapshot = _snapshots.get(key)
+        if snapshot is None:
+            snapshot = _snapshots[key] = LedgerSnapshot(using, tenant_id)
+        _snapshots.move_to_end(key)
+        while len(_snapshots) > limit:
+            _snapshots.popitem(last=False)
+    with snapshot.lock:
+        snapshot.refresh()
+        yield snapshot
+
+
+def _label(dimension, value):
+    if dimension == 'day':
+        return datetime.date.fromordinal(value).isoformat()
+    if dimension == 'month':
+        year, month = divmod(value, 12)
+        return f'{year:04d}-{month + 1:02d}'
+    return value
+
+
+def reset_snapshots():
+    """Сбрасывает снимки всех баз (нужно, например, между тестами)."""
+    with _lock:
+        _snapshots.clear()
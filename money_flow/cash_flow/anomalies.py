@@ -0,0 +1,342 @@
+"""
+Поиск возможных дублей и необычных сумм среди движений ДС.
+
+Записи не сравниваются попарно: поиск идет по колоночному снимку
+analytics.LedgerSnapshot с сортировкой и группировкой (векторно через
+NumPy, если он установлен).
+
+- Дубли: записи сортируются по (подкатегория, валюта, сумма, дата, id);
+  запись и до DUPLICATE_MAX_LAG предшествующих ей с теми же
+  подкатегорией, валютой и суммой и датой не дальше window_days дней —
+  кандидаты. Комментарии читаются из БД только для кандидатов; пустой
+  комментарий дублю не противоречит. Дублем отмечается более поздняя
+  запись пары, исходной — самая похожая из предшествующих.
+- Выбросы: по каждой паре (категория, валюта) считаются медиана и MAD
+  сумм, запись отмечается, если модифицированная z-оценка
+  (x - медиана) / (MAD / 0.6745) по модулю больше OUTLIER_THRESHOLD.
+
+Поиск инкрементальный: проверяются только записи, измененные после номера
+since (change_seq), их прежние отметки заменяются. Статистика выбросов
+при этом считается по всем записям снимка.
+
+Поиск выполняется по записям одной организации (tenant_id) или, без нее,
+по всем записям базы (команда detect_anomalies).
+"""
+import statistics
+from difflib import SequenceMatcher
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from . import analytics, resultcache
+from .analytics import numpy
+from .models import CashFlow, CashFlowFlag, CashFlowTombstone
+
+
+DUPLICATE_WINDOW_DAYS = 3
+# Сколько предшествующих записей с тем же ключом сравнивается с записью.
+DUPLICATE_MAX_LAG = 5
+COMMENT_SIMILARITY = 0.8
+OUTLIER_THRESHOLD = 3.5
+# Меньшие группы не проверяются на выбросы: медиана по ним ненадежна.
+OUTLIER_MIN_GROUP = 10
+BATCH_SIZE = 500
+
+# Множители, приводящие MAD и среднее отклонение к оценке сигмы.
+MAD_SCALE = 0.6745
+MEAN_AD_SCALE = 1.253314
+
+
+def normalize_comment(comment):
+    return ' '.join((comment or '').lower().split())
+
+
+def comment_similarity(first, second):
+    """Сходство комментариев от 0 до 1; пустой комментарий похож на любой."""
+    first, second = normalize_comment(first), normalize_comment(second)
+    if not first or not second or first == second:
+        return 1.0
+    return SequenceMatcher(None, first, second).ratio()
+
+
+def _batches(values, size=BATCH_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def duplicate_pairs(snapshot, positions=None, window_days=DUPLICATE_WINDOW_DAYS):
+    """
+    Пары (id исходной записи, id возможного дубля) с одинаковыми
+    подкатегорией, валютой и суммой. positions — позиции проверяемых
+    записей в снимке (None — все записи): в пару должна входить хотя бы одна.
+    """
+    if numpy is not None:
+        return _duplicate_pairs_numpy(snapshot, positions, window_days)
+    return _duplicate_pairs_python(snapshot, positions, window_days)
+
+
+def _duplicate_pairs_numpy(snapshot, positions, window_days):
+    ids = numpy.frombuffer(snapshot.ids, dtype=numpy.int64)
+    days = numpy.frombuffer(snapshot.days, dtype=numpy.int32)
+    subcategory = numpy.frombuffer(snapshot.subcategory, dtype=numpy.int32)
+    amounts = numpy.frombuffer(snapshot.amounts, dtype=numpy.int64)
+    currencies = numpy.frombuffer(snapshot.currencies, dtype=numpy.int8)
+    mask = numpy.frombuffer(snapshot.alive, dtype=numpy.int8).astype(bool)
+    checked = None
+    if positions is not None:
+        if not positions:
+            return []
+        checked = numpy.zeros(len(ids), dtype=bool)
+        checked[positions] = True
+        # Кандидаты в пару к проверяемым — только с их суммами и датами.
+        mask &= numpy.isin(amounts, numpy.unique(amounts[checked]))
+        mask &= days >= days[checked].min() - window_days
+        mask &= days <= days[checked].max() + window_days
+
+    rows = numpy.nonzero(mask)[0]
+    order = rows[numpy.lexsort((
+        ids[rows], days[rows], amounts[rows], currencies[rows], subcategory[rows]
+    ))]
+    pairs = []
+    for lag in range(1, DUPLICATE_MAX_LAG + 1):
+        first, second = order[:-lag], order[lag:]
+        same = (
+            (subcategory[first] == subcategory[second])
+            & (currencies[first] == currencies[second])
+            & (amounts[first] == amounts[second])
+            & (days[second] - days[first] <= window_days)
+        )
+        # Если пар нет на этом сдвиге, на больших их тоже нет.
+        if not same.any():
+            break
+        if checked is not None:
+            same &= checked[first] | checked[second]
+        pairs.extend(zip(ids[first[same]].tolist(), ids[second[same]].tolist()))
+    return pairs
+
+
+def _duplicate_pairs_python(snapshot, positions, window_days):
+    rows = [i for i in range(len(snapshot.ids)) if snapshot.alive[i]]
+    checked = None
+    if positions is not None:
+        if not positions:
+            return []
+        checked = set(positions)
+        amounts = {snapshot.amounts[i] for i in checked}
+        low = min(snapshot.days[i] for i in checked) - window_days
+        high = max(snapshot.days[i] for i in checked) + window_days
+        rows = [
+            i for i in rows
+            if snapshot.amounts[i] in amounts
+            and low <= snapshot.days[i] <= high
+        ]
+
+    def key(i):
+        return (snapshot.subcategory[i], snapshot.currencies[i],
+                snapshot.amounts[i], snapshot.days[i], snapshot.ids[i])
+
+    rows.sort(key=key)
+    pairs = []
+    for index, second in enumerate(rows):
+        for first in reversed(rows[max(index - DUPLICATE_MAX_LAG, 0):index]):
+            if key(first)[:3] != key(second)[:3]:
+                break
+            if snapshot.days[second] - snapshot.days[first] > window_days:
+                break
+            if checked is None or first in checked or second in checked:
+                pairs.append((snapshot.ids[first], snapshot.ids[second]))
+    return pairs
+
+
+def outliers(snapshot, positions=None, threshold=OUTLIER_THRESHOLD,
+             min_group=OUTLIER_MIN_GROUP):
+    """
+    Записи с необычной суммой для своей категории и валюты: список
+    (id, z-оценка). positions — как в duplicate_pairs.
+    """
+    if positions is not None and not positions:
+        return []
+    if numpy is not None:
+        return _outliers_numpy(snapshot, positions, threshold, min_group)
+    return _outliers_python(snapshot, positions, threshold, min_group)
+
+
+def _outliers_numpy(snapshot, positions, threshold, min_group):
+    ids = numpy.frombuffer(snapshot.ids, dtype=numpy.int64)
+    amounts = numpy.frombuffer(snapshot.amounts, dtype=numpy.int64)
+    codes = numpy.frombuffer(snapshot.category, dtype=numpy.int32).astype(
+        numpy.int64
+    ) * 256 + numpy.frombuffer(snapshot.currencies, dtype=numpy.int8)
+    rows = numpy.nonzero(numpy.frombuffer(snapshot.alive, dtype=numpy.int8))[0]
+    checked = None
+    if positions is not None:
+        checked = numpy.zeros(len(ids), dtype=bool)
+        checked[positions] = True
+        # Статистика нужна только группам, где есть проверяемые записи.
+        rows = rows[numpy.isin(codes[rows], numpy.unique(codes[checked]))]
+    if not len(rows):
+        return []
+
+    # Одна сортировка по коду группы, медианы — через numpy.median
+    # (частичная сортировка внутри группы).
+    rows = rows[numpy.argsort(codes[rows], kind='stable')]
+    bounds = numpy.nonzero(numpy.diff(codes[rows]))[0] + 1
+    result = []
+    for group in numpy.split(rows, bounds):
+        if len(group) < min_group:
+            continue
+        values = amounts[group].astype(numpy.float64)
+        median = numpy.median(values)
+        deviation = numpy.abs(values - median)
+        mad = numpy.median(deviation)
+        scale = mad / MAD_SCALE if mad else MEAN_AD_SCALE * deviation.mean()
+        if not scale:
+            continue
+        scores = (values - median) / scale
+        flagged = numpy.abs(scores) > threshold
+        if checked is not None:
+            flagged &= checked[group]
+        result.extend(zip(ids[group[flagged]].tolist(), scores[flagged].tolist()))
+    return result
+
+
+def _outliers_python(snapshot, positions, threshold, min_group):
+    checked = set(positions) if positions is not None else None
+    groups = {}
+    for i in range(len(snapshot.ids)):
+        if snapshot.alive[i]:
+            key = (snapshot.category[i], snapshot.currencies[i])
+            groups.setdefault(key, []).append(i)
+    if checked is not None:
+        keys = {(snapshot.category[i], snapshot.currencies[i]) for i in checked}
+        groups = {key: rows for key, rows in groups.items() if key in keys}
+
+    result = []
+    for rows in groups.values():
+        if len(rows) < min_group:
+            continue
+        values = [snapshot.amounts[i] for i in rows]
+        median = statistics.median(values)
+        deviations = [abs(value - median) for value in values]
+        mad = statistics.median(deviations)
+        if mad:
+            scale = mad / MAD_SCALE
+        else:
+            scale = MEAN_AD_SCALE * sum(deviations) / len(deviations)
+        if not scale:
+            continue
+        for i, value in zip(rows, values):
+            if checked is not None and i not in checked:
+                continue
+            score = (value - median) / scale
+            if abs(score) > threshold:
+                result.append((snapshot.ids[i], score))
+    return result
+
+
+def similar_duplicates(pairs, using='default'):
+    """
+    Оставляет пары с похожими комментариями и для каждого дубля — самую
+    похожую исходную запись: список (id дубля, id исходной записи, сходство).
+    """
+    comments = {}
+    ids = sorted({pk for pair in pairs for pk in pair})
+    for batch in _batches(ids):
+        comments.update(
+            CashFlow.objects.using(using).filter(pk__in=batch).values_list(
+                'pk', 'comment'
+            )
+        )
+    best = {}
+    for original, duplicate in pairs:
+        similarity = comment_similarity(
+            comments.get(original), comments.get(duplicate)
+        )
+        if similarity < COMMENT_SIMILARITY:
+            continue
+        if duplicate not in best or similarity > best[duplicate][1]:
+            best[duplicate] = (original, similarity)
+    return [
+        (duplicate, original, similarity)
+        for duplicate, (original, similarity) in best.items()
+    ]
+
+
+def detect(since=0, window_days=DUPLICATE_WINDOW_DAYS, using='default',
+           tenant_id=None):
+    """
+    Ищет дубли и выбросы среди записей организации tenant_id (None — всех
+    записей) с change_seq > since (при since=0 — среди всех) и сохраняет
+    отметки CashFlowFlag. Возвращает номер изменений, до которого
+    проверены записи (since для следующего запуска), и число проверенных
+    записей и найденных отметок.
+    """
+    cashflows = CashFlow.objects.using(using)
+    tombstones = CashFlowTombstone.objects.using(using)
+    if tenant_id is not None:
+        cashflows = cashflows.filter(tenant_id=tenant_id)
+        tombstones = tombstones.filter(tenant_id=tenant_id)
+    with analytics.current_snapshot(using, tenant_id=tenant_id) as snapshot:
+        last_seq = snapshot.last_seq
+        checked_ids = None
+        deleted_ids = []
+        positions = None
+        if since:
+            checked_ids = list(
+                cashflows.filter(
+                    change_seq__gt=since, change_seq__lte=last_seq
+                ).values_list('pk', flat=True)
+            )
+            deleted_ids = list(
+                tombstones.filter(
+                    seq__gt=since, seq__lte=last_seq
+                ).values_list('object_id', flat=True)
+            )
+            positions = snapshot.positions(checked_ids)
+        pairs = duplicate_pairs(snapshot, positions, window_days)
+        outlier_scores = outliers(snapshot, positions)
+        checked = len(snapshot) if positions is None else len(positions)
+
+    duplicates = similar_duplicates(pairs, using)
+    flags = [
+        CashFlowFlag(
+            cashflow_id=duplicate, kind=CashFlowFlag.Kind.DUPLICATE,
+            related_id=original, score=similarity,
+        )
+        for duplicate, original, similarity in duplicates
+    ] + [
+        CashFlowFlag(
+            cashflow_id=pk, kind=CashFlowFlag.Kind.OUTLIER, score=score
+        )
+        for pk, score in outlier_scores
+    ]
+    with transaction.atomic(using=using):
+        existing = CashFlowFlag.objects.using(using)
+        if checked_ids is None and tenant_id is None:
+            existing.all().delete()
+        elif checked_ids is None:
+            # Отметки записей организации и удаленных записей.
+            existing.filter(cashflow__tenant_id=tenant_id).delete()
+            existing.filter(
+                ~Exists(CashFlow.objects.filter(pk=OuterRef('cashflow_id')))
+            ).delete()
+        else:
+            # Отметки проверенных и удаленных записей и дубли, указывающие
+            # на них, заменяются новыми.
+            for batch in _batches(checked_ids + deleted_ids):
+                existing.filter(cashflow_id__in=batch).delete()
+                existing.filter(related_id__in=batch).delete()
+        # Конфликт возможен только с отметкой непроверенной записи,
+        # найденной раньше по полным данным, — она сохраняется.
+        existing.bulk_create(flags, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        scope = 'flag' if tenant_id is None else f't{tenant_id}:flag'
+        transaction.on_commit(
+            lambda: resultcache.invalidate(scope), using=using
+        )
+    return {
+        'last_seq': last_seq,
+        'checked': checked,
+        'duplicates': len(duplicates),
+        'outliers': len(outlier_scores),
+    }
@@ -1,14 +1,37 @@
-from rest_framework import viewsets, filters
+import datetime
+import json
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from rest_framework import mixins, status, viewsets, filters
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from django_filters import rest_framework as django_filters
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Status, Type, Category, Subcategory, CashFlow
+from .models import (
+    Status, Type, Category, Subcategory, CashFlow, CashFlowFlag,
+    CashFlowQuerySet, CashFlowTombstone, Currency, Job, Attachment,
+    CategorizationRule, reporting_currency
+)
+from . import analytics, attachments, resultcache
+from .guardrails import GuardedViewSetMixin
+from .jobs import cancel_job, submit_job
+from .tenancy import TenantViewSetMixin
 from .serializers import (
     StatusSerializer, TypeSerializer,
     CategorySerializer, SubcategorySerializer,
-    CashFlowSerializer
+    CashFlowSerializer, CashFlowFlagSerializer, JobSerializer,
+    AttachmentSerializer, AttachmentUploadSerializer,
+    CategorizationRuleSerializer
 )
 
 
-class StatusViewSet(viewsets.ModelViewSet):
+class StatusViewSet(TenantViewSetMixin, viewsets.ModelViewSet):
     """
     API для управления статусами.
 
@@ -26,7 +49,7 @@ class StatusViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name']
 
 
-class TypeViewSet(viewsets.ModelViewSet):
+class TypeViewSet(TenantViewSetMixin, viewsets.ModelViewSet):
     """
     API для управления типами движения денежных средств.
 
@@ -44,7 +67,7 @@ class TypeViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name']
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(TenantViewSetMixin, viewsets.ModelViewSet):
     """
     API для управления категориями.
 
@@ -62,7 +85,7 @@ class CategoryViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name', 'type__name']
 
 
-class SubcategoryViewSet(viewsets.ModelViewSet):
+class SubcategoryViewSet(TenantViewSetMixin, viewsets.ModelViewSet):
     """
     API для управления подкатегориями.
 
@@ -82,14 +105,71 @@ class SubcategoryViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name', 'category__name']
 
 
-class CashFlowViewSet(viewsets.ModelViewSet):
+class CategorizationRuleViewSet(TenantViewSetMixin, viewsets.ModelViewSet):
+    """
+    API для управления правилами автоматической категоризации (см. rules).
+
+    Поддерживает стандартные CRUD-операции; правила возвращаются в
+    порядке применения (по приоритету).
+    """
+    queryset = CategorizationRule.objects.select_related(
+        'subcategory__category__type'
+    ).all()
+    serializer_class = CategorizationRuleSerializer
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    filterset_fields = ['subcategory', 'is_active']
+    search_fields = ['name', 'keyword', 'pattern']
+
+
+class CashFlowFilter(django_filters.FilterSet):
+    """
+    Фильтры списка движений ДС; start_date и end_date задают период
+    (включительно), flag отбирает записи с отметкой (duplicate —
+    возможный дубль, outlier — необычная сумма).
+    """
+    start_date = django_filters.DateFilter(
+        field_name='date_created', lookup_expr='gte'
+    )
+    end_date = django_filters.DateFilter(
+        field_name='date_created', lookup_expr='lte'
+    )
+    flag = django_filters.ChoiceFilter(
+        field_name='flags__kind', choices=CashFlowFlag.Kind.choices
+    )
+
+    class Meta:
+        model = CashFlow
+        fields = [
+            'date_created', 'status', 'type',
+            'category', 'subcategory'
+        ]
+
+
+class CashFlowViewSet(TenantViewSetMixin, GuardedViewSetMixin,
+                      viewsets.ModelViewSet):
     """
     API для управления движением денежных средств.
 
     Поддерживает стандартные CRUD-операции и расширенную фильтрацию.
+    Сортировки без индекса и поиск допускаются только для короткого
+    периода, время запросов ограничено (см. guardrails).
+
+    Все справочники и ресурсы API ограничены текущей организацией
+    (см. tenancy).
+
+    POST /api/cashflows/ принимает и список записей (до bulk_max_size):
+    пакет проверяется целиком и создается одним bulk_create. Записям без
+    подкатегории категории назначаются по правилам (см. rules).
+
+    Вложения (см. attachments):
+    - GET /api/cashflows/{id}/attachments/ - вложения записи
+    - POST /api/cashflows/{id}/attachments/ - загрузить файл (поле file)
+    - GET /api/cashflows/{id}/attachments/{attachment_id}/ - скачать
+      (поддерживается Range; ?download=1 - как файл)
+    - DELETE /api/cashflows/{id}/attachments/{attachment_id}/ - удалить
     """
     queryset = CashFlow.objects.select_related(
-        'status', 'type', 'category', 'subcategory'
+        'status', 'type', 'category__type', 'subcategory__category__type'
     ).all()
     serializer_class = CashFlowSerializer
     filter_backends = [
@@ -97,12 +177,361 @@ class CashFlowViewSet(viewsets.ModelViewSet):
         filters.SearchFilter,
         filters.OrderingFilter
     ]
-    filterset_fields = [
-        'date_created', 'status', 'type',
-        'category', 'subcategory'
-    ]
+    filterset_class = CashFlowFilter
     search_fields = ['comment']
     ordering_fields = [
         'date_created', 'status__name', 'type__name',
         'category__name', 'subcategory__name', 'amount'
     ]
+    guarded_actions = ('list', 'totals', 'flags')
+    changes_page_size = 500
+    changes_max_page_size = 5000
+    bulk_max_size = 1000
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Файлы вложений пишутся на диск частями с подсчетом хеша; задать
+        # обработчики можно только до разбора тела запроса.
+        request.upload_handlers = attachments.upload_handlers(request)
+        return super().initialize_request(request, *args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+        if len(request.data) > self.bulk_max_size:
+            raise ValidationError(
+                f'Не больше {self.bulk_max_size} записей за запрос.'
+            )
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def _int_param(self, name, default, minimum=0):
+        value = self.request.query_params.get(name, default)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({name: 'Ожидается целое число.'})
+        if value < minimum:
+            raise ValidationError({name: f'Значение должно быть не меньше {minimum}.'})
+        return value
+
+    def list(self, request, *args, **kwargs):
+        """
+        Список записей. С facets=1 ответ дополняется блоком facets —
+        числом записей и суммами по статусам, типам, категориям и
+        подкатегориям для текущих фильтров.
+
+        Ответы кешируются (см. resultcache); фасеты считаются по всем
+        значениям справочников, поэтому с ними область кеша сужает только
+        период.
+        """
+        facets = request.query_params.get('facets') in ('1', 'true')
+        key, data = resultcache.lookup(request, 'api', resultcache.dependencies(
+            request.query_params, self.tenant_id, fk_scoped=not facets
+        ))
+        if data is not None:
+            return Response(data)
+        response = super().list(request, *args, **kwargs)
+        if facets:
+            response.data['facets'] = self.get_facets()
+        if key is not None:
+            resultcache.store(key, json.loads(JSONRenderer().render(response.data)))
+        return response
+
+    def get_facets(self):
+        """
+        Фасеты одним групповым запросом (CashFlowQuerySet.facets).
+
+        Фильтры по полям фасетов не применяются к выборке, а передаются
+        в facets как выбранные значения; остальные фильтры и поиск
+        применяются как в списке.
+        """
+        params = self.request.query_params.copy()
+        for field in CashFlowQuerySet.facet_fields:
+            params.pop(field, None)
+        queryset = self.get_queryset()
+        backend = DjangoFilterBackend()
+        filterset = backend.get_filterset_class(self, queryset)(
+            params, queryset=queryset, request=self.request
+        )
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        queryset = filters.SearchFilter().filter_queryset(
+            self.request, filterset.qs, self
+        )
+        facets = queryset.facets(self.request.query_params)
+        return {
+            field: [
+                {
+                    'id': pk,
+                    'count': bucket['count'],
+                    'amounts': {
+                        currency: str(amount)
+                        for currency, amount in bucket['amounts'].items()
+                    },
+                }
+                for pk, bucket in sorted(buckets.items())
+            ]
+            for field, buckets in facets.items()
+        }
+
+    @action(detail=False, methods=['get'])
+    def totals(self, request):
+        """
+        Итоги по отфильтрованной выборке в валюте отчетности.
+
+        GET /api/cashflows/totals/?currency=USD&<фильтры списка> возвращает
+        общий итог и итоги по типам; суммы пересчитываются по курсу на дату
+        записи в SQL. missing — число записей, для которых нет курса.
+        """
+        currency = request.query_params.get('currency') or reporting_currency()
+        if currency not in Currency.values:
+            raise ValidationError({'currency': 'Неизвестная валюта.'})
+        queryset = self.filter_queryset(self.get_queryset())
+        total = queryset.converted_total(currency)
+        by_type = queryset.converted_totals_by('type__name', currency=currency)
+        return Response({
+            'currency': currency,
+            'total': str(total['total']),
+            'missing': total['missing'],
+            'by_type': [
+                {
+                    'type_name': row['type__name'],
+                    'total': str(row['total'] or 0),
+                    'count': row['count'],
+                    'missing': row['missing'],
+                }
+                for row in by_type
+            ],
+        })
+
+    @action(detail=False, methods=['get'])
+    def pivot(self, request):
+        """
+        Сводная таблица по колоночному снимку в памяти (см. analytics).
+
+        GET /api/cashflows/pivot/?rows=month&columns=type&measure=sum
+        группирует записи в валюте currency (по умолчанию валюта
+        отчетности) по одному или двум измерениям: day, month, year,
+        status, type, category, subcategory. Мера — sum, count или avg.
+        Фильтры: status, type, category, subcategory, start_date, end_date.
+        """
+        params = request.query_params
+        dimensions = [
+            params[name] for name in ('rows', 'columns') if params.get(name)
+        ]
+        filters = {}
+        for field in analytics.REFERENCE_DIMENSIONS:
+            if params.get(field):
+                filters[field] = self._int_param(field, None, minimum=1)
+        for field in ('start_date', 'end_date'):
+            if params.get(field):
+                try:
+                    filters[field] = datetime.date.fromisoformat(params[field])
+                except ValueError:
+                    raise ValidationError({field: 'Ожидается дата ГГГГ-ММ-ДД.'})
+        try:
+            result = analytics.pivot(
+                dimensions,
+                measure=params.get('measure', 'sum'),
+                currency=params.get('currency') or reporting_currency(),
+                filters=filters,
+                tenant_id=self.tenant_id,
+            )
+        except analytics.PivotError as error:
+            raise ValidationError({'detail': str(error)})
+
+        labels = {}
+        for position, name in enumerate(dimensions):
+            if name in analytics.REFERENCE_DIMENSIONS:
+                model = CashFlow._meta.get_field(name).related_model
+                ids = {cell['key'][position] for cell in result['cells']}
+                labels[name] = dict(
+                    model.objects.filter(pk__in=ids).values_list('pk', 'name')
+                )
+        return Response({
+            'dimensions': dimensions,
+            'measure': params.get('measure', 'sum'),
+            'as_of': result['as_of'],
+            'labels': labels,
+            'cells': [
+                {**cell, 'value': str(cell['value'])}
+                for cell in result['cells']
+            ],
+        })
+
+    @action(detail=False, methods=['get'])
+    def flags(self, request):
+        """
+        Отметки о возможных дублях и необычных суммах (задача detect).
+
+        GET /api/cashflows/flags/?kind=duplicate&<фильтры списка> — отметки
+        отфильтрованных записей с оценкой и id исходной записи дубля.
+        """
+        kind = request.query_params.get('kind')
+        if kind and kind not in CashFlowFlag.Kind.values:
+            raise ValidationError({'kind': 'Неизвестный вид отметки.'})
+        flags = CashFlowFlag.objects.filter(
+            cashflow__in=self.filter_queryset(self.get_queryset()).values('pk')
+        ).order_by('-cashflow_id', 'kind')
+        if kind:
+            flags = flags.filter(kind=kind)
+        page = self.paginate_queryset(flags)
+        return self.get_paginated_response(
+            CashFlowFlagSerializer(page, many=True).data
+        )
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Лента изменений для инкрементальной синхронизации.
+
+        GET /api/cashflows/changes/?since=<token>&limit=<n> возвращает
+        вставки и изменения (op=upsert) и удаления (op=delete) с номером
+        больше since в порядке номера. Значение next передается как since
+        в следующем запросе; has_more показывает, что страница не последняя.
+        """
+        since = self._int_param('since', 0)
+        limit = min(
+            self._int_param('limit', self.changes_page_size, minimum=1),
+            self.changes_max_page_size
+        )
+
+        rows = self.get_queryset().filter(
+            change_seq__gt=since
+        ).order_by('change_seq')[:limit + 1]
+        tombstones = CashFlowTombstone.objects.filter(
+            tenant_id=self.tenant_id, seq__gt=since
+        ).order_by('seq')[:limit + 1]
+
+        changes = [
+            (row.change_seq, 'upsert', row.pk, row) for row in rows
+        ] + [
+            (tombstone.seq, 'delete', tombstone.object_id, None)
+            for tombstone in tombstones
+        ]
+        changes.sort(key=lambda change: change[0])
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        serializer = self.get_serializer(
+            [row for _, _, _, row in changes if row is not None], many=True
+        )
+        data = iter(serializer.data)
+        return Response({
+            'since': since,
+            'next': changes[-1][0] if changes else since,
+            'has_more': has_more,
+            'changes': [
+                {
+                    'seq': seq,
+                    'op': op,
+                    'id': pk,
+                    'data': next(data) if row is not None else None,
+                }
+                for seq, op, pk, row in changes
+            ],
+        })
+
+    @action(detail=True, methods=['get', 'post'])
+    def attachments(self, request, pk=None):
+        """Вложения записи; POST загружает новое (поле file)."""
+        cashflow = self.get_object()
+        if request.method == 'POST':
+            upload = AttachmentUploadSerializer(data=request.data)
+            upload.is_valid(raise_exception=True)
+            attachment = attachments.store(
+                cashflow, upload.validated_data['file']
+            )
+            return Response(
+                AttachmentSerializer(attachment).data,
+                status=status.HTTP_201_CREATED
+            )
+        queryset = Attachment.objects.for_tenant(self.tenant_id).filter(
+            cashflow=cashflow
+        ).select_related('file')
+        return Response(AttachmentSerializer(queryset, many=True).data)
+
+    @action(
+        detail=True, methods=['get', 'delete'],
+        url_path=r'attachments/(?P<attachment_id>\d+)', url_name='attachment'
+    )
+    def attachment(self, request, pk=None, attachment_id=None):
+        """Содержимое вложения (с поддержкой Range) или его удаление."""
+        attachment = get_object_or_404(
+            Attachment.objects.for_tenant(self.tenant_id).select_related('file'),
+            pk=attachment_id, cashflow_id=pk
+        )
+        if request.method == 'DELETE':
+            attachment.delete()
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return attachments.file_response(
+            request, attachment,
+            as_attachment=request.query_params.get('download') in ('1', 'true')
+        )
+
+
+class JobViewSet(TenantViewSetMixin,
+                 mixins.CreateModelMixin,
+                 mixins.RetrieveModelMixin,
+                 mixins.ListModelMixin,
+                 viewsets.GenericViewSet):
+    """
+    API фоновых задач (экспорт, импорт, отчеты, сверка с выпиской).
+
+    - POST /api/jobs/ - создать задачу (kind, params; для импорта и
+      сверки - файл в поле file). С inline=true задача выполняется сразу в запросе.
+    - GET /api/jobs/{id}/ - состояние и прогресс задачи
+    - POST /api/jobs/{id}/cancel/ - отменить задачу
+    - GET /api/jobs/{id}/download/ - скачать файл результата
+
+    Задачи и их данные ограничены текущей организацией.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = dict(serializer.validated_data.get('params') or {})
+        kind = serializer.validated_data['kind']
+        if kind in (Job.Kind.IMPORT, Job.Kind.RECONCILE):
+            upload = request.FILES.get('file')
+            if upload is None:
+                raise ValidationError(
+                    {'file': 'Для импорта и сверки нужен CSV-файл.'}
+                )
+            params['path'] = self._store_upload(upload)
+        inline = str(request.data.get('inline', '')).lower() in ('1', 'true')
+        job = submit_job(kind, params, inline=inline, tenant_id=self.tenant_id)
+        return Response(
+            self.get_serializer(job).data, status=status.HTTP_201_CREATED
+        )
+
+    def _store_upload(self, upload):
+        """Сохраняет загруженный файл по частям и возвращает путь от MEDIA_ROOT."""
+        relative = f'jobs/uploads/{uuid.uuid4().hex}.csv'
+        path = Path(settings.MEDIA_ROOT) / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as out:
+            for chunk in upload.chunks():
+                out.write(chunk)
+        return relative
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        job = cancel_job(self.get_object())
+        return Response(self.get_serializer(job).data)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.state != Job.State.DONE or not job.result_file:
+            raise Http404('Файл результата недоступен.')
+        path = Path(settings.MEDIA_ROOT) / job.result_file
+        if not path.is_file():
+            raise Http404('Файл результата удален.')
+        return FileResponse(
+            open(path, 'rb'), as_attachment=True, filename=path.name
+        )
@@ -1,7 +1,8 @@
 from rest_framework.routers import DefaultRouter
 from .api import (
     StatusViewSet, TypeViewSet, CategoryViewSet,
-    SubcategoryViewSet, CashFlowViewSet
+    SubcategoryViewSet, CashFlowViewSet, JobViewSet,
+    CategorizationRuleViewSet
 )
 
 router = DefaultRouter()
@@ -10,5 +11,7 @@ router.register(r'types', TypeViewSet)
 router.register(r'categories', CategoryViewSet)
 router.register(r'subcategories', SubcategoryViewSet)
 router.register(r'cashflows', CashFlowViewSet)
+router.register(r'jobs', JobViewSet)
+router.register(r'rules', CategorizationRuleViewSet)
 
 urlpatterns = router.urls
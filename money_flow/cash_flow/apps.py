@@ -1,6 +1,30 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+
+
+def enable_sqlite_wal(sender, connection, **kwargs):
+    """
+    Включает WAL для SQLite: читатели (выгрузки, отчеты) не блокируют
+    запись из веб-процессов и воркеров фоновых задач.
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
 
 
 class CashFlowConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cash_flow'
+
+    def ready(self):
+        from . import events, resultcache
+
+        connection_created.connect(enable_sqlite_wal)
+        events.listeners.append(resultcache.event_committed)
+        # События об изменениях справочников; для CashFlow они публикуются
+        # из save/delete и массовых операций CashFlowQuerySet.
+        for name in ('Status', 'Type', 'Category', 'Subcategory'):
+            model = self.get_model(name)
+            post_save.connect(events.reference_saved, sender=model)
+            post_delete.connect(events.reference_deleted, sender=model)
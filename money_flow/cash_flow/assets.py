@@ -0,0 +1,269 @@
+"""
+Статика интерфейса: имена с хешем содержимого, сжатие при collectstatic и
+отдача с заголовками кеширования.
+
+PrecompressedManifestStaticFilesStorage после обычной обработки
+ManifestStaticFilesStorage (имена вида bootstrap.min.3f2a1c9e0b7d.css,
+ссылки url() в CSS переписаны на такие же имена) кладет рядом с текстовыми
+файлами сжатые копии .gz и, если установлен пакет brotli, .br.
+
+StaticAssetsMiddleware отдает файлы из STATIC_ROOT без обращения к
+представлениям:
+- файлам с хешем в имени — Cache-Control на год с immutable, браузер
+  больше не спрашивает их до смены имени;
+- остальным — ETag и Last-Modified с no-cache, повторный запрос получает
+  304 без тела;
+- сжатую копию, если клиент принимает br или gzip (Vary: Accept-Encoding).
+
+При DEBUG статику отдает runserver из исходных каталогов, и в шаблонах
+остаются имена без хеша.
+"""
+import gzip
+import mimetypes
+import os
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import (
+    ManifestStaticFilesStorage, staticfiles_storage
+)
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - зависит от окружения
+    brotli = None
+
+
+COMPRESS_EXTENSIONS = (
+    '.css', '.js', '.json', '.svg', '.txt', '.html', '.xml', '.ttf', '.eot', '.ico',
+)
+# Файлы меньше этого размера не сжимаются: выигрыш меньше заголовков.
+COMPRESS_MIN_SIZE = 512
+# Сжатая копия сохраняется, только если она меньше этой доли исходника.
+COMPRESS_MAX_RATIO = 0.95
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Порядок предпочтения: кодировка, расширение копии.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+TEXT_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data, quality=11)
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage, который сжимает собранные файлы. До
+    первого collectstatic (манифеста нет) ссылки ведут на исходные имена.
+    """
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            if self.hashed_files:
+                raise
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            for encoding, suffix in self.compressed_variants(name):
+                yield name, name + suffix, True
+
+    def compressed_variants(self, name):
+        """
+        Пишет сжатые копии файла name, если их еще нет или исходник
+        новее. Возвращает записанные (кодировка, расширение).
+        """
+        if not name.endswith(COMPRESS_EXTENSIONS) or not self.exists(name):
+            return []
+        path = self.path(name)
+        mtime = os.path.getmtime(path)
+        data = None
+        written = []
+        for encoding, suffix in ENCODINGS:
+            if encoding == 'br' and brotli is None:
+                continue
+            target = path + suffix
+            if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+                continue
+            if data is None:
+                with open(path, 'rb') as source:
+                    data = source.read()
+                if len(data) < COMPRESS_MIN_SIZE:
+                    return []
+            compressed = compress(data, encoding)
+            if len(compressed) >= len(data) * COMPRESS_MAX_RATIO:
+                continue
+            with open(target, 'wb') as out:
+                out.write(compressed)
+            written.append((encoding, suffix))
+        return written
+
+
+@dataclass
+class Asset:
+    path: str
+    size: int
+    mtime: int
+    content_type: str
+    immutable: bool
+    # {кодировка: (путь, размер)}
+    variants: dict = field(default_factory=dict)
+
+    def etag(self, encoding=None):
+        suffix = f'-{encoding}' if encoding else ''
+        return f'"{self.mtime:x}-{self.size:x}{suffix}"'
+
+
+def content_type(name):
+    guessed, _ = mimetypes.guess_type(name)
+    guessed = guessed or 'application/octet-stream'
+    if guessed.startswith(TEXT_TYPES):
+        return f'{guessed}; charset=utf-8'
+    return guessed
+
+
+def scan(root, hashed_names=()):
+    """Индекс файлов каталога root: {имя относительно root: Asset}."""
+    hashed_names = set(hashed_names)
+    assets = {}
+    suffixes = tuple(suffix for _, suffix in ENCODINGS)
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            if filename.endswith(suffixes):
+                continue
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            stat = os.stat(path)
+            asset = Asset(
+                path=path,
+                size=stat.st_size,
+                mtime=int(stat.st_mtime),
+                content_type=content_type(name),
+                immutable=name in hashed_names,
+            )
+            for encoding, suffix in ENCODINGS:
+                if os.path.exists(path + suffix):
+                    asset.variants[encoding] = (
+                        path + suffix, os.path.getsize(path + suffix)
+                    )
+            assets[name] = asset
+    return assets
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding с ненулевым q."""
+    accepted = set()
+    for item in header.split(','):
+        token, _, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if token:
+            accepted.add(token.lower())
+    return accepted
+
+
+class StaticAssetsMiddleware:
+    """
+    Отдает собранную статику (см. модуль). Ставится сразу после
+    SecurityMiddleware, чтобы запросы статики не проходили сессии и
+    аутентификацию. Без STATIC_ROOT на диске пропускает все запросы дальше.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = urlsplit(settings.STATIC_URL or '').path
+        self.assets = None
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    async def __acall__(self, request):
+        response = self.serve(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.serve(request)
+        if response is None:
+            response = self.get_response(request)
+        return response
+
+    def index(self):
+        # При DEBUG файлы могут меняться между запросами, индекс не хранится.
+        if self.assets is None or settings.DEBUG:
+            root = settings.STATIC_ROOT
+            if not root or not os.path.isdir(root):
+                return {}
+            hashed = getattr(staticfiles_storage, 'hashed_files', {}).values()
+            self.assets = scan(root, hashed)
+        return self.assets
+
+    def serve(self, request):
+        if (not self.prefix or not request.path.startswith(self.prefix)
+                or request.method not in ('GET', 'HEAD')):
+            return None
+        asset = self.index().get(request.path[len(self.prefix):])
+        if asset is None:
+            return None
+
+        encoding = None
+        path, size = asset.path, asset.size
+        if asset.variants:
+            accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            for name, _ in ENCODINGS:
+                if name in asset.variants and name in accepted:
+                    encoding = name
+                    path, size = asset.variants[name]
+                    break
+
+        etag = asset.etag(encoding)
+        if self.not_modified(request, etag, asset.mtime):
+            response = HttpResponseNotModified()
+        elif request.method == 'HEAD':
+            response = HttpResponse(content_type=asset.content_type)
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=asset.content_type)
+            response.headers.pop('Content-Disposition', None)
+        if response.status_code == 200:
+            response['Content-Length'] = size
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(asset.mtime)
+        if asset.variants:
+            response['Vary'] = 'Accept-Encoding'
+        if asset.immutable:
+            response['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        else:
+            response['Cache-Control'] = 'no-cache'
+        return response
+
+    def not_modified(self, request, etag, mtime):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')]
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return since is not None and mtime <= since
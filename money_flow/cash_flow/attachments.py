@@ -0,0 +1,376 @@
+"""
+Вложения записей движения ДС: хранение по содержимому, загрузка и отдача
+без чтения файлов в память.
+
+Хранение. Содержимое лежит в CASH_FLOW_ATTACHMENTS_ROOT по пути
+<sha[:2]>/<sha[2:4]>/<sha> (StoredFile), вложение (Attachment) ссылается
+на него, поэтому один и тот же счет, загруженный несколько раз, хранится
+однажды.
+
+Загрузка. HashingUploadHandler пишет файл частями по chunk_size во
+временный файл в том же каталоге и одновременно считает SHA-256; затем
+файл атомарно переименовывается в путь по хешу или, если такое
+содержимое уже есть, удаляется. Память не зависит от размера файла.
+Обработчик нужно установить до разбора тела запроса (upload_handlers).
+
+Отдача. Весь файл — FileResponse (сервер может отдать его через
+sendfile/wsgi.file_wrapper), диапазон (Range: bytes=...) — 206 с чтением
+из отображения файла в память (mmap) блоками. ETag — хеш содержимого,
+If-None-Match дает 304, If-Range с другим ETag — весь файл.
+
+Очистка. Вложения удаленных записей и файлы без вложений удаляет
+collect_garbage() (manage.py collect_attachments). Файл удаляется, только
+если он не использовался дольше GC_GRACE_SECONDS: повторная загрузка
+обновляет время изменения файла, и параллельная загрузка того же
+содержимого не теряет его. Файл переносится в хранилище до фиксации
+транзакции со StoredFile, поэтому после отката (или падения процесса)
+на диске остаются файлы без строки; их, как и брошенные временные
+файлы загрузок, collect_garbage() находит обходом каталога.
+"""
+import hashlib
+import mimetypes
+import mmap
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+from django.db.models import Exists, OuterRef, ProtectedError
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+from .models import Attachment, CashFlow, StoredFile
+
+
+CHUNK_SIZE = 64 * 2 ** 10
+GC_GRACE_SECONDS = 60 * 60
+# Типы, которые можно показывать в браузере; остальные отдаются
+# как application/octet-stream для скачивания.
+INLINE_TYPES = (
+    'application/pdf', 'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+)
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+TEMP_DIR = 'tmp'
+SWEEP_BATCH_SIZE = 500
+
+
+def attachments_root():
+    return Path(getattr(
+        settings, 'CASH_FLOW_ATTACHMENTS_ROOT',
+        Path(settings.MEDIA_ROOT) / 'attachments'
+    ))
+
+
+def max_size():
+    return getattr(settings, 'CASH_FLOW_ATTACHMENT_MAX_SIZE', 50 * 2 ** 20)
+
+
+def file_path(digest):
+    return attachments_root() / digest[:2] / digest[2:4] / digest
+
+
+def _temp_dir():
+    path = attachments_root() / TEMP_DIR
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+class HashedUploadedFile(UploadedFile):
+    """
+    Загруженный файл во временном файле рядом с хранилищем; digest —
+    SHA-256 содержимого, too_large — файл превысил предел, и его хвост
+    не сохранен.
+    """
+
+    def __init__(self, name, content_type, charset=None, content_type_extra=None):
+        file = tempfile.NamedTemporaryFile(suffix='.upload', dir=_temp_dir())
+        super().__init__(file, name, content_type, 0, charset, content_type_extra)
+        self.hasher = hashlib.sha256()
+        self.digest = None
+        self.too_large = False
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def append(self, data):
+        if self.size + len(data) > max_size():
+            self.too_large = True
+        if not self.too_large:
+            self.file.write(data)
+            self.hasher.update(data)
+        self.size += len(data)
+
+    def finish(self):
+        self.file.flush()
+        self.file.seek(0)
+        self.digest = self.hasher.hexdigest()
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # Файл уже перенесен в хранилище.
+            pass
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Пишет файлы запроса на диск частями и считает их SHA-256."""
+    chunk_size = CHUNK_SIZE
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(
+            self.file_name, self.content_type, self.charset,
+            self.content_type_extra,
+        )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.append(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.finish()
+        return self.file
+
+    def upload_interrupted(self):
+        if getattr(self, 'file', None) is not None:
+            self.file.close()
+
+
+def upload_handlers(request):
+    """Обработчики загрузки для request.upload_handlers (до чтения тела)."""
+    return [HashingUploadHandler(request)]
+
+
+def validate_upload(upload):
+    """Валидатор поля файла формы и сериализатора: пустой или большой файл."""
+    if upload.size == 0:
+        raise ValidationError('Файл пуст.')
+    if getattr(upload, 'too_large', False) or upload.size > max_size():
+        raise ValidationError(
+            f'Файл больше {max_size() // 2 ** 20} МБ.'
+        )
+
+
+def _hashed(upload):
+    """Файл, загруженный другими обработчиками, — в HashedUploadedFile."""
+    if isinstance(upload, HashedUploadedFile):
+        return upload
+    hashed = HashedUploadedFile(
+        upload.name, upload.content_type, upload.charset,
+        upload.content_type_extra,
+    )
+    for chunk in upload.chunks(CHUNK_SIZE):
+        hashed.append(chunk)
+    hashed.finish()
+    return hashed
+
+
+def store(cashflow, upload):
+    """
+    Сохраняет загруженный файл как вложение записи cashflow (в ее
+    организации). Содержимое, которое уже есть, повторно не сохраняется.
+    """
+    upload = _hashed(upload)
+    path = file_path(upload.digest)
+    content_type = (
+        upload.content_type or mimetypes.guess_type(upload.name)[0]
+        or 'application/octet-stream'
+    )
+    with transaction.atomic():
+        stored, _ = StoredFile.objects.get_or_create(
+            digest=upload.digest, defaults={'size': upload.size}
+        )
+        if path.exists():
+            # Свежее время изменения защищает файл от collect_garbage().
+            os.utime(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.fsync(upload.file.fileno())
+            os.replace(upload.temporary_file_path(), path)
+        attachment = Attachment.objects.create(
+            cashflow=cashflow, tenant_id=cashflow.tenant_id, file=stored,
+            name=upload.name, content_type=content_type[:100],
+        )
+    upload.close()
+    return attachment
+
+
+def parse_range(header, size):
+    """
+    Диапазон (start, end) включительно из заголовка Range. None — отдать
+    весь файл (заголовка нет, он некорректен или диапазонов несколько),
+    ValueError — диапазон за пределами файла (416).
+    """
+    match = RANGE_RE.match((header or '').replace(' ', ''))
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = size - 1 if not last else min(int(last), size - 1)
+        if last and int(last) < start:
+            return None
+    else:
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError(header)
+        start, end = max(size - suffix, 0), size - 1
+    if start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def _mapped_range(path, start, end, block_size=CHUNK_SIZE):
+    with open(path, 'rb') as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for offset in range(start, end + 1, block_size):
+            yield mapped[offset:min(offset + block_size, end + 1)]
+
+
+def file_response(request, attachment, as_attachment=False):
+    """Ответ с содержимым вложения (весь файл или диапазон, см. модуль)."""
+    stored = attachment.file
+    etag = f'"{stored.digest}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    content_type = attachment.content_type
+    if content_type not in INLINE_TYPES:
+        content_type, as_attachment = 'application/octet-stream', True
+    path = file_path(stored.digest)
+    byte_range = None
+    if request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), stored.size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stored.size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(
+            open(path, 'rb'), content_type=content_type,
+            as_attachment=as_attachment, filename=attachment.name,
+        )
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _mapped_range(path, start, end), status=206,
+            content_type=content_type,
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{stored.size}'
+        response['Content-Disposition'] = content_disposition_header(
+            as_attachment, attachment.name
+        )
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private'
+    return response
+
+
+def _unlink_if_stale(path, cutoff):
+    """Удаляет файл, не изменявшийся с cutoff; возвращает его размер или None."""
+    try:
+        stat = path.stat()
+        if stat.st_mtime > cutoff:
+            return None
+        path.unlink()
+    except FileNotFoundError:
+        return None
+    return stat.st_size
+
+
+def _disk_files():
+    """
+    Файлы каталога хранилища: (путь, digest) для содержимого и
+    (путь, None) для временных файлов загрузок.
+    """
+    root = attachments_root()
+    temp = root / TEMP_DIR
+    if temp.is_dir():
+        for path in temp.iterdir():
+            yield path, None
+    for path in root.glob('??/??/*'):
+        if DIGEST_RE.match(path.name):
+            yield path, path.name
+
+
+def _sweep(cutoff):
+    """
+    Удаляет файлы без строки StoredFile и временные файлы, не
+    изменявшиеся с cutoff. Возвращает их число и объем.
+    """
+    files = freed = 0
+
+    def remove(batch):
+        nonlocal files, freed
+        known = set(StoredFile.objects.filter(
+            digest__in=[digest for _, digest in batch if digest]
+        ).values_list('digest', flat=True))
+        for path, digest in batch:
+            if digest in known:
+                continue
+            size = _unlink_if_stale(path, cutoff)
+            if size is not None:
+                files += 1
+                freed += size
+
+    batch = []
+    for path, digest in _disk_files():
+        batch.append((path, digest))
+        if len(batch) >= SWEEP_BATCH_SIZE:
+            remove(batch)
+            batch = []
+    if batch:
+        remove(batch)
+    return files, freed
+
+
+def collect_garbage(grace_seconds=GC_GRACE_SECONDS):
+    """
+    Удаляет вложения удаленных записей, файлы без вложений и файлы на
+    диске без строки StoredFile (см. модуль), не использованные дольше
+    grace_seconds. Возвращает число удаленных вложений, файлов и
+    освобожденных байт.
+    """
+    orphans = Attachment.objects.filter(
+        ~Exists(CashFlow.objects.filter(pk=OuterRef('cashflow_id')))
+    )
+    attachments, _ = orphans.delete()
+    unused = StoredFile.objects.filter(
+        ~Exists(Attachment.objects.filter(file=OuterRef('pk')))
+    )
+    cutoff = time.time() - grace_seconds
+    files = freed = 0
+    for stored in unused.iterator():
+        path = file_path(stored.digest)
+        try:
+            if path.stat().st_mtime > cutoff:
+                continue
+        except FileNotFoundError:
+            pass
+        try:
+            with transaction.atomic():
+                deleted, _ = unused.filter(pk=stored.pk).delete()
+        except ProtectedError:
+            # Файл только что снова загрузили.
+            continue
+        if deleted:
+            path.unlink(missing_ok=True)
+            files += 1
+            freed += stored.size
+    swept, swept_bytes = _sweep(cutoff)
+    return {
+        'attachments': attachments, 'files': files + swept,
+        'bytes': freed + swept_bytes,
+    }
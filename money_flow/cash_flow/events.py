@@ -0,0 +1,274 @@
+"""
+Рассылка событий об изменениях движений ДС и справочников (SSE).
+
+Событие формируется и сериализуется один раз при фиксации транзакции.
+Брокер передает его в каждый event loop, где есть подписчики, одним
+вызовом call_soon_threadsafe, а там оно раскладывается по очередям
+подписчиков с учетом их фильтров. Запросов к БД на подписчика нет.
+
+Подписчик получает события только своей организации, в том числе
+события массовых операций (по одному на каждую затронутую организацию,
+без данных записей). События без организации получают только подписки
+без организации.
+
+Рассылка работает внутри процесса: при нескольких процессах ASGI-сервера
+подписчик получает события только о записях, сделанных в его процессе.
+"""
+import asyncio
+import json
+import threading
+from functools import partial
+
+from django.db import transaction
+
+
+# Поля фильтров подписки, как в фильтрах списка движений ДС.
+FILTER_FIELDS = ('status', 'type', 'category', 'subcategory')
+MODELS = ('cashflow', 'status', 'type', 'category', 'subcategory')
+
+OVERFLOW = object()
+
+
+class Event:
+    """
+    Событие: сериализованный текст и поля для фильтрации подписок;
+    tenant — организация записей (None — событие без организации, его
+    получают только подписки без организации).
+    """
+
+    __slots__ = ('model', 'op', 'seq', 'payload', 'states', 'tenant')
+
+    def __init__(self, model, op, data, seq=None, states=(), tenant=None):
+        self.model = model
+        self.op = op
+        self.seq = seq
+        self.states = states
+        self.tenant = tenant
+        self.payload = json.dumps(
+            {'model': model, 'op': op, 'seq': seq, **data},
+            ensure_ascii=False, separators=(',', ':'),
+        )
+
+    def encode(self):
+        """Событие в формате text/event-stream."""
+        lines = [f'event: {self.model}.{self.op}', f'data: {self.payload}']
+        if self.seq is not None:
+            lines.insert(0, f'id: {self.seq}')
+        return '\n'.join(lines) + '\n\n'
+
+
+class Subscription:
+    """
+    Подписка с ограниченной очередью. Если клиент не успевает читать и
+    очередь заполняется, подписка закрывается: клиент переподключается и
+    догружает пропущенное через ленту изменений.
+    """
+
+    def __init__(self, filters=None, models=None, queue_size=1000, tenant=None):
+        self.filters = {
+            field: value for field, value in (filters or {}).items() if value
+        }
+        self.models = set(models or MODELS)
+        self.tenant = tenant
+        self.queue = asyncio.Queue(queue_size)
+        self.closed = False
+
+    def matches(self, event):
+        if event.model not in self.models:
+            return False
+        if self.tenant is not None and event.tenant != self.tenant:
+            return False
+        if event.model != 'cashflow' or not event.states:
+            # События справочников и массовых изменений не фильтруются.
+            return True
+        return any(self._matches_state(state) for state in event.states)
+
+    def _matches_state(self, state):
+        for field, value in self.filters.items():
+            if field == 'start_date':
+                if state['date_created'] < value:
+                    return False
+            elif field == 'end_date':
+                if state['date_created'] > value:
+                    return False
+            elif state[field] != value:
+                return False
+        return True
+
+    def put(self, event):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.closed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+
+class EventBroker:
+    """Подписчики, сгруппированные по event loop, в котором они читают."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loops = {}
+
+    def subscribe(self, filters=None, models=None, queue_size=1000, tenant=None):
+        """
+        Создает подписку в текущем event loop: на события организации
+        tenant или, если он не задан, всех организаций (в том числе
+        событий без организации).
+        """
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(filters, models, queue_size, tenant)
+        with self._lock:
+            self._loops.setdefault(loop, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for loop, subscriptions in list(self._loops.items()):
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._loops[loop]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._loops.values())
+
+    def publish(self, event):
+        """Передает событие в event loop'ы подписчиков; потокобезопасен."""
+        with self._lock:
+            loops = list(self._loops)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._dispatch, loop, event)
+            except RuntimeError:
+                # Event loop закрыт, его подписки больше не читаются.
+                with self._lock:
+                    self._loops.pop(loop, None)
+
+    def _dispatch(self, loop, event):
+        with self._lock:
+            subscriptions = list(self._loops.get(loop, ()))
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                subscription.put(event)
+
+
+broker = EventBroker()
+
+
+class EventStream:
+    """
+    Тело ответа text/event-stream для подписки. Django вызывает close()
+    по завершении ответа или отключении клиента — подписка снимается.
+    """
+
+    def __init__(self, subscription, heartbeat=15):
+        self.subscription = subscription
+        self.heartbeat = heartbeat
+
+    def __aiter__(self):
+        return self._stream()
+
+    async def _stream(self):
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        self.subscription.queue.get(), self.heartbeat
+                    )
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                if event is OVERFLOW:
+                    yield 'event: overflow\ndata: {}\n\n'
+                    return
+                yield event.encode()
+        finally:
+            self.close()
+
+    def close(self):
+        broker.unsubscribe(self.subscription)
+
+
+# Синхронные обработчики событий (например, сброс кеша результатов);
+# вызываются после фиксации в потоке, сделавшем изменение.
+listeners = []
+
+
+def publish(event):
+    """Передает событие обработчикам listeners и подписчикам брокера."""
+    for listener in listeners:
+        listener(event)
+    broker.publish(event)
+
+
+def publish_on_commit(event, using='default'):
+    """Публикует событие после фиксации текущей транзакции."""
+    transaction.on_commit(partial(publish, event), using=using)
+
+
+def cashflow_state(values):
+    """Значения полей фильтров для проверки подписок."""
+    return {
+        'date_created': values['date_created'],
+        **{field: values[f'{field}_id'] for field in FILTER_FIELDS},
+    }
+
+
+def cashflow_event(instance, op, previous=None, seq=None):
+    """
+    Событие о записи движения ДС. previous — значения полей фильтров до
+    изменения: запись, ушедшая из фильтра подписки, тоже попадет к ней.
+    """
+    state = cashflow_state({
+        'date_created': str(instance.date_created),
+        **{f'{field}_id': getattr(instance, f'{field}_id') for field in FILTER_FIELDS},
+    })
+    states = (state,)
+    if previous and previous != state:
+        states = (state, previous)
+    data = {'id': instance.pk}
+    if op != 'delete':
+        data.update(state)
+        data.update({
+            'amount': str(instance.amount),
+            'currency': instance.currency,
+            'comment': instance.comment,
+        })
+    return Event(
+        'cashflow', op, data, seq=seq or instance.change_seq, states=states,
+        tenant=instance.tenant_id,
+    )
+
+
+def bulk_event(op, since, last, tenant=None):
+    """
+    Событие о массовом изменении записей организации tenant без
+    перечисления строк: клиент догружает изменения через
+    /api/cashflows/changes/?since=<since>.
+    """
+    return Event('cashflow', op, {'since': since}, seq=last, tenant=tenant)
+
+
+def reference_event(instance, op):
+    """Событие об изменении справочника (статуса, типа, категории...)."""
+    data = {'id': instance.pk, 'name': instance.name}
+    for parent in ('type', 'category'):
+        if hasattr(instance, f'{parent}_id'):
+            data[parent] = getattr(instance, f'{parent}_id')
+    return Event(instance._meta.model_name, op, data, tenant=instance.tenant_id)
+
+
+def reference_saved(sender, instance, created, using, **kwargs):
+    publish_on_commit(
+        reference_event(instance, 'create' if created else 'update'), using
+    )
+
+
+def reference_deleted(sender, instance, using, **kwargs):
+    publish_on_commit(reference_event(instance, 'delete'), using)
@@ -0,0 +1,56 @@
+import csv
+
+from .models import reporting_currency
+
+
+EXPORT_HEADER = [
+    'id', 'date_created', 'status', 'type', 'category', 'subcategory',
+    'amount', 'currency', 'converted_amount', 'reporting_currency', 'comment',
+]
+
+
+class _Echo:
+    """Псевдобуфер для csv.writer: write возвращает строку без накопления."""
+
+    def write(self, value):
+        return value
+
+
+def export_queryset(queryset, currency):
+    """Добавляет к queryset справочники и сумму в валюте отчетности."""
+    return queryset.select_related(
+        'status', 'type', 'category', 'subcategory'
+    ).with_converted_amount(currency)
+
+
+def export_row(cashflow, currency):
+    """Строка CSV для записи из export_queryset."""
+    return [
+        cashflow.pk,
+        cashflow.date_created.isoformat(),
+        cashflow.status.name,
+        cashflow.type.name,
+        cashflow.category.name,
+        cashflow.subcategory.name,
+        cashflow.amount,
+        cashflow.currency,
+        '' if cashflow.converted_amount is None else cashflow.converted_amount,
+        currency,
+        cashflow.comment or '',
+    ]
+
+
+def iter_cashflows_csv(queryset, currency=None, chunk_size=2000):
+    """
+    Построчно формирует CSV с записями queryset.
+
+    Пересчет в валюту отчетности выполняется в том же SQL-запросе
+    (with_converted_amount), а строки читаются итератором по chunk_size,
+    поэтому выгрузка не держит всю выборку в памяти.
+    """
+    currency = currency or reporting_currency()
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_HEADER)
+    queryset = export_queryset(queryset, currency)
+    for cashflow in queryset.iterator(chunk_size=chunk_size):
+        yield writer.writerow(export_row(cashflow, currency))
@@ -0,0 +1,100 @@
+from decimal import Decimal, InvalidOperation
+
+from django import forms
+from django.core import exceptions
+from django.db import models
+
+
+class MoneyField(models.BigIntegerField):
+    """
+    Денежная сумма, которая хранится в БД целым числом минимальных единиц
+    (копеек), а в Python, формах и сериализаторах представлена Decimal.
+
+    Значения в фильтрах и при сохранении задаются в рублях и переводятся
+    в копейки в get_prep_value, поэтому SUM/MIN/MAX и сравнения выполняются
+    над целыми числами. Выражения вида F('amount') * 2 и Avg('amount')
+    работают с копейками.
+    """
+    description = "Денежная сумма в минимальных единицах"
+
+    def __init__(self, *args, decimal_places=2, max_digits=17, **kwargs):
+        self.decimal_places = decimal_places
+        self.max_digits = max_digits
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.decimal_places != 2:
+            kwargs['decimal_places'] = self.decimal_places
+        if self.max_digits != 17:
+            kwargs['max_digits'] = self.max_digits
+        return name, path, args, kwargs
+
+    def from_minor(self, value):
+        """Переводит целое число копеек в Decimal."""
+        return Decimal(value).scaleb(-self.decimal_places)
+
+    def to_minor(self, value):
+        """
+        Переводит сумму в рублях в целое число копеек без потерь. Суммы
+        длиннее max_digits цифр, NaN и бесконечность — ValidationError:
+        иначе они дошли бы до БД и не поместились бы в BIGINT.
+        """
+        minor = self.to_python(value).scaleb(self.decimal_places)
+        if not minor.is_finite():
+            raise exceptions.ValidationError(
+                self.error_messages['invalid'],
+                code='invalid',
+                params={'value': value},
+            )
+        if minor != minor.to_integral_value():
+            raise exceptions.ValidationError(
+                f'Допускается не более {self.decimal_places} знаков '
+                f'после запятой.',
+                code='invalid',
+            )
+        if abs(minor) >= 10 ** self.max_digits:
+            raise exceptions.ValidationError(
+                f'Допускается не более {self.max_digits} цифр.',
+                code='max_digits',
+            )
+        return int(minor)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return self.from_minor(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        try:
+            if isinstance(value, float):
+                return Decimal(repr(value))
+            return Decimal(value)
+        except (InvalidOperation, TypeError, ValueError):
+            raise exceptions.ValidationError(
+                self.error_messages['invalid'],
+                code='invalid',
+                params={'value': value},
+            )
+
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return self.to_minor(value)
+
+    def formfield(self, **kwargs):
+        return super(models.IntegerField, self).formfield(**{
+            'form_class': forms.DecimalField,
+            'max_digits': self.max_digits,
+            'decimal_places': self.decimal_places,
+            **kwargs,
+        })
+
+    @property
+    def validators(self):
+        # Границы BIGINT относятся к копейкам: их заменяет проверка
+        # max_digits в to_minor, а здесь остаются только пользовательские
+        # валидаторы.
+        return list(self._validators)
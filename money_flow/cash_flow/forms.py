@@ -1,11 +1,19 @@
 from django import forms
-from .models import CashFlow, Status, Type, Category, Subcategory
+from . import rules
+from .attachments import validate_upload
+from .models import (
+    CashFlow, CashFlowFlag, Status, Type, Category, Subcategory
+)
+from .tenancy import TenantFormMixin
 import datetime
+from urllib.parse import urlencode
 
 
-class CashFlowForm(forms.ModelForm):
+class CashFlowForm(TenantFormMixin, forms.ModelForm):
     """
     Форма для создания и редактирования записей о движении денежных средств.
+    Без подкатегории тип, категория и подкатегория назначаются по правилам
+    категоризации организации (см. rules).
     """
 
     class Meta:
@@ -13,7 +21,7 @@ class CashFlowForm(forms.ModelForm):
         fields = [
             'date_created', 'status', 'type',
             'category', 'subcategory',
-            'amount', 'comment'
+            'amount', 'currency', 'comment'
         ]
         widgets = {
             'date_created': forms.DateInput(
@@ -33,6 +41,7 @@ class CashFlowForm(forms.ModelForm):
                     'min': '0.01'
                 }
             ),
+            'currency': forms.Select(attrs={'class': 'form-control'}),
             'comment': forms.Textarea(
                 attrs={
                     'class': 'form-control',
@@ -46,20 +55,55 @@ class CashFlowForm(forms.ModelForm):
 
         if not self.initial.get('date_created'):
             self.initial['date_created'] = datetime.date.today()
+        for name in ('type', 'category', 'subcategory'):
+            self.fields[name].required = False
 
-        if not self.instance.pk:
-            self.fields['category'].queryset = Category.objects.none()
-            self.fields['subcategory'].queryset = Subcategory.objects.none()
+        # Выборки полей уже ограничены организацией (TenantFormMixin).
+        categories = self.fields['category'].queryset
+        subcategories = self.fields['subcategory'].queryset
+        if self.is_bound:
+            # Допустимые значения ограничиваются выбранными родителями,
+            # поэтому иерархия тип -> категория -> подкатегория проверяется
+            # стандартной валидацией полей.
+            self.fields['category'].queryset = categories.filter(
+                type_id=self._bound_id('type')
+            )
+            self.fields['subcategory'].queryset = subcategories.filter(
+                category_id=self._bound_id('category')
+            )
+        elif not self.instance.pk:
+            self.fields['category'].queryset = categories.none()
+            self.fields['subcategory'].queryset = subcategories.none()
         else:
-            self.fields['category'].queryset = Category.objects.filter(
+            self.fields['category'].queryset = categories.filter(
                 type=self.instance.type
             )
-            self.fields['subcategory'].queryset = Subcategory.objects.filter(
+            self.fields['subcategory'].queryset = subcategories.filter(
                 category=self.instance.category
             )
 
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.errors:
+            return cleaned_data
+        # Правила нужны, только если подкатегория не указана.
+        rule_matcher = None if cleaned_data.get('subcategory') else (
+            rules.matcher(self.tenant_id)
+        )
+        if not rules.categorize(cleaned_data, rule_matcher):
+            self.add_error('subcategory', rules.NO_RULE_MESSAGE)
+        return cleaned_data
+
+    def _bound_id(self, name):
+        """Возвращает id из отправленных данных или None, если он некорректен."""
+        value = self.data.get(self.add_prefix(name))
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
 
-class StatusForm(forms.ModelForm):
+
+class StatusForm(TenantFormMixin, forms.ModelForm):
     """Форма для создания и редактирования статусов."""
 
     class Meta:
@@ -70,7 +114,7 @@ class StatusForm(forms.ModelForm):
         }
 
 
-class TypeForm(forms.ModelForm):
+class TypeForm(TenantFormMixin, forms.ModelForm):
     """Форма для создания и редактирования типов."""
 
     class Meta:
@@ -81,7 +125,7 @@ class TypeForm(forms.ModelForm):
         }
 
 
-class CategoryForm(forms.ModelForm):
+class CategoryForm(TenantFormMixin, forms.ModelForm):
     """Форма для создания и редактирования категорий."""
 
     class Meta:
@@ -93,7 +137,7 @@ class CategoryForm(forms.ModelForm):
         }
 
 
-class SubcategoryForm(forms.ModelForm):
+class SubcategoryForm(TenantFormMixin, forms.ModelForm):
     """Форма для создания и редактирования подкатегорий."""
 
     class Meta:
@@ -103,3 +147,191 @@ class SubcategoryForm(forms.ModelForm):
             'name': forms.TextInput(attrs={'class': 'form-control'}),
             'category': forms.Select(attrs={'class': 'form-control'}),
         }
+
+
+class AttachmentForm(forms.Form):
+    """Форма загрузки вложения (чека, счета) к записи."""
+    file = forms.FileField(
+        label='Файл',
+        validators=[validate_upload],
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control'}),
+    )
+
+
+class CashFlowSelectionForm(forms.Form):
+    """
+    Выбор записей для пакетного действия в списке: отмеченные на странице
+    (ids) или все, подходящие под фильтры списка (select_all). Выборка
+    (selection) строится без загрузки записей.
+    """
+    max_ids = 1000
+    filter_fields = (
+        'start_date', 'end_date', 'status', 'type', 'category',
+        'subcategory', 'flag',
+    )
+
+    ids = forms.Field(required=False, widget=forms.MultipleHiddenInput)
+    select_all = forms.BooleanField(required=False)
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+    status = forms.ModelChoiceField(Status.objects.none(), required=False)
+    type = forms.ModelChoiceField(Type.objects.none(), required=False)
+    category = forms.ModelChoiceField(Category.objects.none(), required=False)
+    subcategory = forms.ModelChoiceField(
+        Subcategory.objects.none(), required=False
+    )
+    flag = forms.ChoiceField(
+        choices=[('', '')] + CashFlowFlag.Kind.choices, required=False
+    )
+
+    def __init__(self, *args, tenant_id, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tenant_id = tenant_id
+        for name, model in (('status', Status), ('type', Type),
+                            ('category', Category),
+                            ('subcategory', Subcategory)):
+            self.fields[name].queryset = model.objects.for_tenant(tenant_id)
+
+    def clean_ids(self):
+        ids = self.cleaned_data['ids'] or []
+        try:
+            ids = sorted({int(pk) for pk in ids})
+        except (TypeError, ValueError):
+            raise forms.ValidationError('Некорректный список записей.')
+        if len(ids) > self.max_ids:
+            raise forms.ValidationError(
+                f'Можно отметить не больше {self.max_ids} записей; '
+                f'для большего числа выберите все записи по фильтру.'
+            )
+        found = CashFlow.objects.for_tenant(self.tenant_id).filter(
+            pk__in=ids
+        ).count()
+        if found != len(ids):
+            raise forms.ValidationError(
+                'Часть отмеченных записей не найдена: обновите страницу.'
+            )
+        return ids
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if (not self.errors and not cleaned_data['select_all']
+                and not cleaned_data['ids']):
+            raise forms.ValidationError('Не выбрано ни одной записи.')
+        return cleaned_data
+
+    def selection(self):
+        """Выборка записей организации (QuerySet) по отметкам или фильтрам."""
+        queryset = CashFlow.objects.for_tenant(self.tenant_id)
+        if self.cleaned_data['select_all']:
+            return queryset.filter_by_params(self.cleaned_data)
+        return queryset.filter(pk__in=self.cleaned_data['ids'])
+
+    def filter_query(self):
+        """Фильтры списка строкой запроса — для возврата к списку."""
+        return urlencode([
+            (name, self.data[name])
+            for name in self.filter_fields if self.data.get(name)
+        ])
+
+    def hidden_items(self):
+        """Пары (имя, значение) выбора для скрытых полей формы подтверждения."""
+        return [
+            (name, value)
+            for name in self.fields
+            for value in self.data.getlist(name)
+            if value
+        ]
+
+
+class CashFlowBatchForm(forms.Form):
+    """
+    Пакетное действие над выбранными записями: смена статуса, смена
+    категории (тип и категория берутся из подкатегории и должны ей
+    соответствовать, если указаны) или удаление.
+
+    Скрытые поля confirmed_count и confirmed_seq переносят со страницы
+    подтверждения число выбранных записей и их наибольший номер изменения:
+    по ним представление проверяет, что выборка с тех пор не изменилась.
+    """
+    STATUS = 'status'
+    CATEGORIZE = 'categorize'
+    DELETE = 'delete'
+    ACTIONS = [
+        (STATUS, 'Изменить статус'),
+        (CATEGORIZE, 'Изменить категорию'),
+        (DELETE, 'Удалить'),
+    ]
+
+    action = forms.ChoiceField(choices=ACTIONS, widget=forms.HiddenInput)
+    confirmed_count = forms.IntegerField(
+        min_value=1, required=False, widget=forms.HiddenInput
+    )
+    confirmed_seq = forms.IntegerField(
+        min_value=0, required=False, widget=forms.HiddenInput
+    )
+    new_status = forms.ModelChoiceField(
+        Status.objects.none(), required=False, label='Новый статус',
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+    new_type = forms.ModelChoiceField(
+        Type.objects.none(), required=False, label='Тип',
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+    new_category = forms.ModelChoiceField(
+        Category.objects.none(), required=False, label='Категория',
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+    new_subcategory = forms.ModelChoiceField(
+        Subcategory.objects.none(), required=False, label='Подкатегория',
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+
+    def __init__(self, *args, tenant_id, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name, model in (('new_status', Status), ('new_type', Type),
+                            ('new_category', Category),
+                            ('new_subcategory', Subcategory)):
+            self.fields[name].queryset = model.objects.for_tenant(tenant_id)
+        self.fields['new_subcategory'].queryset = self.fields[
+            'new_subcategory'
+        ].queryset.select_related('category')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if (cleaned_data.get('confirmed_count') is None
+                or cleaned_data.get('confirmed_seq') is None):
+            self.add_error(
+                None, 'Подтвердите действие на странице сводки выбранных записей.'
+            )
+        action = cleaned_data.get('action')
+        if action == self.STATUS and not cleaned_data.get('new_status'):
+            self.add_error('new_status', 'Выберите статус.')
+        elif action == self.CATEGORIZE:
+            subcategory = cleaned_data.get('new_subcategory')
+            if subcategory is None:
+                self.add_error('new_subcategory', 'Выберите подкатегорию.')
+                return cleaned_data
+            category = cleaned_data.get('new_category')
+            if category is not None and category.pk != subcategory.category_id:
+                self.add_error(
+                    'new_subcategory',
+                    'Подкатегория не относится к выбранной категории.'
+                )
+            type_ = cleaned_data.get('new_type')
+            if type_ is not None and type_.pk != subcategory.category.type_id:
+                self.add_error(
+                    'new_category', 'Категория не относится к выбранному типу.'
+                )
+        return cleaned_data
+
+    def changes(self):
+        """Новые значения полей для QuerySet.update (кроме удаления)."""
+        action = self.cleaned_data['action']
+        if action == self.STATUS:
+            return {'status': self.cleaned_data['new_status']}
+        subcategory = self.cleaned_data['new_subcategory']
+        return {
+            'type_id': subcategory.category.type_id,
+            'category_id': subcategory.category_id,
+            'subcategory': subcategory,
+        }
@@ -0,0 +1,267 @@
+"""
+Ограничение стоимости запросов к списку движений ДС (веб-интерфейс и API).
+
+- Размер страницы задается параметром page_size, но не больше
+  CASH_FLOW_MAX_PAGE_SIZE.
+- Сортировка: по индексу (cashflow_tenant_date_id_idx и первичный
+  ключ) доступны только INDEXED_ORDERINGS. Остальные сортировки и поиск
+  по комментарию (LIKE '%...%' без индекса) разрешены лишь вместе
+  с периодом не длиннее CASH_FLOW_NARROW_RANGE_DAYS дней (date_created
+  или start_date и end_date): тогда строки отбираются по индексу дат,
+  и сортируется небольшой остаток.
+- Каждый SQL-запрос ограничен CASH_FLOW_STATEMENT_TIMEOUT секундами:
+  в SQLite — обработчиком прогресса, в PostgreSQL — statement_timeout,
+  в MySQL — max_execution_time.
+
+Недопустимые и прерванные по времени запросы получают ответ 400 с
+пояснением и учитываются в счетчиках (cash_flow.metrics):
+guardrails.rejected.<параметр> и guardrails.timeout.<представление>.
+"""
+import datetime
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import OperationalError, connections
+from django.template.response import TemplateResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.pagination import PageNumberPagination
+
+from . import metrics
+
+
+INDEXED_ORDERINGS = (
+    'date_created', '-date_created',
+    'date_created,id', '-date_created,-id',
+    'id', '-id',
+)
+PAGE_SIZE_PARAM = 'page_size'
+# Обработчик прогресса SQLite вызывается раз в столько инструкций VM.
+PROGRESS_STEPS = 1000
+POSTGRES_QUERY_CANCELED = '57014'
+
+
+class QueryRejected(ValidationError):
+    """Запрос отклонен до выполнения как слишком дорогой."""
+
+
+class QueryTimeout(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = (
+        'Запрос выполнялся слишком долго и был прерван. '
+        'Сузьте период или добавьте фильтры.'
+    )
+    default_code = 'query_timeout'
+
+
+def max_page_size():
+    return getattr(settings, 'CASH_FLOW_MAX_PAGE_SIZE', 100)
+
+
+def narrow_range_days():
+    return getattr(settings, 'CASH_FLOW_NARROW_RANGE_DAYS', 31)
+
+
+def page_size(params, default):
+    """
+    Размер страницы из параметра page_size (или default). Нечисловое,
+    неположительное или больше предела значение — QueryRejected.
+    """
+    value = params.get(PAGE_SIZE_PARAM)
+    if not value:
+        return default
+    limit = max_page_size()
+    try:
+        size = int(value)
+    except ValueError:
+        size = 0
+    if not 1 <= size <= limit:
+        metrics.increment(f'guardrails.rejected.{PAGE_SIZE_PARAM}')
+        raise QueryRejected(
+            {PAGE_SIZE_PARAM: f'Ожидается целое число от 1 до {limit}.'}
+        )
+    return size
+
+
+def range_days(params):
+    """
+    Длина периода в днях по параметрам date_created или start_date и
+    end_date; None, если период не ограничен с обеих сторон.
+    """
+    if params.get('date_created'):
+        return 1
+    try:
+        start = datetime.date.fromisoformat(params.get('start_date') or '')
+        end = datetime.date.fromisoformat(params.get('end_date') or '')
+    except ValueError:
+        return None
+    return max((end - start).days + 1, 0)
+
+
+def check_cashflow_query(params):
+    """
+    Проверяет сортировку и поиск списка движений ДС (см. модуль);
+    недопустимая комбинация — QueryRejected с пояснением по параметрам.
+    """
+    days = range_days(params)
+    limit = narrow_range_days()
+    narrow = days is not None and days <= limit
+    errors = {}
+    ordering = (params.get('ordering') or '').replace(' ', '')
+    if ordering and ordering not in INDEXED_ORDERINGS and not narrow:
+        errors['ordering'] = (
+            f'Сортировка «{ordering}» не поддерживается индексом. Она доступна '
+            f'только для периода не длиннее {limit} дней (date_created или '
+            f'start_date и end_date). Без ограничений: '
+            f'{", ".join(INDEXED_ORDERINGS)}.'
+        )
+    if params.get('search') and not narrow:
+        errors['search'] = (
+            f'Поиск по комментарию доступен только для периода не длиннее '
+            f'{limit} дней (date_created или start_date и end_date).'
+        )
+    for name in errors:
+        metrics.increment(f'guardrails.rejected.{name}')
+    if errors:
+        raise QueryRejected(errors)
+
+
+class StatementTimeout:
+    """Состояние ограничения: expired — запрос прерван по времени."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = None
+        self.expired = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper: отсчет времени заново для каждого запроса.
+        self.deadline = time.monotonic() + self.seconds
+        return execute(sql, params, many, context)
+
+    def caused(self, error):
+        """Вызвана ли ошибка БД истечением времени."""
+        if not isinstance(error, OperationalError) or not self.seconds:
+            return False
+        cause = getattr(error, '__cause__', None)
+        if getattr(cause, 'pgcode', None) == POSTGRES_QUERY_CANCELED:
+            self.expired = True
+        return self.expired
+
+    def progress(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.expired = True
+            return 1
+        return 0
+
+
+@contextmanager
+def statement_timeout(seconds=None, using='default'):
+    """
+    Ограничивает время каждого SQL-запроса внутри блока (по умолчанию
+    CASH_FLOW_STATEMENT_TIMEOUT секунд; 0 — без ограничения). Прерванный
+    запрос завершается OperationalError; StatementTimeout.caused(error)
+    отличает его от прочих ошибок.
+    """
+    if seconds is None:
+        seconds = getattr(settings, 'CASH_FLOW_STATEMENT_TIMEOUT', 0)
+    timeout = StatementTimeout(seconds)
+    connection = connections[using]
+    if not seconds:
+        yield timeout
+        return
+    connection.ensure_connection()
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        connection.connection.set_progress_handler(timeout.progress, PROGRESS_STEPS)
+        try:
+            with connection.execute_wrapper(timeout):
+                yield timeout
+        finally:
+            connection.connection.set_progress_handler(None, PROGRESS_STEPS)
+        return
+
+    statements = {
+        'postgresql': ('SET statement_timeout = %s', 'RESET statement_timeout'),
+        'mysql': ('SET SESSION max_execution_time = %s',
+                  'SET SESSION max_execution_time = DEFAULT'),
+    }.get(vendor)
+    if statements is None:
+        yield timeout
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(statements[0], [int(seconds * 1000)])
+    try:
+        yield timeout
+    finally:
+        if connection.connection is not None:
+            with connection.cursor() as cursor:
+                cursor.execute(statements[1])
+
+
+class GuardedPagination(PageNumberPagination):
+    """Страницы API с размером page_size не больше CASH_FLOW_MAX_PAGE_SIZE."""
+    page_size_query_param = PAGE_SIZE_PARAM
+
+    def get_page_size(self, request):
+        return page_size(request.query_params, self.page_size)
+
+
+class GuardedViewSetMixin:
+    """
+    Для viewset: проверка параметров действий guarded_actions и
+    ограничение времени запросов к БД с ответом 400 при его истечении.
+    """
+    guarded_actions = ('list',)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.guarded_actions:
+            check_cashflow_query(request.query_params)
+
+    def dispatch(self, request, *args, **kwargs):
+        with statement_timeout() as self.query_timeout:
+            return super().dispatch(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        timeout = getattr(self, 'query_timeout', None)
+        if timeout is not None and timeout.caused(exc):
+            metrics.increment('guardrails.timeout.api')
+            exc = QueryTimeout()
+        return super().handle_exception(exc)
+
+
+class GuardedListMixin:
+    """
+    Для ListView: page_size, проверка параметров и ограничение времени
+    запросов, включая отрисовку шаблона (страница выборки читается при
+    ней). Отказ — страница query_rejected.html со статусом 400.
+    """
+    rejected_template_name = 'cash_flow/query_rejected.html'
+
+    def get_paginate_by(self, queryset):
+        return page_size(self.request.GET, self.paginate_by)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            check_cashflow_query(request.GET)
+            with statement_timeout() as timeout:
+                try:
+                    response = super().dispatch(request, *args, **kwargs)
+                    if hasattr(response, 'render'):
+                        response.render()
+                    return response
+                except OperationalError as error:
+                    if not timeout.caused(error):
+                        raise
+            metrics.increment('guardrails.timeout.list')
+            errors = [QueryTimeout.default_detail]
+        except QueryRejected as error:
+            errors = [str(message) for messages in error.detail.values()
+                      for message in messages]
+        return TemplateResponse(
+            request, self.rejected_template_name,
+            {'errors': errors, 'reset_url': request.path},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
@@ -0,0 +1,373 @@
+import csv
+import datetime
+import os
+import time
+import traceback
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import anomalies, reconciliation, rules
+from .exports import EXPORT_HEADER, export_queryset, export_row
+from .models import (
+    CashFlow, Currency, Job, Status, Subcategory, reporting_currency
+)
+
+
+class JobCancelled(Exception):
+    """Задача остановлена по запросу пользователя."""
+
+
+class JobContext:
+    """
+    Передается обработчику задачи: сохраняет прогресс и проверяет отмену.
+
+    Прогресс пишется в БД не чаще progress_interval секунд, флаг отмены
+    читается тем же запросом.
+    """
+    progress_interval = 0.5
+
+    def __init__(self, job):
+        self.job = job
+        self._last_report = 0.0
+
+    def progress(self, done, total=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_report < self.progress_interval:
+            return
+        self._last_report = now
+        fields = {'progress_done': done}
+        if total is not None:
+            fields['progress_total'] = total
+        Job.objects.filter(pk=self.job.pk).update(**fields)
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if Job.objects.filter(pk=self.job.pk, cancel_requested=True).exists():
+            raise JobCancelled()
+
+    def result_path(self, suffix):
+        """Возвращает относительный и полный путь файла результата."""
+        relative = f'jobs/{self.job.pk}.{suffix}'
+        path = Path(settings.MEDIA_ROOT) / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return relative, path
+
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Регистрирует обработчик задачи вида kind."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+@handler(Job.Kind.EXPORT)
+def export_cashflows(ctx, params):
+    """
+    Выгружает отфильтрованные записи в CSV-файл в порядке id.
+
+    Записи читаются пакетами по ключу (id > последнего), а не одним
+    итератором: в SQLite открытый курсор удерживал бы блокировку записи
+    прогресса до конца выгрузки и мешал другим воркерам.
+    """
+    currency = params.get('reporting_currency') or reporting_currency()
+    chunk_size = int(params.get('chunk_size', 2000))
+    queryset = CashFlow.objects.for_tenant(ctx.job.tenant_id).filter_by_params(
+        params
+    )
+    total = queryset.count()
+    ctx.progress(0, total, force=True)
+    queryset = export_queryset(queryset, currency).order_by('pk')
+    relative, path = ctx.result_path('csv')
+    rows = 0
+    last_pk = 0
+    with open(path, 'w', encoding='utf-8', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(EXPORT_HEADER)
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+            if not batch:
+                break
+            writer.writerows(export_row(cashflow, currency) for cashflow in batch)
+            rows += len(batch)
+            last_pk = batch[-1].pk
+            ctx.progress(rows, total)
+    ctx.progress(rows, total, force=True)
+    return {'rows': rows}, relative
+
+
+def _import_amount(value):
+    """
+    Сумма строки импорта. Проверяется до вставки пакета: иначе NaN,
+    бесконечность или лишние знаки после запятой прервали бы bulk_create
+    уже после сохранения предыдущих пакетов.
+    """
+    field = CashFlow._meta.get_field('amount')
+    amount = Decimal(value)
+    # NaN, бесконечность и слишком длинные суммы — ValidationError.
+    if field.to_minor(amount) <= 0:
+        raise ValueError(value)
+    return amount
+
+
+@handler(Job.Kind.IMPORT)
+def import_cashflows(ctx, params):
+    """
+    Загружает записи из CSV в формате экспорта (справочники по названиям
+    в организации задачи). Строкам без подкатегории категории назначаются
+    по правилам категоризации (см. rules).
+
+    Справочники читаются один раз в словари, правила компилируются один
+    раз, записи вставляются пакетами bulk_create; строки с ошибками
+    пропускаются и перечисляются в отчете.
+    """
+    path = Path(settings.MEDIA_ROOT) / params['path']
+    batch_size = int(params.get('batch_size', 2000))
+    tenant_id = ctx.job.tenant_id
+    statuses = dict(
+        Status.objects.for_tenant(tenant_id).values_list('name', 'pk')
+    )
+    hierarchy = {
+        (sub.category.type.name, sub.category.name, sub.name): sub
+        for sub in Subcategory.objects.for_tenant(tenant_id).select_related(
+            'category__type'
+        )
+    }
+    rule_matcher = rules.matcher(tenant_id)
+    with open(path, encoding='utf-8', newline='') as lines:
+        total = max(sum(1 for _ in lines) - 1, 0)
+    ctx.progress(0, total, force=True)
+
+    created = categorized = 0
+    errors = []
+    batch = []
+    with open(path, encoding='utf-8', newline='') as lines:
+        for line_number, row in enumerate(csv.DictReader(lines), start=2):
+            try:
+                currency = row.get('currency') or Currency.RUB
+                if currency not in Currency.values:
+                    raise ValueError(currency)
+                amount = _import_amount(row['amount'])
+                comment = row.get('comment') or None
+                if row.get('subcategory'):
+                    subcategory = hierarchy[
+                        (row['type'], row['category'], row['subcategory'])
+                    ]
+                else:
+                    rule = rule_matcher.match(comment, amount, currency)
+                    if rule is None:
+                        raise KeyError('subcategory')
+                    subcategory = rule.subcategory
+                batch.append(CashFlow(
+                    tenant_id=tenant_id,
+                    date_created=datetime.date.fromisoformat(row['date_created']),
+                    status_id=statuses[row['status']],
+                    type_id=subcategory.category.type_id,
+                    category_id=subcategory.category_id,
+                    subcategory=subcategory,
+                    amount=amount,
+                    currency=currency,
+                    comment=comment,
+                ))
+                categorized += not row.get('subcategory')
+            except (KeyError, ValueError, InvalidOperation, ValidationError):
+                if len(errors) < 100:
+                    errors.append(line_number)
+                continue
+            if len(batch) >= batch_size:
+                CashFlow.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+                ctx.progress(line_number - 1, total)
+    if batch:
+        CashFlow.objects.bulk_create(batch)
+        created += len(batch)
+    ctx.progress(total, total, force=True)
+    return {
+        'created': created, 'categorized': categorized, 'error_lines': errors
+    }, ''
+
+
+@handler(Job.Kind.REPORT)
+def monthly_report(ctx, params):
+    """
+    Итоги по месяцам и типам в валюте отчетности reporting_currency;
+    currency, как и в выгрузке, — фильтр по валюте записей.
+    """
+    currency = params.get('reporting_currency') or reporting_currency()
+    queryset = CashFlow.objects.for_tenant(
+        ctx.job.tenant_id
+    ).filter_by_params(params).annotate(
+        month=TruncMonth('date_created')
+    )
+    ctx.progress(0, 1, force=True)
+    rows = [
+        {
+            'month': row['month'].isoformat(),
+            'type_name': row['type__name'],
+            'total': str(row['total'] or 0),
+            'count': row['count'],
+            'missing': row['missing'],
+        }
+        for row in queryset.converted_totals_by(
+            'month', 'type__name', currency=currency
+        )
+    ]
+    ctx.progress(1, 1, force=True)
+    return {'currency': currency, 'rows': rows}, ''
+
+
+@handler(Job.Kind.DETECT)
+def detect_anomalies(ctx, params):
+    """
+    Ищет дубли и выбросы среди записей организации задачи, измененных
+    после ее прошлого успешного поиска (с full=1 — среди всех ее записей),
+    см. anomalies.detect. Задача без организации (команда
+    detect_anomalies) проверяет записи всех организаций.
+    """
+    tenant_id = ctx.job.tenant_id
+    since = 0
+    if not params.get('full'):
+        previous = Job.objects.filter(
+            kind=Job.Kind.DETECT, state=Job.State.DONE, tenant_id=tenant_id
+        ).exclude(pk=ctx.job.pk).order_by('-pk').values_list(
+            'result', flat=True
+        ).first()
+        since = (previous or {}).get('last_seq') or 0
+    window_days = int(
+        params.get('window_days', anomalies.DUPLICATE_WINDOW_DAYS)
+    )
+    ctx.progress(0, 1, force=True)
+    result = anomalies.detect(
+        since, window_days=window_days, tenant_id=tenant_id
+    )
+    ctx.progress(1, 1, force=True)
+    return {'since': since, **result}, ''
+
+
+@handler(Job.Kind.RECONCILE)
+def reconcile_statement(ctx, params):
+    """
+    Сверяет банковскую выписку из CSV с записями учета организации задачи
+    (см. reconciliation); с параметром status назначает его сопоставленным
+    записям. Отчет по обеим сторонам сохраняется CSV-файлом результата.
+    """
+    path = Path(settings.MEDIA_ROOT) / params['path']
+    tolerance_days = int(
+        params.get('tolerance_days', reconciliation.DEFAULT_TOLERANCE_DAYS)
+    )
+    ctx.progress(0, 1, force=True)
+    with open(path, encoding='utf-8', newline='') as lines:
+        result = reconciliation.reconcile(
+            lines, tolerance_days, matched_status=params.get('status') or None,
+            tenant_id=ctx.job.tenant_id,
+        )
+    relative, report_path = ctx.result_path('csv')
+    with open(report_path, 'w', encoding='utf-8', newline='') as out:
+        reconciliation.write_report(result, out)
+    ctx.progress(1, 1, force=True)
+    return reconciliation.summary(result), relative
+
+
+@handler(Job.Kind.CATEGORIZE)
+def apply_categorization_rules(ctx, params):
+    """
+    Переназначает категории записям организации задачи (с фильтрами
+    списка из params) по ее правилам, см. rules.apply_rules; с dry_run
+    только считает записи, которые изменились бы.
+    """
+    queryset = CashFlow.objects.for_tenant(ctx.job.tenant_id).filter_by_params(
+        params
+    )
+    result = rules.apply_rules(
+        queryset, rules.matcher(ctx.job.tenant_id),
+        batch_size=int(params.get('batch_size', rules.APPLY_BATCH_SIZE)),
+        progress=ctx.progress, dry_run=bool(params.get('dry_run')),
+    )
+    ctx.progress(result['checked'], result['checked'], force=True)
+    return result, ''
+
+
+def claim_next_job():
+    """
+    Забирает следующую задачу из очереди и возвращает ее id или None.
+
+    Захват — условный UPDATE state=pending -> running, поэтому несколько
+    воркеров не получат одну и ту же задачу.
+    """
+    pending = Job.objects.filter(state=Job.State.PENDING).order_by('pk')
+    for pk in pending.values_list('pk', flat=True)[:10]:
+        claimed = Job.objects.filter(pk=pk, state=Job.State.PENDING).update(
+            state=Job.State.RUNNING, started_at=timezone.now()
+        )
+        if claimed:
+            return pk
+    return None
+
+
+def run_job(pk):
+    """Выполняет задачу pk и сохраняет результат, ошибку или отмену."""
+    job = Job.objects.get(pk=pk)
+    ctx = JobContext(job)
+    try:
+        ctx.check_cancelled()
+        result, relative = HANDLERS[job.kind](ctx, job.params)
+    except JobCancelled:
+        _remove_result(ctx)
+        fields = {'state': Job.State.CANCELLED}
+    except Exception:
+        _remove_result(ctx)
+        fields = {'state': Job.State.FAILED, 'error': traceback.format_exc()}
+    else:
+        fields = {
+            'state': Job.State.DONE,
+            'result': result,
+            'result_file': relative,
+        }
+    Job.objects.filter(pk=pk).update(finished_at=timezone.now(), **fields)
+    return fields['state']
+
+
+def _remove_result(ctx):
+    """Удаляет недописанный файл результата."""
+    _, path = ctx.result_path('csv')
+    if path.exists():
+        os.remove(path)
+
+
+def submit_job(kind, params, inline=False, tenant_id=None):
+    """
+    Создает задачу организации tenant_id. При inline=True выполняет ее
+    сразу в текущем процессе, иначе оставляет в очереди для run_jobs.
+    Задачи с данными организации (экспорт, импорт, отчет, сверка) без
+    организации не видят записей.
+    """
+    job = Job.objects.create(kind=kind, params=params, tenant_id=tenant_id)
+    if inline:
+        Job.objects.filter(pk=job.pk).update(
+            state=Job.State.RUNNING, started_at=timezone.now()
+        )
+        run_job(job.pk)
+        job.refresh_from_db()
+    return job
+
+
+def cancel_job(job):
+    """Отменяет задачу из очереди сразу, выполняющейся — по флагу."""
+    cancelled = Job.objects.filter(
+        pk=job.pk, state=Job.State.PENDING
+    ).update(state=Job.State.CANCELLED, finished_at=timezone.now())
+    if not cancelled:
+        Job.objects.filter(pk=job.pk, state=Job.State.RUNNING).update(
+            cancel_requested=True
+        )
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cash_flow.models import CashFlow
+from cash_flow.rules import APPLY_BATCH_SIZE, apply_rules, matcher
+from cash_flow.tenancy import default_tenant_id
+
+
+class Command(BaseCommand):
+    help = (
+        'Применяет правила категоризации к уже сохраненным записям '
+        'организации: тип, категория и подкатегория назначаются по первому '
+        'подходящему правилу.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help='Начало периода (ГГГГ-ММ-ДД)')
+        parser.add_argument('--end-date', help='Конец периода (ГГГГ-ММ-ДД)')
+        parser.add_argument(
+            '--batch-size', type=int, default=APPLY_BATCH_SIZE,
+            help='Записей в пакете (одна транзакция)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать записи, которые изменятся'
+        )
+        parser.add_argument(
+            '--tenant', type=int, default=default_tenant_id(),
+            help='id организации (по умолчанию CASH_FLOW_DEFAULT_TENANT)'
+        )
+
+    def handle(self, *args, **options):
+        tenant_id = options['tenant']
+        if tenant_id is None:
+            raise CommandError('Укажите организацию: --tenant.')
+        rule_matcher = matcher(tenant_id)
+        if not len(rule_matcher):
+            raise CommandError('У организации нет включенных правил.')
+        queryset = CashFlow.objects.for_tenant(tenant_id).filter_by_params({
+            'start_date': options['start_date'],
+            'end_date': options['end_date'],
+        })
+
+        def progress(done, total):
+            self.stdout.write(f'{done}/{total}', ending='\r')
+
+        result = apply_rules(
+            queryset, rule_matcher, batch_size=options['batch_size'],
+            progress=progress, dry_run=options['dry_run'],
+        )
+        verb = 'изменится' if options['dry_run'] else 'изменено'
+        self.stdout.write(self.style.SUCCESS(
+            f"Проверено записей: {result['checked']}, {verb}: {result['changed']}"
+        ))
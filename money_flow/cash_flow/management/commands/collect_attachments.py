@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from cash_flow.attachments import GC_GRACE_SECONDS, collect_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет вложения удаленных записей и файлы вложений, на которые '
+        'больше ничто не ссылается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-seconds', type=int, default=GC_GRACE_SECONDS,
+            help='Не удалять файлы, использованные за последние N секунд'
+        )
+
+    def handle(self, *args, **options):
+        result = collect_garbage(options['grace_seconds'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Удалено вложений: {result['attachments']}, "
+            f"файлов: {result['files']}, освобождено байт: {result['bytes']}"
+        ))
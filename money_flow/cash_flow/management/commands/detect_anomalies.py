@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cash_flow.anomalies import DUPLICATE_WINDOW_DAYS
+from cash_flow.jobs import submit_job
+from cash_flow.models import Job
+
+
+class Command(BaseCommand):
+    help = (
+        'Ищет возможные дубли и необычные суммы среди записей, измененных '
+        'после прошлого поиска (удобно запускать по расписанию).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true', help='Проверить все записи'
+        )
+        parser.add_argument(
+            '--window-days', type=int, default=DUPLICATE_WINDOW_DAYS
+        )
+
+    def handle(self, *args, **options):
+        params = {'window_days': options['window_days']}
+        if options['full']:
+            params['full'] = True
+        job = submit_job(Job.Kind.DETECT, params, inline=True)
+        if job.state != Job.State.DONE:
+            raise CommandError(job.error or job.get_state_display())
+        result = job.result
+        self.stdout.write(self.style.SUCCESS(
+            f"Проверено записей: {result['checked']}, "
+            f"дублей: {result['duplicates']}, выбросов: {result['outliers']}"
+        ))
@@ -0,0 +1,78 @@
+import csv
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from cash_flow import resultcache
+from cash_flow.models import Currency, ExchangeRate
+
+
+def load_exchange_rates(lines, batch_size=5000):
+    """
+    Загружает курсы из CSV (date,base,quote,rate) пакетами bulk_create.
+
+    Существующие курсы на ту же дату и пару перезаписываются
+    (INSERT ... ON CONFLICT DO UPDATE). Возвращает число строк.
+    """
+    known = set(Currency.values)
+    reader = csv.DictReader(lines)
+    batch = []
+    loaded = 0
+
+    def flush():
+        ExchangeRate.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=['base_currency', 'quote_currency', 'date'],
+            update_fields=['rate'],
+        )
+
+    with transaction.atomic():
+        # Итоги в валюте отчетности в кешированных списках меняются.
+        transaction.on_commit(resultcache.invalidate_all)
+        for line_number, row in enumerate(reader, start=2):
+            try:
+                base = row['base'].strip().upper()
+                quote = row['quote'].strip().upper()
+                rate = ExchangeRate(
+                    date=datetime.date.fromisoformat(row['date'].strip()),
+                    base_currency=base,
+                    quote_currency=quote,
+                    rate=Decimal(row['rate'].strip()),
+                )
+            except (KeyError, AttributeError, ValueError, InvalidOperation):
+                raise CommandError(f'Строка {line_number}: неверный формат.')
+            if base not in known or quote not in known:
+                raise CommandError(
+                    f'Строка {line_number}: неизвестная валюта {base}/{quote}.'
+                )
+            batch.append(rate)
+            if len(batch) >= batch_size:
+                flush()
+                loaded += len(batch)
+                batch = []
+        if batch:
+            flush()
+            loaded += len(batch)
+    return loaded
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает курсы валют из локального CSV-файла '
+        'с колонками date,base,quote,rate.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к CSV-файлу')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], newline='', encoding='utf-8') as lines:
+                loaded = load_exchange_rates(lines, options['batch_size'])
+        except OSError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(f'Загружено курсов: {loaded}'))
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cash_flow.models import Status
+from cash_flow.tenancy import default_tenant_id
+from cash_flow.reconciliation import (
+    DEFAULT_TOLERANCE_DAYS, reconcile, summary, write_report
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет банковскую выписку (CSV с колонками date,amount,currency,'
+        'description) с движениями ДС.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к CSV-файлу выписки')
+        parser.add_argument(
+            '--status',
+            help='Название статуса, который назначается сопоставленным записям'
+        )
+        parser.add_argument(
+            '--tolerance-days', type=int, default=DEFAULT_TOLERANCE_DAYS
+        )
+        parser.add_argument('--report', help='Куда записать отчет CSV')
+        parser.add_argument(
+            '--tenant', type=int, default=default_tenant_id(),
+            help='id организации (по умолчанию CASH_FLOW_DEFAULT_TENANT)'
+        )
+
+    def handle(self, *args, **options):
+        tenant_id = options['tenant']
+        if tenant_id is None:
+            raise CommandError('Укажите организацию: --tenant.')
+        status = None
+        if options['status']:
+            try:
+                status = Status.objects.for_tenant(tenant_id).get(
+                    name=options['status']
+                ).pk
+            except Status.DoesNotExist:
+                raise CommandError(f"Статус «{options['status']}» не найден.")
+        try:
+            with open(options['path'], newline='', encoding='utf-8') as lines:
+                result = reconcile(
+                    lines, options['tolerance_days'], status,
+                    tenant_id=tenant_id,
+                )
+            if options['report']:
+                with open(options['report'], 'w', newline='', encoding='utf-8') as out:
+                    write_report(result, out)
+        except OSError as error:
+            raise CommandError(str(error))
+        totals = summary(result)
+        self.stdout.write(self.style.SUCCESS(
+            f"Строк выписки: {totals['lines']}, точно: {totals['exact']}, "
+            f"по дате ±{options['tolerance_days']} дн.: {totals['fuzzy']}, "
+            f"без пары в выписке: {totals['unmatched_lines_count']}, "
+            f"в учете: {totals['unmatched_ledger_count']}"
+        ))
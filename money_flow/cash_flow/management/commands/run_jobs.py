@@ -0,0 +1,84 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from cash_flow.jobs import claim_next_job, run_job
+
+
+def _init_worker():
+    """Настраивает Django в процессе пула, запущенном через spawn."""
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'money_flow.settings')
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет фоновые задачи из таблицы Job в пуле процессов. '
+        'С --processes 0 задачи выполняются в текущем процессе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Размер пула процессов (0 — без пула)'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить задачи из очереди и завершиться'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Пауза между опросами очереди, с'
+        )
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 0:
+            self.run_inline(options)
+        else:
+            self.run_pool(options)
+
+    def run_inline(self, options):
+        while True:
+            pk = claim_next_job()
+            if pk is not None:
+                self.report(pk, run_job(pk))
+                continue
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
+
+    def run_pool(self, options):
+        processes = options['processes']
+        with ProcessPoolExecutor(processes, initializer=_init_worker) as pool:
+            running = {}
+            while True:
+                while len(running) < processes:
+                    pk = claim_next_job()
+                    if pk is None:
+                        break
+                    # Пул создает процессы при первой отправке задачи;
+                    # открытое соединение не должно попасть в них через fork.
+                    connections.close_all()
+                    running[pool.submit(run_job, pk)] = pk
+                if not running:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+                done, _ = wait(
+                    running, timeout=options['poll_interval'],
+                    return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    pk = running.pop(future)
+                    try:
+                        self.report(pk, future.result())
+                    except Exception as error:
+                        self.stderr.write(f'Задача #{pk}: сбой воркера: {error}')
+
+    def report(self, pk, state):
+        self.stdout.write(f'Задача #{pk}: {state}')
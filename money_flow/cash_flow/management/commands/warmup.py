@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from cash_flow.warmup import warmup
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогревает процесс (импорт модулей, шаблоны, соединения с БД, '
+        'справочники, первые запросы) и печатает профиль по этапам.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-requests', action='store_true',
+            help='Не отправлять прогревочные GET-запросы'
+        )
+        parser.add_argument(
+            '--json', action='store_true', help='Профиль в формате JSON'
+        )
+
+    def handle(self, *args, **options):
+        profile = warmup(requests=not options['no_requests'])
+        if options['json']:
+            self.stdout.write(json.dumps(profile, ensure_ascii=False, indent=2))
+            return
+        for stage in profile['stages']:
+            self.stdout.write(
+                f"{stage['stage']:<12}{stage['seconds'] * 1000:>10.1f} мс"
+            )
+            detail = stage['detail']
+            if 'error' in detail:
+                self.stdout.write(self.style.ERROR(f"  {detail['error']}"))
+                continue
+            for name, value in detail.items():
+                if name == 'slowest':
+                    value = ', '.join(
+                        f'{module} {seconds * 1000:.1f} мс'
+                        for module, seconds in value.items()
+                    )
+                elif isinstance(value, dict):
+                    value = ', '.join(f'{key}: {item}' for key, item in value.items())
+                self.stdout.write(f'  {name}: {value}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Прогрев завершен за {profile['total'] * 1000:.1f} мс"
+        ))
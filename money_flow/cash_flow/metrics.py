@@ -0,0 +1,30 @@
+"""
+Счетчики процесса для наблюдения за сервисом (отклоненные и прерванные
+запросы и т. п.).
+
+Счетчики живут в памяти процесса и сбрасываются при перезапуске; при
+нескольких процессах у каждого свои значения. Сотрудники видят их на
+/cash_flow/metrics/.
+"""
+import threading
+from collections import Counter
+
+_lock = threading.Lock()
+_counters = Counter()
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def snapshot():
+    """Текущие значения счетчиков, отсортированные по имени."""
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+def reset():
+    """Обнуляет счетчики (нужно, например, между тестами)."""
+    with _lock:
+        _counters.clear()
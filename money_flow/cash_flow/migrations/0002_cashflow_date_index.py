@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-19 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cash_flow', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cashflow',
+            index=models.Index(fields=['date_created', 'id'], name='cashflow_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.2 on 2026-10-19 15:42
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def backfill_change_seq(apps, schema_editor):
+    """Нумерует существующие записи их id и выставляет счетчик."""
+    CashFlow = apps.get_model('cash_flow', 'CashFlow')
+    ChangeCounter = apps.get_model('cash_flow', 'ChangeCounter')
+    db = schema_editor.connection.alias
+    CashFlow.objects.using(db).update(change_seq=F('id'))
+    last = CashFlow.objects.using(db).aggregate(last=Max('id'))['last'] or 0
+    ChangeCounter.objects.using(db).create(pk=1, value=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cash_flow', '0002_cashflow_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CashFlowTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField(unique=True, verbose_name='Номер изменения')),
+                ('object_id', models.BigIntegerField(verbose_name='ID записи')),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата удаления')),
+            ],
+            options={
+                'verbose_name': 'Удаленная запись',
+                'verbose_name_plural': 'Удаленные записи',
+                'ordering': ['seq'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ChangeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Счетчик изменений',
+                'verbose_name_plural': 'Счетчики изменений',
+            },
+        ),
+        migrations.AddField(
+            model_name='cashflow',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.RunPython(backfill_change_seq, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,91 @@
+import django.core.validators
+from decimal import Decimal
+
+from django.db import migrations, models, transaction
+from django.db.models import ExpressionWrapper, F, Max, Min, Value
+from django.db.models.functions import Cast, Round
+
+import cash_flow.fields
+
+
+BATCH_SIZE = 10000
+
+
+def _batches(queryset):
+    """Разбивает таблицу на диапазоны id по BATCH_SIZE строк."""
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return
+    for start in range(bounds['low'], bounds['high'] + 1, BATCH_SIZE):
+        yield queryset.filter(pk__gte=start, pk__lt=start + BATCH_SIZE)
+
+
+def amount_to_minor(apps, schema_editor):
+    """
+    Переносит суммы в копейки пакетами по диапазонам id.
+
+    Каждый пакет фиксируется отдельно; заполняются только строки с пустым
+    amount_minor, поэтому прерванную миграцию можно запустить повторно.
+    ROUND защищает от погрешности REAL-хранения DECIMAL в SQLite.
+    """
+    CashFlow = apps.get_model('cash_flow', 'CashFlow')
+    db = schema_editor.connection.alias
+    for batch in _batches(CashFlow.objects.using(db)):
+        with transaction.atomic(using=db):
+            batch.filter(amount_minor__isnull=True).update(
+                amount_minor=Cast(
+                    Round(F('amount') * 100), models.BigIntegerField()
+                )
+            )
+
+
+def amount_from_minor(apps, schema_editor):
+    CashFlow = apps.get_model('cash_flow', 'CashFlow')
+    db = schema_editor.connection.alias
+    for batch in _batches(CashFlow.objects.using(db)):
+        with transaction.atomic(using=db):
+            batch.update(
+                amount=ExpressionWrapper(
+                    F('amount_minor') / Value(100.0),
+                    output_field=models.DecimalField(
+                        max_digits=17, decimal_places=2
+                    )
+                )
+            )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('cash_flow', '0003_change_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cashflow',
+            name='amount_minor',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='cashflow',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True, validators=[django.core.validators.MinValueValidator(0.01)], verbose_name='Сумма (руб.)'),
+        ),
+        migrations.RunPython(amount_to_minor, amount_from_minor),
+        migrations.RemoveField(
+            model_name='cashflow',
+            name='amount',
+        ),
+        migrations.RenameField(
+            model_name='cashflow',
+            old_name='amount_minor',
+            new_name='amount',
+        ),
+        migrations.AlterField(
+            model_name='cashflow',
+            name='amount',
+            field=cash_flow.fields.MoneyField(validators=[django.core.validators.MinValueValidator(Decimal('0.01'))], verbose_name='Сумма (руб.)'),
+        ),
+    ]
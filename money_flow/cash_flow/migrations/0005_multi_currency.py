@@ -0,0 +1,45 @@
+# Generated by Django 5.0.2 on 2026-10-19 15:48
+
+import cash_flow.fields
+import django.core.validators
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cash_flow', '0004_amount_minor_units'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('base_currency', models.CharField(choices=[('RUB', 'Российский рубль'), ('USD', 'Доллар США'), ('EUR', 'Евро'), ('CNY', 'Китайский юань'), ('KZT', 'Казахстанский тенге')], max_length=3, verbose_name='Валюта')),
+                ('quote_currency', models.CharField(choices=[('RUB', 'Российский рубль'), ('USD', 'Доллар США'), ('EUR', 'Евро'), ('CNY', 'Китайский юань'), ('KZT', 'Казахстанский тенге')], max_length=3, verbose_name='Валюта котировки')),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18, validators=[django.core.validators.MinValueValidator(Decimal('1E-8'))], verbose_name='Курс')),
+            ],
+            options={
+                'verbose_name': 'Курс валюты',
+                'verbose_name_plural': 'Курсы валют',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='cashflow',
+            name='currency',
+            field=models.CharField(choices=[('RUB', 'Российский рубль'), ('USD', 'Доллар США'), ('EUR', 'Евро'), ('CNY', 'Китайский юань'), ('KZT', 'Казахстанский тенге')], default='RUB', max_length=3, verbose_name='Валюта'),
+        ),
+        migrations.AlterField(
+            model_name='cashflow',
+            name='amount',
+            field=cash_flow.fields.MoneyField(validators=[django.core.validators.MinValueValidator(Decimal('0.01'))], verbose_name='Сумма'),
+        ),
+        migrations.AddConstraint(
+            model_name='exchangerate',
+            constraint=models.UniqueConstraint(fields=('base_currency', 'quote_currency', 'date'), name='exchangerate_pair_date_uniq'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.2 on 2026-10-19 16:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cash_flow', '0006_jobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('export', 'Экспорт'), ('import', 'Импорт'), ('report', 'Отчет'), ('detect', 'Поиск дублей и выбросов')], max_length=20, verbose_name='Вид'),
+        ),
+        migrations.CreateModel(
+            name='CashFlowFlag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('duplicate', 'Возможный дубль'), ('outlier', 'Необычная сумма')], max_length=20, verbose_name='Вид')),
+                ('score', models.FloatField(verbose_name='Оценка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Найдена')),
+                ('cashflow', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='flags', to='cash_flow.cashflow', verbose_name='Запись')),
+                ('related', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='cash_flow.cashflow', verbose_name='Исходная запись')),
+            ],
+            options={
+                'verbose_name': 'Отметка записи',
+                'verbose_name_plural': 'Отметки записей',
+                'indexes': [models.Index(fields=['kind', 'cashflow'], name='cashflowflag_kind_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='cashflowflag',
+            constraint=models.UniqueConstraint(fields=('cashflow', 'kind'), name='cashflowflag_cashflow_kind_uniq'),
+        ),
+    ]
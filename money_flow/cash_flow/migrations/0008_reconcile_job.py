@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-19 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cash_flow', '0007_anomaly_flags'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('export', 'Экспорт'), ('import', 'Импорт'), ('report', 'Отчет'), ('detect', 'Поиск дублей и выбросов'), ('reconcile', 'Сверка с выпиской')], max_length=20, verbose_name='Вид'),
+        ),
+    ]
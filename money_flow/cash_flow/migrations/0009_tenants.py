@@ -0,0 +1,146 @@
+# Generated by Django 5.0.2 on 2026-10-19 16:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Организация, которой принадлежат данные, созданные до ее появления
+# (CASH_FLOW_DEFAULT_TENANT в настройках).
+DEFAULT_TENANT = 1
+
+
+def create_default_tenant(apps, schema_editor):
+    Tenant = apps.get_model('cash_flow', 'Tenant')
+    Tenant.objects.using(schema_editor.connection.alias).create(
+        pk=DEFAULT_TENANT, name='Основная организация'
+    )
+
+
+def assign_default_tenant(apps, schema_editor):
+    """Существующие задачи и надгробия относятся к той же организации."""
+    db = schema_editor.connection.alias
+    for name in ('Job', 'CashFlowTombstone'):
+        apps.get_model('cash_flow', name).objects.using(db).update(
+            tenant=DEFAULT_TENANT
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cash_flow', '0008_reconcile_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tenant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True, verbose_name='Название')),
+            ],
+            options={
+                'verbose_name': 'Организация',
+                'verbose_name_plural': 'Организации',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.RunPython(create_default_tenant, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='cashflow',
+            name='cashflow_date_id_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='category',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='subcategory',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='status',
+            name='name',
+            field=models.CharField(max_length=100, verbose_name='Название'),
+        ),
+        migrations.AlterField(
+            model_name='type',
+            name='name',
+            field=models.CharField(max_length=100, verbose_name='Название'),
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='users',
+            field=models.ManyToManyField(blank=True, related_name='cash_flow_tenants', to=settings.AUTH_USER_MODEL, verbose_name='Пользователи'),
+        ),
+        migrations.AddField(
+            model_name='cashflow',
+            name='tenant',
+            field=models.ForeignKey(db_index=False, default=DEFAULT_TENANT, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='cash_flow.tenant', verbose_name='Организация'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='cashflowtombstone',
+            name='tenant',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='cash_flow.tenant', verbose_name='Организация'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='tenant',
+            field=models.ForeignKey(db_index=False, default=DEFAULT_TENANT, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='cash_flow.tenant', verbose_name='Организация'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='tenant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='cash_flow.tenant', verbose_name='Организация'),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='tenant',
+            field=models.ForeignKey(db_index=False, default=DEFAULT_TENANT, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='cash_flow.tenant', verbose_name='Организация'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='subcategory',
+            name='tenant',
+            field=models.ForeignKey(db_index=False, default=DEFAULT_TENANT, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='cash_flow.tenant', verbose_name='Организация'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='type',
+            name='tenant',
+            field=models.ForeignKey(db_index=False, default=DEFAULT_TENANT, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='cash_flow.tenant', verbose_name='Организация'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(assign_default_tenant, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cashflow',
+            index=models.Index(fields=['tenant', 'date_created', 'id'], name='cashflow_tenant_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cashflow',
+            index=models.Index(fields=['tenant', 'change_seq'], name='cashflow_tenant_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cashflowtombstone',
+            index=models.Index(fields=['tenant', 'seq'], name='tombstone_tenant_seq_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(fields=('tenant', 'type', 'name'), name='category_tenant_type_name_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='status',
+            constraint=models.UniqueConstraint(fields=('tenant', 'name'), name='status_tenant_name_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='subcategory',
+            constraint=models.UniqueConstraint(fields=('tenant', 'category', 'name'), name='subcategory_tenant_category_name_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='type',
+            constraint=models.UniqueConstraint(fields=('tenant', 'name'), name='type_tenant_name_uniq'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.2 on 2026-10-19 17:22
+
+import cash_flow.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cash_flow', '0010_attachments'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('export', 'Экспорт'), ('import', 'Импорт'), ('report', 'Отчет'), ('detect', 'Поиск дублей и выбросов'), ('reconcile', 'Сверка с выпиской'), ('categorize', 'Применение правил категоризации')], max_length=20, verbose_name='Вид'),
+        ),
+        migrations.CreateModel(
+            name='CategorizationRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('priority', models.PositiveIntegerField(default=100, help_text='Правила проверяются по возрастанию приоритета.', verbose_name='Приоритет')),
+                ('keyword', models.CharField(blank=True, help_text='Ищется в комментарии без учета регистра.', max_length=200, verbose_name='Ключевое слово')),
+                ('pattern', models.CharField(blank=True, help_text='Ищется в комментарии без учета регистра.', max_length=200, verbose_name='Регулярное выражение')),
+                ('min_amount', cash_flow.fields.MoneyField(blank=True, null=True, verbose_name='Сумма от')),
+                ('max_amount', cash_flow.fields.MoneyField(blank=True, null=True, verbose_name='Сумма до')),
+                ('currency', models.CharField(blank=True, choices=[('RUB', 'Российский рубль'), ('USD', 'Доллар США'), ('EUR', 'Евро'), ('CNY', 'Китайский юань'), ('KZT', 'Казахстанский тенге')], max_length=3, verbose_name='Валюта')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Включено')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Изменено')),
+                ('subcategory', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='rules', to='cash_flow.subcategory', verbose_name='Подкатегория')),
+                ('tenant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='cash_flow.tenant', verbose_name='Организация')),
+            ],
+            options={
+                'verbose_name': 'Правило категоризации',
+                'verbose_name_plural': 'Правила категоризации',
+                'ordering': ['priority', 'id'],
+                'indexes': [models.Index(fields=['tenant', 'priority', 'id'], name='rule_tenant_priority_idx')],
+            },
+        ),
+    ]
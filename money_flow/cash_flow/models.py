@@ -1,43 +1,164 @@
-from django.db import models
+import re
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.db.models import (
+    Case, Count, F, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Cast, Coalesce, Round
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 
+from . import events
+from .fields import MoneyField
 
-class Status(models.Model):
-    """Модель для хранения статусов движения денежных средств."""
+
+class Currency(models.TextChoices):
+    """Валюты счетов (коды ISO 4217)."""
+    RUB = 'RUB', 'Российский рубль'
+    USD = 'USD', 'Доллар США'
+    EUR = 'EUR', 'Евро'
+    CNY = 'CNY', 'Китайский юань'
+    KZT = 'KZT', 'Казахстанский тенге'
+
+
+def reporting_currency() -> str:
+    """Возвращает валюту отчетности из настроек."""
+    return getattr(settings, 'CASH_FLOW_REPORTING_CURRENCY', Currency.RUB)
+
+
+class Tenant(models.Model):
+    """
+    Организация: владелец своих справочников и движений ДС. Пользователи
+    из users работают с ее данными (см. tenancy).
+    """
     name = models.CharField(
-        max_length=100,
+        max_length=200,
         unique=True,
         verbose_name="Название"
     )
+    users = models.ManyToManyField(
+        settings.AUTH_USER_MODEL,
+        blank=True,
+        related_name='cash_flow_tenants',
+        verbose_name="Пользователи"
+    )
+
+    class Meta:
+        verbose_name = "Организация"
+        verbose_name_plural = "Организации"
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class TenantQuerySet(models.QuerySet):
+    """QuerySet моделей, принадлежащих организации."""
+
+    def for_tenant(self, tenant_id):
+        """
+        Записи организации tenant_id. None не снимает ограничение, а дает
+        пустую выборку: данные без организации недоступны.
+        """
+        return self.filter(tenant_id=tenant_id)
+
+
+class TenantOwnedModel(models.Model):
+    """
+    Модель с организацией. Если организация не задана, она берется у
+    родителя (parent_field: тип у категории, категория у подкатегории,
+    подкатегория у движения ДС); clean() проверяет, что все ссылки на
+    справочники ведут в ту же организацию.
+    """
+    parent_field = None
+    reference_fields = ()
+
+    # Отдельный индекс не нужен: организация — первое поле составных
+    # индексов и ограничений уникальности модели.
+    tenant = models.ForeignKey(
+        Tenant,
+        on_delete=models.PROTECT,
+        related_name='+',
+        db_index=False,
+        verbose_name="Организация"
+    )
+
+    objects = TenantQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def inherit_tenant(self):
+        if self.tenant_id is None and self.parent_field:
+            parent_id = getattr(self, f'{self.parent_field}_id')
+            if parent_id is not None:
+                self.tenant_id = getattr(self, self.parent_field).tenant_id
+
+    def clean(self):
+        super().clean()
+        self.inherit_tenant()
+        foreign = [
+            name for name in self.reference_fields
+            if getattr(self, f'{name}_id') is not None
+            and getattr(self, name).tenant_id != self.tenant_id
+        ]
+        if foreign:
+            raise ValidationError({
+                name: 'Значение принадлежит другой организации.'
+                for name in foreign
+            })
+
+    def save(self, *args, **kwargs):
+        self.inherit_tenant()
+        super().save(*args, **kwargs)
+
+
+class Status(TenantOwnedModel):
+    """Модель для хранения статусов движения денежных средств."""
+    name = models.CharField(max_length=100, verbose_name="Название")
 
     class Meta:
         verbose_name = "Статус"
         verbose_name_plural = "Статусы"
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tenant', 'name'],
+                name='status_tenant_name_uniq'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Type(models.Model):
+class Type(TenantOwnedModel):
     """Модель для хранения типов движения денежных средств."""
-    name = models.CharField(
-        max_length=100,
-        unique=True,
-        verbose_name="Название"
-    )
+    name = models.CharField(max_length=100, verbose_name="Название")
 
     class Meta:
         verbose_name = "Тип"
         verbose_name_plural = "Типы"
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tenant', 'name'],
+                name='type_tenant_name_uniq'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Category(models.Model):
+class Category(TenantOwnedModel):
     """Модель для хранения категорий движения денежных средств."""
+    parent_field = 'type'
+    reference_fields = ('type',)
+
     name = models.CharField(max_length=100, verbose_name="Название")
     type = models.ForeignKey(
         Type,
@@ -50,14 +171,22 @@ class Category(models.Model):
         verbose_name = "Категория"
         verbose_name_plural = "Категории"
         ordering = ['name']
-        unique_together = ['name', 'type']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tenant', 'type', 'name'],
+                name='category_tenant_type_name_uniq'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.type})"
 
 
-class Subcategory(models.Model):
+class Subcategory(TenantOwnedModel):
     """Модель для хранения подкатегорий движения денежных средств."""
+    parent_field = 'category'
+    reference_fields = ('category',)
+
     name = models.CharField(max_length=100, verbose_name="Название")
     category = models.ForeignKey(
         Category,
@@ -70,14 +199,360 @@ class Subcategory(models.Model):
         verbose_name = "Подкатегория"
         verbose_name_plural = "Подкатегории"
         ordering = ['name']
-        unique_together = ['name', 'category']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tenant', 'category', 'name'],
+                name='subcategory_tenant_category_name_uniq'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.category})"
 
 
-class CashFlow(models.Model):
+class ChangeCounterManager(models.Manager):
+    """Менеджер глобального счетчика изменений."""
+
+    def reserve(self, count: int = 1) -> int:
+        """
+        Резервирует count последовательных номеров и возвращает последний.
+
+        Сначала выполняется UPDATE, поэтому блокировка строки счетчика
+        держится до конца внешней транзакции: записи получают номера в том
+        же порядке, в каком фиксируются.
+        """
+        with transaction.atomic(using=self.db):
+            updated = self.filter(pk=1).update(value=F('value') + count)
+            if not updated:
+                self.create(pk=1, value=count)
+            return self.filter(pk=1).values_list('value', flat=True).get()
+
+
+class ChangeCounter(models.Model):
+    """Счетчик, из которого выдаются номера изменений ленты синхронизации."""
+    value = models.BigIntegerField(default=0)
+
+    objects = ChangeCounterManager()
+
+    class Meta:
+        verbose_name = "Счетчик изменений"
+        verbose_name_plural = "Счетчики изменений"
+
+
+def _rate(base, quote):
+    """Подзапрос: последний курс base -> quote не позже даты записи."""
+    return Subquery(ExchangeRate.objects.filter(
+        base_currency=base,
+        quote_currency=quote,
+        date__lte=OuterRef('date_created'),
+    ).order_by('-date').values('rate')[:1])
+
+
+def _float_rate(base, quote):
+    # В SQLite курс без дробной части хранится целым числом, и деление
+    # на него было бы целочисленным.
+    return Cast(_rate(base, quote), models.FloatField())
+
+
+def _multiplier(base, quote):
+    """Множитель base -> quote: прямой курс или обратный к quote -> base."""
+    return Coalesce(
+        _float_rate(base, quote),
+        Value(1.0) / _float_rate(quote, base),
+        output_field=models.FloatField(),
+    )
+
+
+class CashFlowQuerySet(TenantQuerySet):
+    """
+    QuerySet движений ДС, который ведет номер изменения и для массовых
+    операций: bulk_create, bulk_update, update и delete.
+    """
+
+    def _reserve_for_pks(self):
+        """
+        Резервирует номера изменений для строк выборки.
+
+        Номер строки вычисляется как base + (id - min_id), поэтому его можно
+        присвоить одним UPDATE без загрузки строк. Возвращает выборку,
+        ограниченную зарезервированным диапазоном id, и выражение номера;
+        у выборки в _reserved сохраняются границы номеров для события, в
+        _tenants — организации ее строк (обычно одна, и тогда она известна
+        из того же запроса).
+        """
+        bounds = self.aggregate(
+            low=Min('pk'), high=Max('pk'),
+            first_tenant=Min('tenant'), last_tenant=Max('tenant'),
+        )
+        if bounds['low'] is None:
+            return None, None
+        span = bounds['high'] - bounds['low'] + 1
+        last = ChangeCounter.objects.db_manager(self.db).reserve(span)
+        seq = F('pk') - bounds['low'] + (last - span + 1)
+        scoped = self.filter(pk__gte=bounds['low'], pk__lte=bounds['high'])
+        scoped._reserved = (last - span, last)
+        if bounds['first_tenant'] == bounds['last_tenant']:
+            scoped._tenants = [bounds['first_tenant']]
+        else:
+            scoped._tenants = list(
+                scoped.order_by('tenant_id').values_list(
+                    'tenant_id', flat=True
+                ).distinct()
+            )
+        return scoped, seq
+
+    def _publish_bulk(self, op, since, last, tenants):
+        """
+        Событие массовой операции для каждой организации затронутых строк:
+        подписчики и кеш результатов других организаций его не получают.
+        """
+        for tenant_id in tenants:
+            events.publish_on_commit(
+                events.bulk_event(op, since, last, tenant=tenant_id), self.db
+            )
+
+    def filter_by_params(self, params):
+        """
+        Применяет фильтры списка движений ДС из словаря параметров
+        (status, type, category, subcategory, currency, start_date,
+        end_date). Используется там, где нет запроса, например в задачах.
+        """
+        queryset = self
+        for field in ('status', 'type', 'category', 'subcategory', 'currency'):
+            if params.get(field):
+                queryset = queryset.filter(**{field: params[field]})
+        if params.get('start_date'):
+            queryset = queryset.filter(date_created__gte=params['start_date'])
+        if params.get('end_date'):
+            queryset = queryset.filter(date_created__lte=params['end_date'])
+        if params.get('flag'):
+            queryset = queryset.filter(flags__kind=params['flag'])
+        return queryset
+
+    def total_minor(self) -> int:
+        """Возвращает сумму amount в копейках, посчитанную в БД над целыми."""
+        return self.aggregate(
+            total=Sum('amount', output_field=models.BigIntegerField())
+        )['total'] or 0
+
+    def total(self) -> Decimal:
+        """Возвращает сумму amount в рублях."""
+        return self.model._meta.get_field('amount').from_minor(
+            self.total_minor()
+        )
+
+    def with_converted_amount(self, currency=None):
+        """
+        Добавляет converted_amount — сумму в валюте currency.
+
+        Курс берется в SQL коррелированным подзапросом «последний курс не
+        позже даты записи» по индексу (base, quote, date), без обращений
+        к БД из Python для каждой строки. Пары пробуются по очереди, и
+        следующая ищется, только если для предыдущей курса нет: прямая
+        (валюта записи -> currency), обратная (1 / курс currency -> валюта
+        записи) и кросс-курс через валюту отчетности (каждое плечо —
+        прямое или обратное). Если курса нет, значение NULL.
+        """
+        currency = currency or reporting_currency()
+        amount = Cast('amount', models.FloatField())
+        candidates = [
+            F('amount') * _rate(OuterRef('currency'), currency),
+            amount / _float_rate(currency, OuterRef('currency')),
+        ]
+        via = reporting_currency()
+        if via != currency:
+            candidates.append(
+                amount * _multiplier(OuterRef('currency'), via)
+                * _multiplier(via, currency)
+            )
+        return self.annotate(converted_amount=Case(
+            When(currency=currency, then=F('amount')),
+            default=Coalesce(*(
+                Cast(Round(candidate), models.BigIntegerField())
+                for candidate in candidates
+            )),
+            output_field=MoneyField(),
+        ))
+
+    def converted_total(self, currency=None):
+        """
+        Возвращает итог в валюте currency и число записей без курса
+        одним агрегирующим запросом.
+        """
+        result = self.order_by().with_converted_amount(currency).aggregate(
+            total=Sum('converted_amount'),
+            missing=Count('pk', filter=Q(converted_amount__isnull=True)),
+        )
+        result['total'] = result['total'] or Decimal('0.00')
+        return result
+
+    def converted_totals_by(self, *fields, currency=None):
+        """Итоги в валюте currency, сгруппированные по полям fields."""
+        return self.with_converted_amount(currency).order_by(*fields).values(
+            *fields
+        ).annotate(
+            total=Sum('converted_amount'),
+            count=Count('pk'),
+            missing=Count('pk', filter=Q(converted_amount__isnull=True)),
+        )
+
+    facet_fields = ('status', 'type', 'category', 'subcategory')
+
+    def facets(self, selected=None):
+        """
+        Счетчики и суммы по значениям status, type, category и subcategory.
+
+        Выполняется один GROUP BY по всем четырем полям и валюте, а
+        распределение по фасетам считается в Python. queryset не должен
+        содержать фильтров по этим полям: выбранные значения передаются
+        в selected ({поле: id}, например GET-параметры) и для каждого фасета учитываются все
+        выбранные значения, кроме его собственного. Так у каждого варианта
+        видно, сколько записей будет после его выбора.
+
+        Возвращает {поле: {id: {'count': n, 'amounts': {валюта: Decimal}}}};
+        суммы не пересчитываются между валютами.
+        """
+        selected = {
+            field: int(selected[field]) for field in self.facet_fields
+            if str(selected.get(field) or '').isdigit()
+        } if selected else {}
+        columns = [f'{field}_id' for field in self.facet_fields]
+        rows = self.order_by().values(*columns, 'currency').annotate(
+            count=Count('pk'),
+            amount=Sum('amount', output_field=models.BigIntegerField()),
+        )
+        amount_field = self.model._meta.get_field('amount')
+        facets = {field: {} for field in self.facet_fields}
+        for row in rows:
+            matched = {
+                field for field in self.facet_fields
+                if field not in selected or row[f'{field}_id'] == selected[field]
+            }
+            for field in self.facet_fields:
+                # Фасет учитывает строку, если она проходит все прочие фильтры.
+                if len(matched - {field}) < len(self.facet_fields) - 1:
+                    continue
+                bucket = facets[field].setdefault(
+                    row[f'{field}_id'], {'count': 0, 'amounts': {}}
+                )
+                bucket['count'] += row['count']
+                amounts = bucket['amounts']
+                amounts[row['currency']] = (
+                    amounts.get(row['currency'], 0) + row['amount']
+                )
+        for buckets in facets.values():
+            for bucket in buckets.values():
+                bucket['amounts'] = {
+                    currency: amount_field.from_minor(amount)
+                    for currency, amount in bucket['amounts'].items()
+                }
+        return facets
+
+    def _assign_sequences(self, objs, op):
+        last = ChangeCounter.objects.db_manager(self.db).reserve(len(objs))
+        for seq, obj in enumerate(objs, start=last - len(objs) + 1):
+            obj.change_seq = seq
+        self._publish_bulk(
+            op, last - len(objs), last,
+            sorted({obj.tenant_id for obj in objs}, key=lambda pk: pk or 0),
+        )
+
+    def _inherit_tenants(self, objs):
+        """
+        Проставляет организацию подкатегории записям без нее: из
+        загруженной подкатегории или одним запросом по их id.
+        """
+        missing = [obj for obj in objs if obj.tenant_id is None]
+        unloaded = {
+            obj.subcategory_id for obj in missing
+            if not self.model.subcategory.is_cached(obj)
+        }
+        tenants = dict(
+            Subcategory.objects.using(self.db).filter(
+                pk__in=unloaded
+            ).values_list('pk', 'tenant_id')
+        ) if unloaded else {}
+        for obj in missing:
+            if self.model.subcategory.is_cached(obj):
+                obj.tenant_id = obj.subcategory.tenant_id
+            else:
+                obj.tenant_id = tenants.get(obj.subcategory_id)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        if not objs:
+            return super().bulk_create(objs, *args, **kwargs)
+        self._inherit_tenants(objs)
+        with transaction.atomic(using=self.db):
+            self._assign_sequences(objs, 'bulk_create')
+            return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if not objs:
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        fields = list(fields)
+        if 'change_seq' not in fields:
+            fields.append('change_seq')
+        with transaction.atomic(using=self.db):
+            self._assign_sequences(objs, 'bulk_update')
+            return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        if 'change_seq' in kwargs:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            scoped, seq = self._reserve_for_pks()
+            if scoped is None:
+                return 0
+            kwargs['change_seq'] = seq
+            self._publish_bulk('bulk_update', *scoped._reserved, scoped._tenants)
+            return super(CashFlowQuerySet, scoped).update(**kwargs)
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            scoped, seq = self._reserve_for_pks()
+            if scoped is None:
+                return 0, {}
+            scoped._insert_tombstones(seq)
+            self._publish_bulk('bulk_delete', *scoped._reserved, scoped._tenants)
+            return super(CashFlowQuerySet, scoped).delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def _insert_tombstones(self, seq):
+        """Записывает надгробия для строк выборки одним INSERT ... SELECT."""
+        tombstones = CashFlowTombstone._meta
+        select = self.order_by().annotate(
+            _seq=seq,
+            _object_id=F('pk'),
+            _tenant=F('tenant'),
+            _deleted_at=Value(
+                timezone.now(), output_field=models.DateTimeField()
+            ),
+        ).values_list('_seq', '_object_id', '_tenant', '_deleted_at')
+        sql, params = select.query.get_compiler(self.db).as_sql()
+        connection = connections[self.db]
+        columns = ', '.join(
+            connection.ops.quote_name(tombstones.get_field(name).column)
+            for name in ('seq', 'object_id', 'tenant', 'deleted_at')
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {connection.ops.quote_name(tombstones.db_table)} '
+                f'({columns}) {sql}',
+                params
+            )
+
+
+class CashFlow(TenantOwnedModel):
     """Модель для хранения записей о движении денежных средств."""
+    parent_field = 'subcategory'
+    reference_fields = ('status', 'type', 'category', 'subcategory')
+
     date_created = models.DateField(verbose_name="Дата создания")
     status = models.ForeignKey(
         Status,
@@ -99,25 +574,478 @@ class CashFlow(models.Model):
         on_delete=models.PROTECT,
         verbose_name="Подкатегория"
     )
-    amount = models.DecimalField(
-        max_digits=10,
-        decimal_places=2,
-        validators=[MinValueValidator(0.01)],
-        verbose_name="Сумма (руб.)"
+    amount = MoneyField(
+        validators=[MinValueValidator(Decimal('0.01'))],
+        verbose_name="Сумма"
+    )
+    currency = models.CharField(
+        max_length=3,
+        choices=Currency.choices,
+        default=Currency.RUB,
+        verbose_name="Валюта"
     )
     comment = models.TextField(
         blank=True,
         null=True,
         verbose_name="Комментарий"
     )
+    change_seq = models.BigIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        verbose_name="Номер изменения"
+    )
+
+    objects = CashFlowQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Движение денежных средств"
         verbose_name_plural = "Движение денежных средств"
         ordering = ['-date_created']
+        indexes = [
+            models.Index(
+                fields=['tenant', 'date_created', 'id'],
+                name='cashflow_tenant_date_id_idx'
+            ),
+            models.Index(
+                fields=['tenant', 'change_seq'],
+                name='cashflow_tenant_seq_idx'
+            ),
+        ]
 
     def __str__(self):
         return (
             f"{self.date_created} - {self.type}"
-            f" - {self.category} - {self.amount} руб."
+            f" - {self.category} - {self.amount} {self.currency}"
+        )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Загруженные значения нужны событию об изменении (events.previous).
+        instance._loaded = (field_names, values)
+        return instance
+
+    def _loaded_state(self):
+        """
+        Значения полей фильтров подписок на момент последнего сохранения
+        или загрузки из БД.
+        """
+        if hasattr(self, '_saved_state'):
+            return self._saved_state
+        field_names, values = getattr(self, '_loaded', ((), ()))
+        loaded = dict(zip(field_names, values))
+        names = ['date_created', *(f'{f}_id' for f in events.FILTER_FIELDS)]
+        if not all(name in loaded for name in names):
+            return None
+        loaded['date_created'] = str(loaded['date_created'])
+        return events.cashflow_state(loaded)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'change_seq' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'change_seq']
+        using = kwargs.get('using') or router.db_for_write(
+            CashFlow, instance=self
+        )
+        op = 'create' if self._state.adding else 'update'
+        with transaction.atomic(using=using):
+            self.change_seq = ChangeCounter.objects.db_manager(using).reserve()
+            super().save(*args, **kwargs)
+            event = events.cashflow_event(self, op, self._loaded_state())
+            events.publish_on_commit(event, using)
+            self._saved_state = event.states[0]
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(
+            CashFlow, instance=self
+        )
+        with transaction.atomic(using=using):
+            tombstone = CashFlowTombstone.objects.using(using).create(
+                seq=ChangeCounter.objects.db_manager(using).reserve(),
+                object_id=self.pk,
+                tenant_id=self.tenant_id
+            )
+            events.publish_on_commit(
+                events.cashflow_event(self, 'delete', seq=tombstone.seq), using
+            )
+            return super().delete(*args, **kwargs)
+
+
+class CashFlowTombstone(models.Model):
+    """
+    Запись об удалении движения ДС для ленты изменений.
+
+    Номер seq выдается из того же счетчика, что и CashFlow.change_seq,
+    поэтому вставки, изменения и удаления упорядочены в одной шкале.
+    """
+    seq = models.BigIntegerField(unique=True, verbose_name="Номер изменения")
+    object_id = models.BigIntegerField(verbose_name="ID записи")
+    tenant = models.ForeignKey(
+        Tenant,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        null=True,
+        related_name='+',
+        verbose_name="Организация"
+    )
+    deleted_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Дата удаления"
+    )
+
+    class Meta:
+        verbose_name = "Удаленная запись"
+        verbose_name_plural = "Удаленные записи"
+        ordering = ['seq']
+        indexes = [
+            models.Index(
+                fields=['tenant', 'seq'],
+                name='tombstone_tenant_seq_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"#{self.object_id} (seq {self.seq})"
+
+
+class CashFlowFlag(models.Model):
+    """
+    Отметка о возможной ошибке в записи: дубль другой записи или выброс
+    по сумме в своей категории. Ставится задачей поиска (см. anomalies).
+
+    Ссылки на записи без ограничения в БД и каскада: иначе удаление
+    движений ДС загружало бы строки для сборщика каскадного удаления.
+    Отметки удаленных записей снимает следующий запуск поиска.
+    """
+
+    class Kind(models.TextChoices):
+        DUPLICATE = 'duplicate', 'Возможный дубль'
+        OUTLIER = 'outlier', 'Необычная сумма'
+
+    cashflow = models.ForeignKey(
+        CashFlow,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='flags',
+        verbose_name="Запись"
+    )
+    kind = models.CharField(
+        max_length=20,
+        choices=Kind.choices,
+        verbose_name="Вид"
+    )
+    related = models.ForeignKey(
+        CashFlow,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name="Исходная запись"
+    )
+    score = models.FloatField(verbose_name="Оценка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Найдена")
+
+    class Meta:
+        verbose_name = "Отметка записи"
+        verbose_name_plural = "Отметки записей"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['cashflow', 'kind'],
+                name='cashflowflag_cashflow_kind_uniq'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['kind', 'cashflow'],
+                name='cashflowflag_kind_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"#{self.cashflow_id}: {self.get_kind_display()}"
+
+
+class StoredFile(models.Model):
+    """
+    Содержимое вложения, хранимое по SHA-256 (см. attachments): одинаковые
+    файлы, загруженные несколько раз, лежат на диске один раз. Общее для
+    всех организаций; доступ к нему — только через Attachment.
+    """
+    digest = models.CharField(
+        max_length=64, unique=True, verbose_name="SHA-256"
+    )
+    size = models.BigIntegerField(verbose_name="Размер, байт")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Сохранен")
+
+    class Meta:
+        verbose_name = "Файл"
+        verbose_name_plural = "Файлы"
+
+    def __str__(self):
+        return self.digest
+
+
+class Attachment(TenantOwnedModel):
+    """
+    Вложение записи движения ДС (скан чека, PDF счета).
+
+    Ссылка на запись без ограничения в БД и каскада, как у CashFlowFlag:
+    вложения удаленных записей удаляет attachments.collect_garbage().
+    """
+    parent_field = 'cashflow'
+
+    cashflow = models.ForeignKey(
+        CashFlow,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name='attachments',
+        verbose_name="Запись"
+    )
+    file = models.ForeignKey(
+        StoredFile,
+        on_delete=models.PROTECT,
+        related_name='attachments',
+        verbose_name="Файл"
+    )
+    name = models.CharField(max_length=255, verbose_name="Имя файла")
+    content_type = models.CharField(max_length=100, verbose_name="Тип содержимого")
+    uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name="Загружен")
+
+    class Meta:
+        verbose_name = "Вложение"
+        verbose_name_plural = "Вложения"
+        ordering = ['uploaded_at', 'id']
+        indexes = [
+            models.Index(
+                fields=['tenant', 'cashflow'],
+                name='attachment_tenant_cashflow_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class CategorizationRuleQuerySet(TenantQuerySet):
+    """
+    QuerySet правил: update() (и bulk_update) тоже отмечает время
+    изменения, по которому rules.matcher замечает смену правил.
+    """
+
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        return super().update(**kwargs)
+
+
+class CategorizationRule(TenantOwnedModel):
+    """
+    Правило автоматической категоризации: записи, которая подходит под все
+    заданные условия, назначаются подкатегория правила, ее категория и
+    тип. Из подходящих правил действует первое по приоритету (см. rules).
+    """
+    parent_field = 'subcategory'
+    reference_fields = ('subcategory',)
+
+    name = models.CharField(max_length=100, verbose_name="Название")
+    priority = models.PositiveIntegerField(
+        default=100,
+        verbose_name="Приоритет",
+        help_text="Правила проверяются по возрастанию приоритета."
+    )
+    keyword = models.CharField(
+        max_length=200,
+        blank=True,
+        verbose_name="Ключевое слово",
+        help_text="Ищется в комментарии без учета регистра."
+    )
+    pattern = models.CharField(
+        max_length=200,
+        blank=True,
+        verbose_name="Регулярное выражение",
+        help_text="Ищется в комментарии без учета регистра."
+    )
+    min_amount = MoneyField(
+        null=True,
+        blank=True,
+        verbose_name="Сумма от"
+    )
+    max_amount = MoneyField(
+        null=True,
+        blank=True,
+        verbose_name="Сумма до"
+    )
+    currency = models.CharField(
+        max_length=3,
+        choices=Currency.choices,
+        blank=True,
+        verbose_name="Валюта"
+    )
+    subcategory = models.ForeignKey(
+        Subcategory,
+        on_delete=models.PROTECT,
+        related_name='rules',
+        verbose_name="Подкатегория"
+    )
+    is_active = models.BooleanField(default=True, verbose_name="Включено")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменено")
+
+    objects = CategorizationRuleQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Правило категоризации"
+        verbose_name_plural = "Правила категоризации"
+        ordering = ['priority', 'id']
+        indexes = [
+            models.Index(
+                fields=['tenant', 'priority', 'id'],
+                name='rule_tenant_priority_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        super().clean()
+        if not (self.keyword or self.pattern or self.min_amount is not None
+                or self.max_amount is not None):
+            raise ValidationError(
+                'Укажите ключевое слово, регулярное выражение или диапазон суммы.'
+            )
+        if self.pattern:
+            try:
+                re.compile(self.pattern)
+            except re.error as error:
+                raise ValidationError({'pattern': f'Ошибка в выражении: {error}'})
+        if (self.min_amount is not None and self.max_amount is not None
+                and self.min_amount > self.max_amount):
+            raise ValidationError({'max_amount': 'Меньше нижней границы суммы.'})
+
+
+class ExchangeRate(models.Model):
+    """
+    Курс валюты на дату: 1 единица base_currency стоит rate quote_currency.
+
+    Для даты без курса используется последний известный курс до нее.
+    Пересчет в обратную сторону идет по 1 / rate, а между валютами без
+    общего курса — через валюту отчетности (см. with_converted_amount).
+    """
+    date = models.DateField(verbose_name="Дата")
+    base_currency = models.CharField(
+        max_length=3,
+        choices=Currency.choices,
+        verbose_name="Валюта"
+    )
+    quote_currency = models.CharField(
+        max_length=3,
+        choices=Currency.choices,
+        verbose_name="Валюта котировки"
+    )
+    rate = models.DecimalField(
+        max_digits=18,
+        decimal_places=8,
+        validators=[MinValueValidator(Decimal('0.00000001'))],
+        verbose_name="Курс"
+    )
+
+    class Meta:
+        verbose_name = "Курс валюты"
+        verbose_name_plural = "Курсы валют"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['base_currency', 'quote_currency', 'date'],
+                name='exchangerate_pair_date_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.date}: 1 {self.base_currency} = "
+            f"{self.rate} {self.quote_currency}"
         )
+
+
+class Job(models.Model):
+    """
+    Фоновая задача (экспорт, импорт, отчет, сверка, категоризация),
+    выполняемая командой
+    run_jobs.
+
+    Очередь хранится в этой же таблице, поэтому внешний брокер не нужен.
+    """
+
+    class Kind(models.TextChoices):
+        EXPORT = 'export', 'Экспорт'
+        IMPORT = 'import', 'Импорт'
+        REPORT = 'report', 'Отчет'
+        DETECT = 'detect', 'Поиск дублей и выбросов'
+        RECONCILE = 'reconcile', 'Сверка с выпиской'
+        CATEGORIZE = 'categorize', 'Применение правил категоризации'
+
+    class State(models.TextChoices):
+        PENDING = 'pending', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        DONE = 'done', 'Выполнена'
+        FAILED = 'failed', 'Ошибка'
+        CANCELLED = 'cancelled', 'Отменена'
+
+    kind = models.CharField(
+        max_length=20,
+        choices=Kind.choices,
+        verbose_name="Вид"
+    )
+    tenant = models.ForeignKey(
+        Tenant,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name="Организация"
+    )
+    state = models.CharField(
+        max_length=20,
+        choices=State.choices,
+        default=State.PENDING,
+        verbose_name="Состояние"
+    )
+    params = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    progress_done = models.BigIntegerField(default=0, verbose_name="Обработано")
+    progress_total = models.BigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="Всего"
+    )
+    cancel_requested = models.BooleanField(
+        default=False,
+        verbose_name="Запрошена отмена"
+    )
+    result = models.JSONField(null=True, blank=True, verbose_name="Результат")
+    result_file = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name="Файл результата"
+    )
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начата")
+    finished_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Завершена"
+    )
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['state', 'id'], name='job_state_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.get_kind_display()} ({self.get_state_display()})"
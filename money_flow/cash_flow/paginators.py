@@ -0,0 +1,72 @@
+from typing import Optional
+
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+
+
+def estimate_table_rows(model, using: str = 'default') -> Optional[int]:
+    """
+    Возвращает оценку количества строк в таблице модели по статистике СУБД.
+
+    Используются pg_class.reltuples (PostgreSQL), information_schema
+    (MySQL) и sqlite_stat1 (SQLite, после ANALYZE). Если статистики нет,
+    возвращает None.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+    elif connection.vendor == 'mysql':
+        sql = (
+            'SELECT table_rows FROM information_schema.tables '
+            'WHERE table_schema = DATABASE() AND table_name = %s'
+        )
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master "
+                "WHERE type = 'table' AND name = 'sqlite_stat1'"
+            )
+            if cursor.fetchone() is None:
+                return None
+        sql = 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1'
+    else:
+        return None
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+
+    if row is None or row[0] is None:
+        return None
+    try:
+        estimate = int(str(row[0]).split()[0])
+    except ValueError:
+        return None
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор, который для нефильтрованных выборок по большим таблицам
+    берет количество строк из статистики СУБД вместо COUNT(*).
+
+    Отфильтрованные выборки и небольшие таблицы считаются точно.
+    """
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where and not query.distinct:
+            estimate = estimate_table_rows(
+                self.object_list.model, self.object_list.db
+            )
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        return super().count
@@ -0,0 +1,273 @@
+"""
+Профилирование отдельных запросов: cProfile, SQL с длительностью и
+планами EXPLAIN.
+
+Профиль снимается:
+- по запросу сотрудника (is_staff): параметр ?_profile=html|download или
+  заголовок X-Profile. html добавляет к странице панель с отчетом (для API
+  возвращается страница отчета), download отдает отчет JSON-файлом;
+- для доли CASH_FLOW_PROFILE_SAMPLE_RATE всех запросов — в кольцевой буфер
+  процесса на CASH_FLOW_PROFILE_BUFFER_SIZE профилей, который
+  суперпользователи просматривают на /cash_flow/profiles/.
+
+Профили по выборке хранят SQL без значений параметров, а профили по
+требованию — без параметров запросов к сессиям и пользователям.
+
+Когда профиль не снимается, middleware только проверяет строку запроса,
+заголовок и (если выборка включена) случайное число.
+"""
+import cProfile
+import io
+import itertools
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.http import HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+MODES = ('html', 'download')
+
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+}
+# Не больше стольких уникальных запросов получают EXPLAIN.
+EXPLAIN_LIMIT = 50
+STATS_LINES = 40
+# Параметры запросов к этим таблицам (ключи сессий, хеши паролей) в
+# профиль не попадают.
+SENSITIVE_TABLES = ('django_session', 'auth_')
+
+_ids = itertools.count(1)
+_buffer_lock = threading.Lock()
+_buffer = None
+
+
+def profile_buffer():
+    """Кольцевой буфер профилей процесса (новые в конце)."""
+    global _buffer
+    with _buffer_lock:
+        size = getattr(settings, 'CASH_FLOW_PROFILE_BUFFER_SIZE', 50)
+        if _buffer is None or _buffer.maxlen != size:
+            _buffer = deque(_buffer or (), maxlen=size)
+        return _buffer
+
+
+def get_profile(profile_id):
+    for profile in list(profile_buffer()):
+        if profile['id'] == profile_id:
+            return profile
+    return None
+
+
+class QueryRecorder:
+    """
+    execute_wrapper, который запоминает SQL, параметры и длительность.
+
+    Параметры не сохраняются при keep_params=False и для запросов к
+    таблицам сессий и пользователей (SENSITIVE_TABLES): вместо них
+    запоминается только их число, а запрос помечается redacted.
+    """
+
+    def __init__(self, keep_params=True):
+        self.keep_params = keep_params
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            redacted = not many and params is not None and not (
+                self.keep_params and not is_sensitive(sql)
+            )
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'params': None if many or redacted else params,
+                'param_count': len(params) if redacted else None,
+                'redacted': redacted,
+                'many': many,
+                'duration_ms': (time.perf_counter() - started) * 1000,
+            })
+
+
+def is_sensitive(sql):
+    """Обращается ли запрос к таблицам с сессиями или учетными данными."""
+    sql = sql.lower()
+    return any(table in sql for table in SENSITIVE_TABLES)
+
+
+def explain(query):
+    """План запроса SELECT или None для остальных и executemany."""
+    sql = query['sql'].lstrip().upper()
+    if query['many'] or not sql.startswith(('SELECT', 'WITH')):
+        return None
+    connection = connections[query['alias']]
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+    if prefix is None:
+        return None
+    params = query['params']
+    if query['redacted']:
+        # Без значений параметров план строится для NULL на их местах.
+        params = [None] * query['param_count']
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + query['sql'], params)
+            rows = cursor.fetchall()
+    except DatabaseError as error:
+        return f'EXPLAIN не выполнен: {error}'
+    return '\n'.join(' | '.join(str(value) for value in row) for row in rows)
+
+
+def add_explains(profile):
+    """Добавляет планы к запросам профиля (один EXPLAIN на текст SQL)."""
+    if profile.get('explained'):
+        return profile
+    plans = {}
+    for query in profile['queries']:
+        key = (query['alias'], query['sql'])
+        if key not in plans and len(plans) < EXPLAIN_LIMIT:
+            plans[key] = explain(query)
+        query['explain'] = plans.get(key)
+    profile['explained'] = True
+    return profile
+
+
+def profile_request(request, get_response, sampled):
+    """Выполняет запрос под cProfile и записью SQL; возвращает ответ и профиль."""
+    recorder = QueryRecorder(keep_params=not sampled)
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        profiler.enable()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+    duration = (time.perf_counter() - started) * 1000
+
+    stats = io.StringIO()
+    pstats.Stats(profiler, stream=stats).sort_stats('cumulative').print_stats(
+        STATS_LINES
+    )
+    user = getattr(request, 'user', None)
+    profile = {
+        'id': next(_ids),
+        'created_at': timezone.now(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'user': str(user) if user is not None and user.is_authenticated else '',
+        'sampled': sampled,
+        'duration_ms': duration,
+        'sql_ms': sum(query['duration_ms'] for query in recorder.queries),
+        'queries': recorder.queries,
+        'stats': stats.getvalue(),
+        'explained': False,
+    }
+    profile_buffer().append(profile)
+    return response, profile
+
+
+def profile_as_json(profile):
+    return {
+        **profile,
+        'created_at': profile['created_at'].isoformat(),
+        'queries': [
+            {**query, 'params': [str(value) for value in query['params'] or ()]}
+            for query in profile['queries']
+        ],
+    }
+
+
+def download_response(profile):
+    response = JsonResponse(
+        profile_as_json(profile), json_dumps_params={'ensure_ascii': False}
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="profile-{profile["id"]}.json"'
+    )
+    return response
+
+
+class ProfilingMiddleware:
+    """
+    Снимает профиль запроса по требованию сотрудника или для выборки
+    запросов (см. модуль). Ставится после AuthenticationMiddleware.
+
+    Профилируются синхронные запросы (WSGI). Под ASGI middleware запросы
+    не профилирует и только передает дальше, чтобы не переключать потоки
+    (поток событий SSE).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        mode = self.requested_mode(request)
+        sample_rate = getattr(settings, 'CASH_FLOW_PROFILE_SAMPLE_RATE', 0)
+        if mode is None:
+            if sample_rate and random.random() < sample_rate:
+                return profile_request(request, self.get_response, True)[0]
+            return self.get_response(request)
+
+        response, profile = profile_request(request, self.get_response, False)
+        if response.streaming:
+            return response
+        add_explains(profile)
+        if mode == 'download':
+            return download_response(profile)
+        return self.html_response(request, response, profile)
+
+    def requested_mode(self, request):
+        if (PROFILE_PARAM not in request.META.get('QUERY_STRING', '')
+                and PROFILE_HEADER not in request.META):
+            return None
+        mode = request.GET.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER)
+        if mode not in MODES:
+            return None
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_staff:
+            return None
+        return mode
+
+    def html_response(self, request, response, profile):
+        panel = render_to_string(
+            'cash_flow/profile_panel.html', {'profile': profile}, request
+        )
+        content_type = response.get('Content-Type', '')
+        if content_type.startswith('text/html') and b'</body>' in response.content:
+            response.content = response.content.replace(
+                b'</body>', panel.encode(response.charset) + b'</body>', 1
+            )
+            if response.has_header('Content-Length'):
+                response['Content-Length'] = len(response.content)
+            return response
+        return HttpResponse(render_to_string(
+            'cash_flow/profile_detail.html', {'profile': profile}, request
+        ))
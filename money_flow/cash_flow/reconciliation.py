@@ -0,0 +1,227 @@
+"""
+Сверка банковской выписки с движениями ДС.
+
+Выписка — CSV с колонками date, amount, currency (необязательна, по
+умолчанию RUB) и description. Суммы сравниваются по модулю: в выписке
+списания обычно отрицательные, а в учете направление задает тип.
+
+1. Записи-кандидаты организации читаются одним запросом по диапазону
+   дат выписки (± tolerance_days) и ее валютам; уже сверенные (со
+   статусом matched_status) не берутся.
+2. Точное совпадение — по хеш-индексу (дата, валюта, сумма).
+3. Оставшиеся строки и записи с одинаковыми валютой и суммой сортируются
+   по дате и сливаются двумя указателями: пара сопоставляется, если даты
+   расходятся не больше чем на tolerance_days.
+4. Сопоставленным записям назначается статус matched_status одним UPDATE
+   на пакет id.
+"""
+import csv
+import datetime
+from collections import defaultdict
+from decimal import InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import BigIntegerField, ExpressionWrapper, F
+
+from .models import CashFlow, Currency, Status
+
+
+DEFAULT_TOLERANCE_DAYS = 3
+UPDATE_BATCH_SIZE = 900
+REPORT_HEADER = [
+    'result', 'line', 'cashflow_id', 'date', 'amount', 'currency', 'description'
+]
+
+
+def parse_statement(lines):
+    """
+    Читает строки выписки. Возвращает записи (номер строки, день
+    (ordinal), валюта, сумма в копейках, описание) и номера строк с
+    ошибками.
+    """
+    amount_field = CashFlow._meta.get_field('amount')
+    known = set(Currency.values)
+    entries = []
+    errors = []
+    for line_number, row in enumerate(csv.DictReader(lines), start=2):
+        try:
+            day = datetime.date.fromisoformat(row['date'].strip()).toordinal()
+            amount = row['amount'].strip().replace('\xa0', '').replace(' ', '')
+            minor = abs(amount_field.to_minor(amount.replace(',', '.')))
+            currency = (row.get('currency') or Currency.RUB).strip().upper()
+            if currency not in known:
+                raise ValueError(currency)
+        except (KeyError, AttributeError, ValueError, InvalidOperation,
+                ValidationError):
+            errors.append(line_number)
+            continue
+        entries.append(
+            (line_number, day, currency, minor, row.get('description') or '')
+        )
+    return entries, errors
+
+
+def ledger_window(entries, tolerance_days, exclude_status=None, using='default',
+                  tenant_id=None):
+    """
+    Записи учета организации tenant_id в диапазоне дат и валютах выписки
+    одним запросом: список (id, день (ordinal), валюта, сумма в копейках).
+    """
+    if not entries:
+        return []
+    days = [entry[1] for entry in entries]
+    queryset = CashFlow.objects.using(using).for_tenant(tenant_id).filter(
+        date_created__gte=datetime.date.fromordinal(min(days) - tolerance_days),
+        date_created__lte=datetime.date.fromordinal(max(days) + tolerance_days),
+        currency__in={entry[2] for entry in entries},
+    )
+    if exclude_status:
+        queryset = queryset.exclude(status=exclude_status)
+    rows = queryset.order_by().annotate(
+        amount_minor=ExpressionWrapper(F('amount'), output_field=BigIntegerField())
+    ).values_list('pk', 'date_created', 'currency', 'amount_minor')
+    return [
+        (pk, date.toordinal(), currency, amount)
+        for pk, date, currency, amount in rows.iterator(chunk_size=10000)
+    ]
+
+
+def match(entries, ledger, tolerance_days=DEFAULT_TOLERANCE_DAYS):
+    """
+    Сопоставляет строки выписки с записями учета. Возвращает пары
+    (строка, id записи, 'exact' или 'fuzzy'), несопоставленные строки
+    и несопоставленные записи.
+    """
+    # Индексируются только записи с суммами из выписки: остальные
+    # не сопоставятся ни точно, ни по дате.
+    amounts = {entry[3] for entry in entries}
+    exact = defaultdict(list)
+    for pk, day, currency, amount in ledger:
+        if amount in amounts:
+            exact[(day, currency, amount)].append(pk)
+
+    matches = []
+    remaining = []
+    for entry in entries:
+        candidates = exact.get(entry[1:4])
+        if candidates:
+            matches.append((entry, candidates.pop(), 'exact'))
+        else:
+            remaining.append(entry)
+
+    # Нечеткий проход: по каждой паре (валюта, сумма) строки и записи,
+    # отсортированные по дате, сливаются двумя указателями.
+    rows_by_amount = defaultdict(list)
+    for (day, currency, amount), pks in exact.items():
+        for pk in pks:
+            rows_by_amount[(currency, amount)].append((day, pk))
+    lines_by_amount = defaultdict(list)
+    for entry in remaining:
+        lines_by_amount[entry[2:4]].append(entry)
+
+    unmatched_lines = []
+    for key, lines in lines_by_amount.items():
+        rows = sorted(rows_by_amount.get(key, ()))
+        lines.sort(key=lambda entry: entry[1])
+        i = j = 0
+        while i < len(lines) and j < len(rows):
+            difference = rows[j][0] - lines[i][1]
+            if abs(difference) <= tolerance_days:
+                matches.append((lines[i], rows[j][1], 'fuzzy'))
+                i += 1
+                j += 1
+            elif difference < 0:
+                j += 1
+            else:
+                unmatched_lines.append(lines[i])
+                i += 1
+        unmatched_lines.extend(lines[i:])
+
+    matched = {pk for _, pk, _ in matches}
+    unmatched_ledger = [row for row in ledger if row[0] not in matched]
+    unmatched_lines.sort()
+    return matches, unmatched_lines, unmatched_ledger
+
+
+def mark_matched(pks, status, using='default'):
+    """Назначает записям статус сверки пакетами UPDATE без загрузки строк."""
+    pks = sorted(pks)
+    marked = 0
+    with transaction.atomic(using=using):
+        for start in range(0, len(pks), UPDATE_BATCH_SIZE):
+            batch = pks[start:start + UPDATE_BATCH_SIZE]
+            marked += CashFlow.objects.using(using).filter(
+                pk__in=batch
+            ).update(status=status)
+    return marked
+
+
+def reconcile(lines, tolerance_days=DEFAULT_TOLERANCE_DAYS,
+              matched_status=None, using='default', tenant_id=None):
+    """
+    Сверяет выписку (итерируемые строки CSV) с учетом организации
+    tenant_id; при matched_status (статус той же организации) назначает
+    его сопоставленным записям. Возвращает словарь с парами,
+    несопоставленными строками и записями и строками с ошибками.
+    """
+    if matched_status and not Status.objects.using(using).for_tenant(
+            tenant_id).filter(pk=matched_status).exists():
+        raise ValueError(f'Статус {matched_status} не найден в организации.')
+    entries, errors = parse_statement(lines)
+    ledger = ledger_window(
+        entries, tolerance_days, matched_status, using, tenant_id
+    )
+    matches, unmatched_lines, unmatched_ledger = match(
+        entries, ledger, tolerance_days
+    )
+    marked = 0
+    if matched_status and matches:
+        marked = mark_matched([pk for _, pk, _ in matches], matched_status, using)
+    return {
+        'lines': len(entries),
+        'ledger': len(ledger),
+        'matches': matches,
+        'unmatched_lines': unmatched_lines,
+        'unmatched_ledger': unmatched_ledger,
+        'error_lines': errors,
+        'marked': marked,
+    }
+
+
+def summary(result, limit=100):
+    """Краткий итог сверки для результата задачи."""
+    kinds = [kind for _, _, kind in result['matches']]
+    return {
+        'lines': result['lines'],
+        'ledger': result['ledger'],
+        'exact': kinds.count('exact'),
+        'fuzzy': kinds.count('fuzzy'),
+        'marked': result['marked'],
+        'unmatched_lines': [entry[0] for entry in result['unmatched_lines'][:limit]],
+        'unmatched_lines_count': len(result['unmatched_lines']),
+        'unmatched_ledger': [row[0] for row in result['unmatched_ledger'][:limit]],
+        'unmatched_ledger_count': len(result['unmatched_ledger']),
+        'error_lines': result['error_lines'][:limit],
+    }
+
+
+def write_report(result, out):
+    """
+    Пишет отчет по всем строкам обеих сторон: exact/fuzzy — пары,
+    statement — строки выписки без пары, ledger — записи без пары.
+    """
+    amount_field = CashFlow._meta.get_field('amount')
+
+    def values(day, amount):
+        return datetime.date.fromordinal(day).isoformat(), amount_field.from_minor(amount)
+
+    writer = csv.writer(out)
+    writer.writerow(REPORT_HEADER)
+    for entry, pk, kind in result['matches']:
+        line, day, currency, amount, description = entry
+        writer.writerow([kind, line, pk, *values(day, amount), currency, description])
+    for line, day, currency, amount, description in result['unmatched_lines']:
+        writer.writerow(['statement', line, '', *values(day, amount), currency, description])
+    for pk, day, currency, amount in result['unmatched_ledger']:
+        writer.writerow(['ledger', '', pk, *values(day, amount), currency, ''])
@@ -0,0 +1,280 @@
+"""
+Кеш результатов списка движений ДС: отрисованных страниц веб-интерфейса
+и данных ответов /api/cashflows/.
+
+Ключ записи — вид списка, организация, хост, путь, нормализованные
+параметры запроса (фильтры, сортировка, страница) и текущие версии
+областей, от которых зависит результат. Запись в кеше не удаляется: после изменения данных
+меняется версия области, и запись становится недостижимой, а ее место
+освобождает вытеснение кеша (LRU по MAX_ENTRIES и TIMEOUT у LocMemCache).
+
+Области (версия каждой хранится в том же кеше):
+- all — все записи всех организаций; меняется при изменениях курсов и
+  событиях без организации;
+- flag — список с фильтром по отметкам; меняется при поиске аномалий по
+  всем организациям;
+- остальные области — в пределах организации (префикс t<id>:):
+  t<id>:all — меняется при изменениях справочников организации и
+  массовых операциях CashFlowQuerySet над ее записями;
+  t<id>:flag — список с фильтром по отметкам организации;
+  t<id>:rows — список без фильтров по периоду и справочникам;
+  t<id>:month:<ГГГГ-ММ> — записи месяца;
+  t<id>:<поле>:<id> и t<id>:<поле>:<id>:<ГГГГ-ММ> — записи со значением
+  справочника (status, type, category, subcategory), всего и за месяц.
+
+Запись зависит от all, t<id>:all и самой узкой области ее фильтров:
+например, список подкатегории за март — от t<id>:subcategory:<id>:2024-03.
+Изменение записи движения ДС меняет версии областей ее организации, в
+которые она входила до и после изменения (по событию из cash_flow.events
+после фиксации), поэтому сбрасываются только результаты, которые могли
+ее включать, и никогда — результаты других организаций.
+
+Счетчики попаданий и промахов — в cash_flow.metrics
+(resultcache.<вид>.hit/miss), доля попаданий — hit_ratios().
+
+Кеш общий для процессов только с общим бэкендом (например, RedisCache):
+с LocMemCache изменения из других процессов (воркеры фоновых задач,
+другие процессы веб-сервера) видны после истечения TIMEOUT.
+"""
+import datetime
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponse
+
+from . import metrics, tenancy
+
+
+CACHE_PREFIX = 'cashflow-results'
+# Поля справочников от самого избирательного.
+SCOPE_FIELDS = ('subcategory', 'category', 'type', 'status')
+# Период длиннее стольких месяцев считается неограниченным.
+MAX_SCOPE_MONTHS = 24
+# Параметры, не влияющие на результат.
+IGNORED_PARAMS = ('_profile',)
+SCOPES = ('list', 'api')
+
+
+def results_cache():
+    """Кеш CASH_FLOW_RESULT_CACHE или None, если кеш результатов выключен."""
+    alias = getattr(settings, 'CASH_FLOW_RESULT_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def _month(value):
+    return str(value)[:7]
+
+
+def _months(start, end):
+    if end < start:
+        return []
+    count = (end.year - start.year) * 12 + end.month - start.month + 1
+    if count > MAX_SCOPE_MONTHS:
+        return None
+    index = start.year * 12 + start.month - 1
+    return [
+        f'{(index + i) // 12:04d}-{(index + i) % 12 + 1:02d}'
+        for i in range(count)
+    ]
+
+
+def _date(value):
+    try:
+        return datetime.date.fromisoformat(value or '')
+    except ValueError:
+        return None
+
+
+def dependencies(params, tenant_id, fk_scoped=True, exact_date=True):
+    """
+    Области, от которых зависит результат организации tenant_id с
+    параметрами params. Без
+    fk_scoped фильтры по справочникам не сужают область (страница с
+    фасетами считает записи и по другим значениям справочников); без
+    exact_date параметр date_created не считается фильтром.
+    """
+    prefix = f't{tenant_id}:'
+    names = ['all', f'{prefix}all']
+    if params.get('flag'):
+        names.extend(['flag', f'{prefix}flag'])
+    if exact_date and params.get('date_created'):
+        start = end = _date(params.get('date_created'))
+    else:
+        start, end = _date(params.get('start_date')), _date(params.get('end_date'))
+    months = _months(start, end) if start and end else None
+
+    field = None
+    if fk_scoped:
+        for name in SCOPE_FIELDS:
+            value = params.get(name) or ''
+            if value.isdigit():
+                field, pk = name, int(value)
+                break
+    if field and months is not None:
+        names.extend(f'{prefix}{field}:{pk}:{month}' for month in months)
+    elif field:
+        names.append(f'{prefix}{field}:{pk}')
+    elif months is not None:
+        names.extend(f'{prefix}month:{month}' for month in months)
+    else:
+        names.append(f'{prefix}rows')
+    return names
+
+
+def state_dependencies(state, tenant_id):
+    """
+    Области организации tenant_id, в которые входит запись с полями
+    state (events.cashflow_state).
+    """
+    prefix = f't{tenant_id}:'
+    month = _month(state['date_created'])
+    names = [f'{prefix}rows', f'{prefix}month:{month}']
+    for field in SCOPE_FIELDS:
+        names.append(f'{prefix}{field}:{state[field]}')
+        names.append(f'{prefix}{field}:{state[field]}:{month}')
+    return names
+
+
+def _version_key(name):
+    return f'{CACHE_PREFIX}:v:{name}'
+
+
+def _token():
+    # Новая версия никогда не совпадает с прежней, даже если ключ версии
+    # был вытеснен из кеша.
+    return uuid.uuid4().hex[:16]
+
+
+def versions(cache, names):
+    keys = [_version_key(name) for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            token = _token()
+            cache.add(key, token, timeout=None)
+            found[key] = cache.get(key) or token
+    return [found[key] for key in keys]
+
+
+def invalidate(*names):
+    """Меняет версии областей names: зависящие от них результаты сбрасываются."""
+    cache = results_cache()
+    if cache is None or not names:
+        return
+    cache.set_many(
+        {_version_key(name): _token() for name in set(names)}, timeout=None
+    )
+    metrics.increment('resultcache.invalidations')
+
+
+def invalidate_all():
+    invalidate('all')
+
+
+def event_committed(event):
+    """
+    Слушатель событий (events.listeners): изменение записи движения ДС
+    сбрасывает области ее состояний до и после изменения, изменение
+    справочника и массовые операции — все результаты организации
+    события, событие без организации — все результаты.
+    """
+    if event.tenant is None:
+        invalidate_all()
+    elif event.model == 'cashflow' and event.states:
+        names = set()
+        for state in event.states:
+            names.update(state_dependencies(state, event.tenant))
+        invalidate(*names)
+    else:
+        invalidate(f't{event.tenant}:all')
+
+
+def lookup(request, scope, names, using='default'):
+    """
+    Ищет результат запроса request вида scope ('list' или 'api'), который
+    зависит от областей names (см. dependencies). Возвращает (ключ,
+    значение): значение None — промах, ключ None — запрос не кешируется
+    (не GET, профилирование, нет организации, открытая транзакция:
+    незафиксированные данные не должны попадать в общий кеш, а откат не
+    меняет версий).
+    """
+    cache = results_cache()
+    tenant_id = tenancy.current_tenant_id(request)
+    if (cache is None or request.method != 'GET' or tenant_id is None
+            or any(name in request.GET for name in IGNORED_PARAMS)
+            or connections[using].in_atomic_block):
+        return None, None
+    params = sorted(
+        (name, value)
+        for name, values in request.GET.lists()
+        for value in values
+        if value != ''
+    )
+    parts = [
+        scope, str(tenant_id), request.get_host(), request.path,
+        '&'.join(f'{name}={value}' for name, value in params),
+        '.'.join(versions(cache, names)),
+    ]
+    key = f'{CACHE_PREFIX}:e:' + hashlib.sha1(
+        '\n'.join(parts).encode()
+    ).hexdigest()
+    value = cache.get(key)
+    metrics.increment(f'resultcache.{scope}.{"miss" if value is None else "hit"}')
+    return key, value
+
+
+def store(key, value):
+    if key is not None:
+        results_cache().set(key, value)
+
+
+def hit_ratios():
+    """Попадания, промахи и доля попаданий по видам списков."""
+    counters = metrics.snapshot()
+    ratios = {}
+    for scope in SCOPES:
+        hits = counters.get(f'resultcache.{scope}.hit', 0)
+        misses = counters.get(f'resultcache.{scope}.miss', 0)
+        ratios[scope] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+    return ratios
+
+
+class CachedListMixin:
+    """
+    Для ListView: отдает отрисованную страницу из кеша результатов.
+    Сохраняются только страницы, одинаковые для всех пользователей
+    организации: без сообщений (messages) и без CSRF-токена. result_cache_scope = None
+    выключает кеш (например, для выгрузки).
+    """
+    result_cache_scope = 'list'
+
+    def dispatch(self, request, *args, **kwargs):
+        key = None
+        tenant_id = tenancy.current_tenant_id(request)
+        if (self.result_cache_scope and tenant_id is not None
+                and not len(messages.get_messages(request))):
+            # На странице есть фасеты по всем значениям справочников,
+            # поэтому область сужает только период.
+            names = dependencies(
+                request.GET, tenant_id, fk_scoped=False, exact_date=False
+            )
+            key, content = lookup(request, self.result_cache_scope, names)
+            if content is not None:
+                return HttpResponse(content)
+        response = super().dispatch(request, *args, **kwargs)
+        if (key is not None and response.status_code == 200
+                and not response.streaming
+                and not request.META.get('CSRF_COOKIE_USED')
+                and not len(messages.get_messages(request))):
+            if hasattr(response, 'render'):
+                response.render()
+            store(key, response.content)
+        return response
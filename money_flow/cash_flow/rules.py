@@ -0,0 +1,264 @@
+"""
+Автоматическая категоризация движений ДС по правилам организации.
+
+Правило (CategorizationRule) задает условия — ключевое слово и
+регулярное выражение в комментарии (без учета регистра), диапазон суммы,
+валюту — и подкатегорию, которая вместе со своими категорией и типом
+назначается записи. Условия правила объединяются через И; из подходящих
+правил действует первое по приоритету, затем по id.
+
+Правила применяются при создании записи в форме и через API (в том числе
+пакетом — списком в POST /api/cashflows/), если подкатегория не указана,
+при импорте строк без категорий и командой apply_rules ко всей истории.
+
+Компиляция (RuleMatcher). Ключевые слова всех правил собираются в одно
+регулярное выражение по префиксному дереву внутри просмотра вперед:
+один проход finditer по комментарию находит в каждой позиции самое
+длинное слово, а остальные слова, начинающиеся там же, — его префиксы,
+заранее сопоставленные ему (prefix_rules). Так за один проход в C-коде
+модуля re находятся все вхождения всех слов, как в автомате
+Ахо — Корасик. Регулярные выражения правил проверяются по одному и только
+для кандидатов, до которых дошла очередь по приоритету. Кандидаты
+одинаковых комментариев (повторяющиеся банковские строки) кешируются.
+
+matcher(tenant_id) хранит скомпилированные правила в процессе и
+пересобирает их, только когда правила изменились: отпечаток читается
+одним запросом. В него входят число правил, время последнего изменения
+(его обновляют и save(), и update() выборки правил) и суммы id категорий
+и типов подкатегорий правил — чтобы перенос подкатегории в другую
+категорию тоже пересобирал правила.
+"""
+import re
+import threading
+from collections import defaultdict
+
+from django.db import connections, transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.expressions import RawSQL
+
+from .models import CashFlow, CategorizationRule, Currency
+
+
+NO_RULE_MESSAGE = (
+    'Укажите подкатегорию: ни одно правило категоризации не подошло.'
+)
+APPLY_BATCH_SIZE = 2000
+ASSIGNMENT_TABLE = 'cash_flow_rule_assignment'
+CANDIDATES_CACHE_SIZE = 10000
+
+_lock = threading.Lock()
+_compiled = {}
+
+
+def _trie_pattern(words):
+    """
+    Альтернатива слов по префиксному дереву: общие префиксы не
+    повторяются, а окончание слова — необязательное жадное продолжение
+    ветки, поэтому в каждой позиции совпадает самое длинное слово.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def emit(node):
+        branches = [
+            re.escape(char) + emit(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f'(?:{"|".join(branches)})'
+        return f'(?:{body})?' if '' in node else body
+
+    return emit(trie)
+
+
+class RuleMatcher:
+    """Скомпилированные правила организации (см. модуль)."""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        keyword_rules = defaultdict(list)
+        self.keywordless = []
+        self.patterns = {}
+        for index, rule in enumerate(self.rules):
+            if rule.keyword:
+                keyword_rules[rule.keyword.lower()].append(index)
+            else:
+                self.keywordless.append(index)
+            if rule.pattern:
+                self.patterns[index] = re.compile(rule.pattern, re.IGNORECASE)
+        self.prefix_rules = {
+            word: [
+                index
+                for length in range(1, len(word) + 1)
+                for index in keyword_rules.get(word[:length], ())
+            ]
+            for word in keyword_rules
+        }
+        self.keywords = re.compile(
+            f'(?=({_trie_pattern(keyword_rules)}))'
+        ) if keyword_rules else None
+        self._candidates = {}
+
+    def __len__(self):
+        return len(self.rules)
+
+    def candidates(self, text):
+        """Номера правил, ключевые слова которых есть в text, и правил без слов."""
+        if self.keywords is None:
+            return self.keywordless
+        found = self._candidates.get(text)
+        if found is None:
+            found = set(self.keywordless)
+            for match in self.keywords.finditer(text.lower()):
+                found.update(self.prefix_rules[match.group(1)])
+            found = sorted(found)
+            if len(self._candidates) >= CANDIDATES_CACHE_SIZE:
+                self._candidates.clear()
+            self._candidates[text] = found
+        return found
+
+    def match(self, comment, amount, currency=Currency.RUB):
+        """Первое по приоритету правило, подходящее записи, или None."""
+        text = comment or ''
+        for index in self.candidates(text):
+            rule = self.rules[index]
+            if rule.currency and rule.currency != currency:
+                continue
+            if rule.min_amount is not None and (
+                    amount is None or amount < rule.min_amount):
+                continue
+            if rule.max_amount is not None and (
+                    amount is None or amount > rule.max_amount):
+                continue
+            pattern = self.patterns.get(index)
+            if pattern is not None and pattern.search(text) is None:
+                continue
+            return rule
+        return None
+
+
+def matcher(tenant_id):
+    """Скомпилированные активные правила организации tenant_id."""
+    rules = CategorizationRule.objects.for_tenant(tenant_id)
+    fingerprint = tuple(rules.aggregate(
+        count=Count('pk'), changed=Max('updated_at'),
+        categories=Sum('subcategory__category_id'),
+        types=Sum('subcategory__category__type_id'),
+    ).values())
+    with _lock:
+        cached = _compiled.get(tenant_id)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    compiled = RuleMatcher(
+        rules.filter(is_active=True).select_related('subcategory__category__type')
+    )
+    with _lock:
+        _compiled[tenant_id] = (fingerprint, compiled)
+    return compiled
+
+
+def categorize(values, rule_matcher):
+    """
+    Заполняет в values (cleaned_data формы, validated_data сериализатора)
+    тип, категорию и подкатегорию. Указанная подкатегория дополняется
+    своими категорией и типом, без нее все три берутся из первого
+    подходящего правила. Возвращает False, если подкатегории нет и ни одно
+    правило не подошло.
+    """
+    subcategory = values.get('subcategory')
+    if subcategory is None:
+        rule = rule_matcher.match(
+            values.get('comment'), values.get('amount'),
+            values.get('currency') or Currency.RUB,
+        )
+        if rule is None:
+            return False
+        subcategory = values['subcategory'] = rule.subcategory
+        values['category'] = values['type'] = None
+    if values.get('category') is None:
+        values['category'] = subcategory.category
+    if values.get('type') is None:
+        values['type'] = values['category'].type
+    return True
+
+
+def _update_categories(using, changes):
+    """
+    Назначает записям (id, подкатегория) из changes подкатегорию, ее
+    категорию и тип одним UPDATE: пары пишутся executemany во временную
+    таблицу соединения, новые значения берутся из нее подзапросами.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(ASSIGNMENT_TABLE)
+    cashflows = connection.ops.quote_name(CashFlow._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE IF NOT EXISTS {table} ('
+            f'cashflow_id BIGINT PRIMARY KEY, type_id BIGINT NOT NULL, '
+            f'category_id BIGINT NOT NULL, subcategory_id BIGINT NOT NULL)'
+        )
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.executemany(
+            f'INSERT INTO {table} VALUES (%s, %s, %s, %s)',
+            [
+                (pk, subcategory.category.type_id, subcategory.category_id,
+                 subcategory.pk)
+                for pk, subcategory in changes
+            ]
+        )
+
+    def assigned(column):
+        return RawSQL(
+            f'SELECT {column} FROM {table} WHERE cashflow_id = {cashflows}.id',
+            ()
+        )
+
+    CashFlow.objects.using(using).filter(
+        pk__in=RawSQL(f'SELECT cashflow_id FROM {table}', ())
+    ).update(
+        type_id=assigned('type_id'),
+        category_id=assigned('category_id'),
+        subcategory_id=assigned('subcategory_id'),
+    )
+
+
+def apply_rules(queryset, rule_matcher, batch_size=APPLY_BATCH_SIZE,
+                progress=None, dry_run=False):
+    """
+    Переназначает категории записям queryset по правилам rule_matcher.
+
+    Записи читаются пакетами по ключу (id > последнего), без загрузки
+    моделей; измененные записи пакета обновляются одним UPDATE в своей
+    транзакции (см. _update_categories). Записи без подходящего правила и уже с той же
+    подкатегорией не меняются. progress(done, total) вызывается после
+    каждого пакета. Возвращает число проверенных и измененных записей.
+    """
+    total = queryset.count() if progress is not None else None
+    rows = queryset.order_by('pk').values_list(
+        'pk', 'comment', 'amount', 'currency', 'subcategory_id'
+    )
+    checked = changed = 0
+    last_pk = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        changes = []
+        for pk, comment, amount, currency, subcategory_id in batch:
+            rule = rule_matcher.match(comment, amount, currency)
+            if rule is not None and rule.subcategory_id != subcategory_id:
+                changes.append((pk, rule.subcategory))
+        if changes and not dry_run:
+            with transaction.atomic(using=queryset.db):
+                _update_categories(queryset.db, changes)
+        checked += len(batch)
+        changed += len(changes)
+        last_pk = batch[-1][0]
+        if progress is not None:
+            progress(checked, total)
+    return {'checked': checked, 'changed': changed}
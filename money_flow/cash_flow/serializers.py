@@ -1,8 +1,19 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Status, Type, Category, Subcategory, CashFlow
+from rest_framework.fields import get_error_detail
+from . import rules
+from .attachments import validate_upload
+from .models import (
+    Status, Type, Category, Subcategory, CashFlow, CashFlowFlag, Job,
+    Attachment, CategorizationRule
+)
+from .tenancy import TenantSerializerMixin
 
 
-class StatusSerializer(serializers.ModelSerializer):
+class StatusSerializer(TenantSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Status.
     Преобразует объекты Status в JSON и обратно.
@@ -12,7 +23,7 @@ class StatusSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
-class TypeSerializer(serializers.ModelSerializer):
+class TypeSerializer(TenantSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Type.
     Преобразует объекты Type в JSON и обратно.
@@ -22,7 +33,7 @@ class TypeSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TenantSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Category.
     Включает информацию о связанном типе.
@@ -34,7 +45,7 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'type', 'type_name']
 
 
-class SubcategorySerializer(serializers.ModelSerializer):
+class SubcategorySerializer(TenantSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Subcategory.
     Включает информацию о связанной категории.
@@ -49,10 +60,22 @@ class SubcategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'category', 'category_name']
 
 
-class CashFlowSerializer(serializers.ModelSerializer):
+class CashFlowListSerializer(serializers.ListSerializer):
+    """Создание пакета записей (список в POST) одним bulk_create."""
+
+    def create(self, validated_data):
+        return CashFlow.objects.bulk_create(
+            [CashFlow(**attrs) for attrs in validated_data]
+        )
+
+
+class CashFlowSerializer(TenantSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели CashFlow.
     Включает информацию о связанных объектах и допускает вложенное создание.
+    Без подкатегории тип, категория и подкатегория назначаются по правилам
+    категоризации организации (см. rules); правила компилируются один раз
+    на запрос, в том числе для пакета записей.
     """
     status_name = serializers.StringRelatedField(
         source='status', read_only=True
@@ -66,11 +89,143 @@ class CashFlowSerializer(serializers.ModelSerializer):
         source='subcategory',
         read_only=True
     )
+    # Сумма хранится в копейках, в API передается десятичным числом.
+    amount = serializers.DecimalField(
+        max_digits=CashFlow._meta.get_field('amount').max_digits,
+        decimal_places=CashFlow._meta.get_field('amount').decimal_places,
+        min_value=Decimal('0.01')
+    )
 
     class Meta:
         model = CashFlow
         fields = [
             'id', 'date_created', 'status', 'status_name',
             'type', 'type_name', 'category', 'category_name',
-            'subcategory', 'subcategory_name', 'amount', 'comment'
+            'subcategory', 'subcategory_name', 'amount', 'currency', 'comment',
+            'change_seq'
+        ]
+        read_only_fields = ['change_seq']
+        extra_kwargs = {
+            'type': {'required': False},
+            'category': {'required': False},
+            'subcategory': {'required': False},
+        }
+        list_serializer_class = CashFlowListSerializer
+
+    def validate(self, attrs):
+        if self.instance is None or 'subcategory' in attrs:
+            context = self.context
+            if attrs.get('subcategory') is None and 'rule_matcher' not in context:
+                context['rule_matcher'] = rules.matcher(context.get('tenant_id'))
+            if not rules.categorize(attrs, context.get('rule_matcher')):
+                raise serializers.ValidationError(
+                    {'subcategory': rules.NO_RULE_MESSAGE}
+                )
+        return super().validate(attrs)
+
+
+class AttachmentSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для модели Attachment.
+    size и digest — размер и SHA-256 содержимого, url — адрес скачивания.
+    """
+    size = serializers.IntegerField(source='file.size', read_only=True)
+    digest = serializers.CharField(source='file.digest', read_only=True)
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Attachment
+        fields = [
+            'id', 'cashflow', 'name', 'content_type', 'size', 'digest',
+            'uploaded_at', 'url'
         ]
+        read_only_fields = fields
+
+    def get_url(self, attachment):
+        return reverse(
+            'cashflow-attachment', args=[attachment.cashflow_id, attachment.pk]
+        )
+
+
+class AttachmentUploadSerializer(serializers.Serializer):
+    """Загрузка вложения: файл в поле file (multipart/form-data)."""
+    file = serializers.FileField(validators=[validate_upload])
+
+
+class CategorizationRuleSerializer(TenantSerializerMixin,
+                                   serializers.ModelSerializer):
+    """
+    Сериализатор для модели CategorizationRule.
+    Проверяет правило так же, как админка (CategorizationRule.clean).
+    """
+    min_amount = serializers.DecimalField(
+        max_digits=CategorizationRule._meta.get_field('min_amount').max_digits,
+        decimal_places=CategorizationRule._meta.get_field('min_amount').decimal_places,
+        required=False,
+        allow_null=True
+    )
+    max_amount = serializers.DecimalField(
+        max_digits=CategorizationRule._meta.get_field('max_amount').max_digits,
+        decimal_places=CategorizationRule._meta.get_field('max_amount').decimal_places,
+        required=False,
+        allow_null=True
+    )
+
+    class Meta:
+        model = CategorizationRule
+        fields = [
+            'id', 'name', 'priority', 'keyword', 'pattern', 'min_amount',
+            'max_amount', 'currency', 'subcategory', 'is_active', 'updated_at'
+        ]
+        read_only_fields = ['updated_at']
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        values = {
+            field.name: getattr(self.instance, field.name)
+            for field in CategorizationRule._meta.concrete_fields
+            if field.name not in ('id', 'tenant')
+        } if self.instance is not None else {}
+        values.update(attrs)
+        try:
+            CategorizationRule(
+                tenant_id=self.context.get('tenant_id'), **values
+            ).clean()
+        except DjangoValidationError as error:
+            raise serializers.ValidationError(get_error_detail(error))
+        return attrs
+
+
+class CashFlowFlagSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для модели CashFlowFlag.
+    related — id исходной записи для возможного дубля.
+    """
+    class Meta:
+        model = CashFlowFlag
+        fields = ['id', 'cashflow', 'kind', 'related', 'score', 'created_at']
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для модели Job.
+    Показывает состояние, прогресс и результат фоновой задачи.
+    """
+    progress_percent = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'state', 'params', 'progress_done',
+            'progress_total', 'progress_percent', 'cancel_requested',
+            'result', 'result_file', 'error', 'created_at',
+            'started_at', 'finished_at'
+        ]
+        read_only_fields = [
+            field for field in fields if field not in ('kind', 'params')
+        ]
+
+    def get_progress_percent(self, obj):
+        if not obj.progress_total:
+            return 100 if obj.state == Job.State.DONE else 0
+        return min(100, round(100 * obj.progress_done / obj.progress_total))
@@ -0,0 +1,268 @@
+"""
+Разделение данных организаций (Tenant) в одной базе.
+
+Справочники и движения ДС принадлежат организации (поле tenant). Текущая
+организация запроса определяется так (current_tenant_id):
+
+- пользователь — участник организаций (Tenant.users): выбранная
+  заголовком X-Tenant (API) или сохраненная в сессии (select_tenant),
+  иначе первая из его организаций; суперпользователь может выбрать
+  любую организацию (без выбора — CASH_FLOW_DEFAULT_TENANT);
+- вошедший пользователь без организаций — None;
+- анонимные запросы — организация CASH_FLOW_DEFAULT_TENANT (одна
+  организация на установку).
+
+Запросы без организации (None) получают 403.
+
+Ограничение по организации применяется миксинами: TenantViewMixin
+(представления Django), TenantViewSetMixin и TenantSerializerMixin (API),
+TenantFormMixin (формы) и TenantAdminMixin (админка). Организация —
+первое поле составных индексов и ключей кеша результатов, поэтому время
+запросов организации не зависит от объема данных остальных.
+"""
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db.models import UniqueConstraint
+from rest_framework import serializers
+
+from .models import Tenant
+
+
+HEADER = 'X-Tenant'
+SESSION_KEY = 'cash_flow_tenant'
+
+
+def default_tenant_id():
+    return getattr(settings, 'CASH_FLOW_DEFAULT_TENANT', None)
+
+
+def _parse_id(value):
+    value = str(value or '')
+    return int(value) if value.isdigit() else None
+
+
+def _resolve(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return default_tenant_id()
+    requested = _parse_id(request.headers.get(HEADER))
+    if requested is None and hasattr(request, 'session'):
+        requested = _parse_id(request.session.get(SESSION_KEY))
+    if user.is_superuser and requested is not None:
+        if Tenant.objects.filter(pk=requested).exists():
+            return requested
+    member_of = list(
+        user.cash_flow_tenants.order_by('pk').values_list('pk', flat=True)
+    )
+    if requested in member_of:
+        return requested
+    if member_of:
+        return member_of[0]
+    # Вошедший пользователь без организаций не получает организацию по
+    # умолчанию: ее данные доступны только анонимным запросам установки с
+    # одной организацией и суперпользователю, который видит все.
+    return default_tenant_id() if user.is_superuser else None
+
+
+def current_tenant_id(request):
+    """Организация запроса или None (вычисляется один раз на запрос)."""
+    request = getattr(request, '_request', request)
+    if not hasattr(request, '_cash_flow_tenant_id'):
+        request._cash_flow_tenant_id = _resolve(request)
+    return request._cash_flow_tenant_id
+
+
+def require_tenant_id(request):
+    """Организация запроса; без нее — PermissionDenied (403)."""
+    tenant_id = current_tenant_id(request)
+    if tenant_id is None:
+        raise PermissionDenied('Не выбрана организация.')
+    return tenant_id
+
+
+def is_tenant_owned(model):
+    return any(field.name == 'tenant' for field in model._meta.fields)
+
+
+def unique_conflicts(model, tenant_id, values, exclude_pk=None):
+    """
+    Поля ограничений уникальности с организацией, которые нарушит запись
+    со значениями values (API не проверяет такие ограничения сам).
+    """
+    conflicts = []
+    for constraint in model._meta.constraints:
+        if not isinstance(constraint, UniqueConstraint):
+            continue
+        fields = [name for name in constraint.fields if name != 'tenant']
+        if len(fields) == len(constraint.fields) or not all(
+            name in values for name in fields
+        ):
+            continue
+        duplicates = model._default_manager.filter(
+            tenant_id=tenant_id, **{name: values[name] for name in fields}
+        )
+        if exclude_pk is not None:
+            duplicates = duplicates.exclude(pk=exclude_pk)
+        if duplicates.exists():
+            conflicts.append(fields)
+    return conflicts
+
+
+class TenantFormMixin:
+    """
+    Для ModelForm: выбор справочников только своей организации и
+    проверка уникальности в ее пределах. Организация передается
+    аргументом tenant_id (TenantViewMixin делает это сам).
+    """
+
+    def __init__(self, *args, tenant_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tenant_id = tenant_id
+        if tenant_id is None:
+            return
+        if self.instance.tenant_id is None:
+            self.instance.tenant_id = tenant_id
+        for field in self.fields.values():
+            queryset = getattr(field, 'queryset', None)
+            if queryset is not None and is_tenant_owned(queryset.model):
+                field.queryset = queryset.filter(tenant_id=tenant_id)
+
+    def _get_validation_exclusions(self):
+        # Организации нет среди полей формы, но ограничения уникальности
+        # с ней нужно проверять.
+        exclude = super()._get_validation_exclusions()
+        if self.tenant_id is not None:
+            exclude.discard('tenant')
+        return exclude
+
+
+class TenantViewMixin:
+    """
+    Для представлений моделей организации (списки, формы, удаление):
+    выборка, выбор справочников в форме и новые объекты — только текущей
+    организации; чужой объект — 404.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        self.tenant_id = require_tenant_id(request)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return super().get_queryset().filter(tenant_id=self.tenant_id)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        if issubclass(self.get_form_class(), TenantFormMixin):
+            kwargs['tenant_id'] = self.tenant_id
+        return kwargs
+
+
+class TenantSerializerMixin:
+    """
+    Для ModelSerializer: ссылки на справочники только своей организации
+    (context['tenant_id']), уникальность в ее пределах.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        tenant_id = self.context.get('tenant_id')
+        if tenant_id is None:
+            return fields
+        for field in fields.values():
+            queryset = getattr(field, 'queryset', None)
+            if queryset is not None and is_tenant_owned(queryset.model):
+                field.queryset = queryset.filter(tenant_id=tenant_id)
+        return fields
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        tenant_id = self.context.get('tenant_id')
+        if tenant_id is None:
+            return attrs
+        values = {
+            field.name: getattr(self.instance, field.name)
+            for field in self.Meta.model._meta.concrete_fields
+        } if self.instance is not None else {}
+        values.update(attrs)
+        conflicts = unique_conflicts(
+            self.Meta.model, tenant_id, values,
+            exclude_pk=getattr(self.instance, 'pk', None),
+        )
+        if conflicts:
+            raise serializers.ValidationError({
+                fields[-1]: 'Такое значение уже есть в организации.'
+                for fields in conflicts
+            })
+        return attrs
+
+
+class TenantViewSetMixin:
+    """
+    Для ModelViewSet: выборка и созданные объекты — текущей организации
+    (из запроса; без нее — 403), сериализатор получает ее в контексте.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.tenant_id = require_tenant_id(request)
+
+    def get_queryset(self):
+        return super().get_queryset().filter(tenant_id=self.tenant_id)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['tenant_id'] = getattr(self, 'tenant_id', None)
+        return context
+
+    def perform_create(self, serializer):
+        serializer.save(tenant_id=self.tenant_id)
+
+
+class TenantAdminMixin:
+    """
+    Для ModelAdmin: сотрудник видит и выбирает только объекты текущей
+    организации, новые объекты получают ее. Суперпользователь видит все
+    организации и выбирает организацию в форме.
+    """
+
+    def _tenant_id(self, request):
+        return None if request.user.is_superuser else require_tenant_id(request)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        tenant_id = self._tenant_id(request)
+        if tenant_id is None:
+            return queryset
+        return queryset.filter(tenant_id=tenant_id)
+
+    def get_list_display(self, request):
+        list_display = super().get_list_display(request)
+        if request.user.is_superuser:
+            return (*list_display, 'tenant')
+        return list_display
+
+    def get_list_select_related(self, request):
+        related = super().get_list_select_related(request)
+        if request.user.is_superuser and related is not False:
+            return (*(related or ()), 'tenant')
+        return related
+
+    def get_exclude(self, request, obj=None):
+        exclude = super().get_exclude(request, obj) or ()
+        if not request.user.is_superuser:
+            return (*exclude, 'tenant')
+        return exclude
+
+    def get_form(self, request, obj=None, change=False, **kwargs):
+        form = super().get_form(request, obj, change, **kwargs)
+        tenant_id = self._tenant_id(request)
+        if tenant_id is None:
+            return form
+
+        class TenantForm(TenantFormMixin, form):
+            def __init__(self, *args, **kwargs):
+                kwargs.setdefault('tenant_id', tenant_id)
+                super().__init__(*args, **kwargs)
+
+        TenantForm.__name__ = form.__name__
+        return TenantForm
@@ -1,3 +1,2090 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import io
+import json
+import os
+import random
+import re
+import threading
+import tempfile
+import tracemalloc
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import BigIntegerField
+from django.db.models.functions import Cast
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.client import ClientHandler
+from django.urls import reverse
+
+from . import (
+    analytics, anomalies, attachments, events, guardrails, metrics, profiling, reconciliation,
+    resultcache, rules, tenancy, warmup
+)
+from .exports import iter_cashflows_csv
+from .forms import CashFlowForm
+from .jobs import run_job, submit_job
+from .management.commands.load_exchange_rates import load_exchange_rates
+from .models import (
+    Tenant, Status, Type, Category, Subcategory, CashFlow, CashFlowFlag,
+    CashFlowTombstone, ExchangeRate, Job, Attachment, StoredFile,
+    CategorizationRule
+)
+
+
+class CashFlowDataMixin:
+    """Общие справочники и фабрика записей для тестов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Организация по умолчанию создается миграцией, но
+        # TransactionTestCase очищает таблицы.
+        cls.tenant, _ = Tenant.objects.get_or_create(
+            pk=settings.CASH_FLOW_DEFAULT_TENANT,
+            defaults={'name': 'Основная организация'},
+        )
+        cls.status = Status.objects.create(name='Бизнес', tenant=cls.tenant)
+        cls.type = Type.objects.create(name='Списание', tenant=cls.tenant)
+        cls.category = Category.objects.create(
+            name='Маркетинг', type=cls.type
+        )
+        cls.subcategory = Subcategory.objects.create(
+            name='Avito', category=cls.category
+        )
+
+    @classmethod
+    def create_cashflows(cls, count, start=datetime.date(2024, 1, 1),
+                         step_days=17, **kwargs):
+        values = {
+            'status': cls.status,
+            'type': cls.type,
+            'category': cls.category,
+            'subcategory': cls.subcategory,
+            'amount': Decimal('100.00'),
+        }
+        values.update(kwargs)
+        return CashFlow.objects.bulk_create([
+            CashFlow(
+                date_created=start + datetime.timedelta(days=i * step_days),
+                **values
+            )
+            for i in range(count)
+        ])
+
+
+class CashFlowAdminTests(CashFlowDataMixin, TestCase):
+    """Тесты производительности списка движений ДС в админке."""
+
+    def setUp(self):
+        user = get_user_model().objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        self.client.force_login(user)
+        self.url = reverse('admin:cash_flow_cashflow_changelist')
+
+    def test_changelist_query_count_does_not_depend_on_rows(self):
+        self.create_cashflows(5, step_days=0)
+        with self.assertNumQueries(10):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+        self.create_cashflows(45, step_days=0)
+        with self.assertNumQueries(10):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_changelist_does_not_render_all_categories(self):
+        for i in range(30):
+            Category.objects.create(name=f'Категория {i}', type=self.type)
+        self.create_cashflows(1)
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'Категория 29')
+        self.assertContains(response, 'data-autocomplete-filter')
+
+        response = self.client.get(
+            self.url, {'category__id__exact': self.category.pk}
+        )
+        self.assertContains(response, 'Маркетинг (Списание)')
+
+    def test_date_hierarchy_drilldown(self):
+        self.create_cashflows(40)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'date_created__year=2025')
+
+        response = self.client.get(self.url, {'date_created__year': 2024})
+        self.assertContains(response, 'date_created__month=2')
+
+
+class CashFlowChangeFeedTests(CashFlowDataMixin, TestCase):
+    """Тесты ленты изменений /api/cashflows/changes/."""
+
+    url = '/api/cashflows/changes/'
+
+    def feed(self, since=0, limit=None):
+        params = {'since': since}
+        if limit:
+            params['limit'] = limit
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_every_write_path_advances_sequence(self):
+        rows = self.create_cashflows(3)
+        token = self.feed()['next']
+
+        self.client.post(reverse('cashflow_create'), {
+            'date_created': '2024-05-01',
+            'status': self.status.pk,
+            'type': self.type.pk,
+            'category': self.category.pk,
+            'subcategory': self.subcategory.pk,
+            'amount': '15.00',
+            'currency': 'RUB',
+        })
+        self.client.patch(
+            f'/api/cashflows/{rows[0].pk}/', {'amount': '7.00'},
+            content_type='application/json'
+        )
+        CashFlow.objects.filter(pk=rows[1].pk).update(comment='bulk')
+        CashFlow.objects.filter(pk=rows[2].pk).delete()
+
+        changes = self.feed(token)['changes']
+        self.assertEqual(
+            [change['op'] for change in changes],
+            ['upsert', 'upsert', 'upsert', 'delete']
+        )
+        self.assertEqual(changes[1]['id'], rows[0].pk)
+        self.assertEqual(changes[1]['data']['amount'], '7.00')
+        self.assertEqual(changes[2]['data']['comment'], 'bulk')
+        self.assertEqual(changes[3]['id'], rows[2].pk)
+        self.assertEqual(self.feed(changes[-1]['seq'])['changes'], [])
+
+    def test_feed_is_paged_by_sequence(self):
+        rows = self.create_cashflows(5)
+        deleted_pk = rows[0].pk
+        rows[0].delete()
+
+        page = self.feed(limit=2)
+        self.assertTrue(page['has_more'])
+        seen = [change['id'] for change in page['changes']]
+        while page['has_more']:
+            page = self.feed(page['next'], limit=2)
+            seen.extend(change['id'] for change in page['changes'])
+        self.assertEqual(seen, [row.pk for row in rows[1:]] + [deleted_pk])
+
+    def test_queryset_delete_writes_tombstones_without_loading_rows(self):
+        self.create_cashflows(4)
+        with self.assertNumQueries(9):
+            CashFlow.objects.all().delete()
+        self.assertEqual(CashFlowTombstone.objects.count(), 4)
+        self.assertEqual(
+            len(set(CashFlowTombstone.objects.values_list('seq', flat=True))), 4
+        )
+
+    def test_invalid_token(self):
+        response = self.client.get(self.url, {'since': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CashFlowAmountTests(CashFlowDataMixin, TestCase):
+    """Тесты хранения сумм в копейках."""
+
+    def test_amount_is_stored_in_minor_units(self):
+        row = self.create_cashflows(1, amount=Decimal('1234567.89'))[0]
+        self.assertEqual(
+            CashFlow.objects.filter(pk=row.pk).values_list(
+                'amount', flat=True
+            ).get(),
+            Decimal('1234567.89')
+        )
+        raw = CashFlow.objects.filter(pk=row.pk).values_list(
+            Cast('amount', BigIntegerField()), flat=True
+        ).get()
+        self.assertEqual(raw, 123456789)
+
+    def test_totals_are_integer_sums(self):
+        self.create_cashflows(3, amount=Decimal('0.10'))
+        self.create_cashflows(1, amount=Decimal('0.20'))
+        self.assertEqual(CashFlow.objects.total_minor(), 50)
+        self.assertEqual(CashFlow.objects.total(), Decimal('0.50'))
+        self.assertEqual(
+            CashFlow.objects.filter(amount__gte=Decimal('0.2')).count(), 1
+        )
+
+    def test_amount_out_of_range_is_validation_error(self):
+        field = CashFlow._meta.get_field('amount')
+        self.assertEqual(
+            field.to_minor('999999999999999.99'), 99999999999999999
+        )
+        for value in ('1000000000000000', '-1e300', 'Infinity', 'NaN'):
+            with self.subTest(value=value):
+                with self.assertRaises(ValidationError):
+                    field.to_minor(value)
+        with self.assertRaises(ValidationError):
+            self.create_cashflows(1, amount=Decimal('1e20'))
+        self.assertFalse(CashFlow.objects.exists())
+
+    def test_form_and_api_accept_decimals(self):
+        data = {
+            'date_created': '2024-05-01',
+            'status': self.status.pk,
+            'type': self.type.pk,
+            'category': self.category.pk,
+            'subcategory': self.subcategory.pk,
+            'amount': '150000000.25',
+            'currency': 'RUB',
+        }
+        form = CashFlowForm(data)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save().amount, Decimal('150000000.25'))
+
+        self.assertFalse(CashFlowForm({**data, 'amount': '1.001'}).is_valid())
+
+        response = self.client.post(
+            '/api/cashflows/', {**data, 'amount': '10.50'}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['amount'], '10.50')
+
+        response = self.client.get(reverse('cashflow_list'))
+        self.assertContains(response, '10,50')
+
+
+class CashFlowCurrencyTests(CashFlowDataMixin, TestCase):
+    """Тесты пересчета сумм в валюту отчетности."""
+
+    def setUp(self):
+        load_exchange_rates(io.StringIO(
+            'date,base,quote,rate\n'
+            '2024-01-01,USD,RUB,90\n'
+            '2024-02-01,USD,RUB,100\n'
+            '2024-01-01,EUR,RUB,95.5\n'
+        ))
+
+    def test_loader_upserts_rates(self):
+        load_exchange_rates(io.StringIO(
+            'date,base,quote,rate\n2024-01-01,USD,RUB,91\n'
+        ))
+        self.assertEqual(ExchangeRate.objects.count(), 3)
+        self.assertEqual(
+            ExchangeRate.objects.get(
+                base_currency='USD', date=datetime.date(2024, 1, 1)
+            ).rate,
+            Decimal('91')
+        )
+
+    def test_conversion_uses_nearest_previous_rate(self):
+        self.create_cashflows(1, amount=Decimal('100.00'))
+        # 2024-01-15 -> курс от 01.01, 2024-03-01 -> курс от 01.02
+        self.create_cashflows(
+            1, start=datetime.date(2024, 1, 15),
+            amount=Decimal('1.50'), currency='USD'
+        )
+        self.create_cashflows(
+            1, start=datetime.date(2024, 3, 1),
+            amount=Decimal('2.00'), currency='USD'
+        )
+        self.create_cashflows(
+            1, start=datetime.date(2023, 12, 31),
+            amount=Decimal('1.00'), currency='EUR'
+        )
+        with self.assertNumQueries(1):
+            totals = CashFlow.objects.converted_total('RUB')
+        self.assertEqual(totals['total'], Decimal('435.00'))
+        self.assertEqual(totals['missing'], 1)
+
+    def test_conversion_uses_inverse_and_cross_rates(self):
+        # Курсы есть только к рублю: рубли пересчитываются по обратному
+        # курсу, евро — через рубль.
+        self.create_cashflows(
+            1, start=datetime.date(2024, 1, 15), amount=Decimal('180.00')
+        )
+        self.create_cashflows(
+            1, start=datetime.date(2024, 1, 15),
+            amount=Decimal('2.00'), currency='EUR'
+        )
+        self.create_cashflows(
+            1, start=datetime.date(2024, 1, 15),
+            amount=Decimal('1.00'), currency='USD'
+        )
+        self.create_cashflows(
+            1, start=datetime.date(2023, 12, 31), amount=Decimal('5.00')
+        )
+        with self.assertNumQueries(1):
+            totals = CashFlow.objects.converted_total('USD')
+        # 2.00 + 2.00 * 95.5 / 90 = 2.12 + 1.00
+        self.assertEqual(totals['total'], Decimal('5.12'))
+        self.assertEqual(totals['missing'], 1)
+
+    def test_list_api_and_export_show_converted_totals(self):
+        self.create_cashflows(1, amount=Decimal('10.00'))
+        self.create_cashflows(
+            1, start=datetime.date(2024, 1, 2),
+            amount=Decimal('1.00'), currency='USD'
+        )
+        response = self.client.get(reverse('cashflow_list'))
+        self.assertEqual(response.context['totals']['total'], Decimal('100.00'))
+
+        response = self.client.get('/api/cashflows/totals/')
+        self.assertEqual(response.json()['total'], '100.00')
+
+        response = self.client.get(reverse('cashflow_export'))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn('1.00,USD,90.00,RUB', lines[1] + lines[2])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='cashflow-jobs-'))
+class JobTests(CashFlowDataMixin, TestCase):
+    """Тесты фоновых задач; воркер запускается в текущем процессе."""
+
+    def run_worker(self):
+        call_command('run_jobs', once=True, processes=0, stdout=io.StringIO())
+
+    def test_export_job_runs_in_worker(self):
+        self.create_cashflows(3)
+        self.create_cashflows(2, currency='USD')
+        response = self.client.post(
+            '/api/jobs/', {'kind': 'export', 'params': {'currency': 'RUB'}},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        job_id = response.json()['id']
+        self.assertEqual(response.json()['state'], 'pending')
+
+        self.run_worker()
+
+        job = self.client.get(f'/api/jobs/{job_id}/').json()
+        self.assertEqual(job['state'], 'done')
+        self.assertEqual(job['progress_percent'], 100)
+        self.assertEqual(job['result'], {'rows': 3})
+        response = self.client.get(f'/api/jobs/{job_id}/download/')
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(content.splitlines()), 4)
+
+        os.remove(os.path.join(
+            settings.MEDIA_ROOT, Job.objects.get(pk=job_id).result_file
+        ))
+        response = self.client.get(f'/api/jobs/{job_id}/download/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_html_export_can_be_queued(self):
+        self.create_cashflows(2)
+        response = self.client.get(
+            reverse('cashflow_export'), {'background': 1, 'status': self.status.pk}
+        )
+        self.assertRedirects(
+            response, f"{reverse('cashflow_list')}?status={self.status.pk}"
+        )
+        job = Job.objects.get()
+        self.assertEqual(job.params, {'status': str(self.status.pk)})
+
+    def test_import_inline_round_trips_export(self):
+        self.create_cashflows(4, amount=Decimal('12.34'))
+        exported = ''.join(iter_cashflows_csv(CashFlow.objects.all()))
+        upload = SimpleUploadedFile('import.csv', exported.encode())
+        response = self.client.post(
+            '/api/jobs/', {'kind': 'import', 'inline': 'true', 'file': upload}
+        )
+        self.assertEqual(response.json()['state'], 'done')
+        self.assertEqual(response.json()['result']['created'], 4)
+        self.assertEqual(CashFlow.objects.count(), 8)
+        self.assertEqual(CashFlow.objects.total(), Decimal('98.72'))
+
+    def test_import_skips_bad_amounts(self):
+        header = 'date_created,status,type,category,subcategory,amount,currency,comment\n'
+        line = (
+            f'2024-01-02,{self.status.name},{self.type.name},'
+            f'{self.category.name},{self.subcategory.name},{{}},RUB,\n'
+        )
+        amounts = ['10.00', 'NaN', 'Infinity', '0', '-5', '1.005', '1e30', '20.00']
+        content = header + ''.join(line.format(amount) for amount in amounts)
+        with open(os.path.join(settings.MEDIA_ROOT, 'bad-amounts.csv'), 'w',
+                  encoding='utf-8') as file:
+            file.write(content)
+        # Пакет из одной строки: плохая сумма посередине не должна
+        # прерывать задачу после уже вставленных пакетов.
+        job = submit_job(
+            Job.Kind.IMPORT, {'path': 'bad-amounts.csv', 'batch_size': 1},
+            inline=True, tenant_id=self.tenant.pk
+        )
+        self.assertEqual(job.state, Job.State.DONE)
+        self.assertEqual(job.result['created'], 2)
+        self.assertEqual(job.result['error_lines'], [3, 4, 5, 6, 7, 8])
+        self.assertEqual(CashFlow.objects.total(), Decimal('30.00'))
+
+    def test_report_job(self):
+        self.create_cashflows(3, step_days=40)
+        job = submit_job(Job.Kind.REPORT, {}, tenant_id=self.tenant.pk)
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.State.DONE)
+        self.assertEqual(
+            [row['month'] for row in job.result['rows']],
+            ['2024-01-01', '2024-02-01', '2024-03-01']
+        )
+
+    def test_report_job_converts_all_currencies(self):
+        ExchangeRate.objects.create(
+            date=datetime.date(2024, 1, 1), base_currency='USD',
+            quote_currency='RUB', rate=Decimal('90')
+        )
+        self.create_cashflows(2, amount=Decimal('10.00'))
+        self.create_cashflows(1, amount=Decimal('1.00'), currency='USD')
+
+        def report(params):
+            job = submit_job(
+                Job.Kind.REPORT, params, inline=True, tenant_id=self.tenant.pk
+            )
+            self.assertEqual(job.state, Job.State.DONE)
+            return [
+                (row['total'], row['count'], row['missing'])
+                for row in job.result['rows']
+            ]
+
+        self.assertEqual(report({'reporting_currency': 'RUB'}), [('110.00', 3, 0)])
+        # currency отбирает записи, а не задает валюту отчета.
+        self.assertEqual(
+            report({'reporting_currency': 'RUB', 'currency': 'USD'}),
+            [('90.00', 1, 0)]
+        )
+
+    def test_cancel(self):
+        job = submit_job(Job.Kind.EXPORT, {}, tenant_id=self.tenant.pk)
+        response = self.client.post(f'/api/jobs/{job.pk}/cancel/')
+        self.assertEqual(response.json()['state'], 'cancelled')
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.State.CANCELLED)
+
+        running = Job.objects.create(
+            kind=Job.Kind.EXPORT, state=Job.State.RUNNING,
+            tenant=self.tenant
+        )
+        response = self.client.post(f'/api/jobs/{running.pk}/cancel/')
+        self.assertTrue(response.json()['cancel_requested'])
+        self.assertEqual(run_job(running.pk), Job.State.CANCELLED)
+
+
+class CashFlowFacetTests(CashFlowDataMixin, TestCase):
+    """Тесты счетчиков по вариантам фильтров списка."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_status = Status.objects.create(name='Личное', tenant=cls.tenant)
+        cls.other_subcategory = Subcategory.objects.create(
+            name='Farpost', category=cls.category
+        )
+        cls.create_cashflows(3, amount=Decimal('10.00'))
+        cls.create_cashflows(2, status=cls.other_status, amount=Decimal('1.50'))
+        cls.create_cashflows(
+            1, subcategory=cls.other_subcategory, currency='USD',
+            amount=Decimal('2.00')
+        )
+
+    def test_facets_in_one_query(self):
+        with self.assertNumQueries(1):
+            facets = CashFlow.objects.facets({'status': str(self.status.pk)})
+        # Фасет статуса не ограничен выбранным статусом.
+        self.assertEqual(facets['status'][self.status.pk]['count'], 4)
+        self.assertEqual(facets['status'][self.other_status.pk]['count'], 2)
+        # Остальные фасеты учитывают выбранный статус.
+        self.assertEqual(
+            facets['subcategory'][self.subcategory.pk],
+            {'count': 3, 'amounts': {'RUB': Decimal('30.00')}}
+        )
+        self.assertEqual(
+            facets['category'][self.category.pk]['amounts'],
+            {'RUB': Decimal('30.00'), 'USD': Decimal('2.00')}
+        )
+
+    def test_list_and_api_show_facets(self):
+        response = self.client.get(reverse('cashflow_list'), {
+            'subcategory': self.other_subcategory.pk
+        })
+        statuses = {s.pk: s.facet for s in response.context['statuses']}
+        self.assertEqual(statuses[self.status.pk]['count'], 1)
+        self.assertIsNone(statuses[self.other_status.pk])
+        self.assertContains(response, 'Бизнес (1)')
+        self.assertContains(response, 'Личное (0)')
+
+        response = self.client.get('/api/cashflows/', {
+            'facets': 1, 'status': self.other_status.pk
+        })
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['facets']['status'], [
+            {'id': self.status.pk, 'count': 4,
+             'amounts': {'RUB': '30.00', 'USD': '2.00'}},
+            {'id': self.other_status.pk, 'count': 2,
+             'amounts': {'RUB': '3.00'}},
+        ])
+        self.assertNotIn('facets', self.client.get('/api/cashflows/').json())
+
+
+class CashFlowPivotTests(CashFlowDataMixin, TestCase):
+    """Тесты сводных таблиц по снимку в памяти."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.income = Type.objects.create(name='Пополнение', tenant=cls.tenant)
+        cls.salary = Category.objects.create(name='Зарплата', type=cls.income)
+        cls.bonus = Subcategory.objects.create(name='Премия', category=cls.salary)
+
+    def setUp(self):
+        analytics.reset_snapshots()
+        self.addCleanup(analytics.reset_snapshots)
+        self.create_cashflows(4, step_days=10, amount=Decimal('10.00'))
+        self.create_cashflows(
+            2, start=datetime.date(2024, 2, 5), type=self.income,
+            category=self.salary, subcategory=self.bonus, amount=Decimal('1.25')
+        )
+        self.create_cashflows(1, currency='USD', amount=Decimal('99.00'))
+
+    def pivot_cells(self, **params):
+        response = self.client.get('/api/cashflows/pivot/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return {
+            tuple(cell['key']): (cell['count'], cell['value'])
+            for cell in response.json()['cells']
+        }
+
+    def expected(self):
+        return {
+            ('2024-01', self.type.pk): (4, '40.00'),
+            ('2024-02', self.income.pk): (2, '2.50'),
+        }
+
+    def test_pivot_matches_orm(self):
+        self.assertEqual(
+            self.pivot_cells(rows='month', columns='type'), self.expected()
+        )
+        with mock.patch.object(analytics, 'numpy', None):
+            self.assertEqual(
+                self.pivot_cells(rows='month', columns='type'), self.expected()
+            )
+        self.assertEqual(
+            self.pivot_cells(rows='year', measure='avg', currency='USD'),
+            {(2024,): (1, '99.00')}
+        )
+        self.assertEqual(
+            self.pivot_cells(
+                rows='subcategory', measure='count',
+                type=self.income.pk, end_date='2024-02-05'
+            ),
+            {(self.bonus.pk,): (1, '1')}
+        )
+
+    def test_snapshot_refreshes_incrementally(self):
+        self.pivot_cells(rows='type')
+        snapshot = analytics._snapshots['default', self.tenant.pk]
+        first = CashFlow.objects.filter(type=self.type).order_by('pk').first()
+
+        CashFlow.objects.filter(pk=first.pk).update(amount=Decimal('5.00'))
+        first.delete()
+        self.create_cashflows(1, amount=Decimal('0.50'))
+        with mock.patch.object(snapshot, 'load') as load:
+            cells = self.pivot_cells(rows='type')
+        load.assert_not_called()
+        self.assertEqual(cells[(self.type.pk,)], (4, '30.50'))
+        self.assertEqual(len(snapshot), 7)
+
+    @override_settings(CASH_FLOW_SNAPSHOT_LIMIT=1)
+    def test_snapshots_lock_separately_and_are_evicted(self):
+        other = Tenant.objects.create(name='Другая организация')
+        with analytics.current_snapshot(tenant_id=self.tenant.pk) as snapshot:
+            self.assertFalse(analytics._lock.locked())
+            self.assertTrue(snapshot.lock.locked())
+            with analytics.current_snapshot(tenant_id=other.pk) as other_snapshot:
+                self.assertEqual(len(other_snapshot), 0)
+        self.assertEqual(len(snapshot), 7)
+        self.assertEqual(list(analytics._snapshots), [('default', other.pk)])
+
+        self.pivot_cells(rows='type')
+        self.assertEqual(
+            list(analytics._snapshots), [('default', self.tenant.pk)]
+        )
+        self.assertIsNot(
+            analytics._snapshots['default', self.tenant.pk], snapshot
+        )
+
+    def test_invalid_parameters(self):
+        response = self.client.get('/api/cashflows/pivot/', {'rows': 'comment'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/cashflows/pivot/', {
+            'rows': 'type', 'start_date': 'вчера'
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class CashFlowEventTests(CashFlowDataMixin, TestCase):
+    """Тесты рассылки событий об изменениях."""
+
+    def setUp(self):
+        # Подписчики читают в отдельном event loop, как под ASGI-сервером,
+        # а записи выполняются в потоке теста, как в синхронных view.
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.loop.call_soon_threadsafe, self.loop.stop)
+
+    def in_loop(self, func, *args):
+        async def call():
+            return func(*args)
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result(5)
+
+    def drain(self, subscription):
+        def read():
+            items = []
+            while not subscription.queue.empty():
+                items.append(json.loads(subscription.queue.get_nowait().payload))
+            return items
+        return self.in_loop(read)
+
+    def test_fanout_to_hundreds_of_subscribers(self):
+        other_status = Status.objects.create(name='Личное', tenant=self.tenant)
+        subscriptions = [
+            self.in_loop(events.broker.subscribe, filters)
+            for filters in [{}, {'status': self.status.pk},
+                            {'status': other_status.pk},
+                            {'start_date': '2025-01-01'}] * 75
+        ]
+        self.addCleanup(
+            lambda: [events.broker.unsubscribe(s) for s in subscriptions]
+        )
+        cashflow = CashFlow(
+            date_created=datetime.date(2024, 1, 1), status=self.status,
+            type=self.type, category=self.category,
+            subcategory=self.subcategory, amount=Decimal('10.00'),
+        )
+        with mock.patch.object(
+            self.loop, 'call_soon_threadsafe',
+            wraps=self.loop.call_soon_threadsafe
+        ) as notify:
+            with self.captureOnCommitCallbacks(execute=True):
+                cashflow.save()
+            stored = CashFlow.objects.get(pk=cashflow.pk)
+            stored.status = other_status
+            with self.captureOnCommitCallbacks(execute=True):
+                stored.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                CashFlow.objects.filter(status=other_status).update(comment='x')
+            with self.captureOnCommitCallbacks(execute=True):
+                stored.delete()
+        # Одно уведомление event loop'а на запись, а не на подписчика.
+        self.assertEqual(notify.call_count, 4)
+
+        everything, business, personal, future = [
+            [(e['op'], e.get('id')) for e in self.drain(s)]
+            for s in subscriptions[:4]
+        ]
+        self.assertEqual(everything, [
+            ('create', cashflow.pk), ('update', cashflow.pk),
+            ('bulk_update', None), ('delete', cashflow.pk),
+        ])
+        # Запись ушла из фильтра по статусу — подписчик узнает и об этом.
+        self.assertEqual(business, everything[:3])
+        self.assertEqual(personal, everything[1:])
+        self.assertEqual(future, [('bulk_update', None)])
+        self.assertEqual(
+            [len(self.drain(s)) for s in subscriptions[4:]],
+            [len(everything), len(business), len(personal), len(future)] * 74
+        )
+
+    def test_slow_subscriber_is_closed(self):
+        subscription = self.in_loop(
+            lambda: events.broker.subscribe(queue_size=2)
+        )
+        for _ in range(3):
+            events.broker.publish(events.reference_event(self.status, 'update'))
+        self.in_loop(lambda: None)
+        self.assertTrue(subscription.closed)
+        self.assertIs(
+            self.in_loop(subscription.queue.get_nowait), events.OVERFLOW
+        )
+        events.broker.unsubscribe(subscription)
+
+    async def test_stream_view(self):
+        response = await self.async_client.get(
+            reverse('cashflow_events'), {'models': 'status'}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        self.assertEqual(events.broker.subscriber_count(), 1)
+        events.broker.publish(events.reference_event(self.status, 'update'))
+        events.broker.publish(
+            events.bulk_event('bulk_update', since=1, last=5)
+        )
+        chunk = await asyncio.wait_for(anext(stream), 1)
+        self.assertTrue(chunk.startswith(b'event: status.update\ndata: '))
+        # Сервер закрывает ответ в конце потока или при отключении
+        # клиента — подписка снимается.
+        await stream.aclose()
+        response.close()
+        self.assertEqual(events.broker.subscriber_count(), 0)
+
+        response = await self.async_client.get(
+            reverse('cashflow_events'), {'status': 'abc'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class CashFlowAnomalyTests(CashFlowDataMixin, TestCase):
+    """Тесты поиска дублей и выбросов (задача detect)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.create_cashflows(12)
+        cls.outlier = cls.create_cashflows(1, amount=Decimal('100000.00'))[0]
+        day = datetime.date(2024, 3, 5)
+        cls.original, cls.duplicate = cls.create_cashflows(
+            2, start=day, step_days=0, amount=Decimal('555.00')
+        )
+        CashFlow.objects.filter(pk=cls.original.pk).update(comment='Оплата Avito')
+        CashFlow.objects.filter(pk=cls.duplicate.pk).update(
+            comment='оплата  avito', date_created=day + datetime.timedelta(days=1)
+        )
+        # Та же сумма, но другой комментарий или слишком далекая дата.
+        cls.create_cashflows(
+            1, start=day, amount=Decimal('555.00'), comment='Зарплата курьерам'
+        )
+        cls.create_cashflows(
+            1, start=day + datetime.timedelta(days=10), amount=Decimal('555.00')
+        )
+
+    def setUp(self):
+        analytics.reset_snapshots()
+
+    def flags(self):
+        return set(CashFlowFlag.objects.values_list('cashflow', 'kind', 'related'))
+
+    def test_detect_duplicates_and_outliers(self):
+        job = submit_job(Job.Kind.DETECT, {}, inline=True)
+        self.assertEqual(job.state, Job.State.DONE, job.error)
+        self.assertEqual(job.result['checked'], 17)
+        self.assertEqual(self.flags(), {
+            (self.duplicate.pk, 'duplicate', self.original.pk),
+            (self.outlier.pk, 'outlier', None),
+        })
+
+        with mock.patch.object(anomalies, 'numpy', None):
+            anomalies.detect()
+        self.assertEqual(len(self.flags()), 2)
+
+        response = self.client.get(reverse('cashflow_list'), {'flag': 'duplicate'})
+        self.assertEqual(
+            [cashflow.pk for cashflow in response.context['cashflows']],
+            [self.duplicate.pk]
+        )
+        response = self.client.get('/api/cashflows/', {'flag': 'outlier'})
+        self.assertEqual(
+            [row['id'] for row in response.json()['results']], [self.outlier.pk]
+        )
+        response = self.client.get('/api/cashflows/flags/', {'kind': 'duplicate'})
+        self.assertEqual(response.json()['results'][0]['related'], self.original.pk)
+
+    def test_incremental_run_checks_only_changed_rows(self):
+        submit_job(Job.Kind.DETECT, {}, inline=True)
+        late = self.create_cashflows(
+            1, start=datetime.date(2024, 3, 4), amount=Decimal('555.00'),
+            comment='Оплата AVITO'
+        )[0]
+        job = submit_job(Job.Kind.DETECT, {}, inline=True)
+        self.assertEqual(job.result['checked'], 1)
+        # Новая запись раньше по дате — дублем становится прежний оригинал.
+        self.assertEqual(self.flags(), {
+            (self.original.pk, 'duplicate', late.pk),
+            (self.duplicate.pk, 'duplicate', self.original.pk),
+            (self.outlier.pk, 'outlier', None),
+        })
+
+        CashFlow.objects.filter(pk=self.outlier.pk).update(amount=Decimal('100.00'))
+        job = submit_job(Job.Kind.DETECT, {}, inline=True)
+        self.assertEqual(job.result['checked'], 1)
+        self.assertNotIn(
+            (self.outlier.pk, 'outlier', None), self.flags()
+        )
+
+    def test_tenant_job_checks_only_its_records_and_watermark(self):
+        other = Tenant.objects.create(name='Другая')
+        status = Status.objects.create(name='Бизнес', tenant=other)
+        type_ = Type.objects.create(name='Списание', tenant=other)
+        category = Category.objects.create(name='Маркетинг', type=type_)
+        subcategory = Subcategory.objects.create(name='Avito', category=category)
+        foreign = self.create_cashflows(
+            2, step_days=0, amount=Decimal('7.00'), status=status, type=type_,
+            category=category, subcategory=subcategory, tenant=other,
+        )
+        CashFlowFlag.objects.create(
+            cashflow=foreign[0], kind=CashFlowFlag.Kind.OUTLIER, score=9.0
+        )
+
+        job = submit_job(Job.Kind.DETECT, {}, inline=True, tenant_id=self.tenant.pk)
+        self.assertEqual(job.result['checked'], 17)
+        self.assertIn((foreign[0].pk, 'outlier', None), self.flags())
+        self.assertNotIn(foreign[1].pk, {flag[0] for flag in self.flags()})
+
+        # Прошлый поиск другой организации не сдвигает окно этой.
+        job = submit_job(Job.Kind.DETECT, {}, inline=True, tenant_id=other.pk)
+        self.assertEqual(job.result['since'], 0)
+        self.assertEqual(job.result['checked'], 2)
+        self.assertIn((foreign[1].pk, 'duplicate', foreign[0].pk), self.flags())
+        self.assertNotIn((foreign[0].pk, 'outlier', None), self.flags())
+        self.assertIn((self.outlier.pk, 'outlier', None), self.flags())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='cashflow-reconcile-'))
+class ReconciliationTests(CashFlowDataMixin, TestCase):
+    """Тесты сверки банковской выписки с учетом."""
+
+    def test_match_exact_then_fuzzy(self):
+        entries = [
+            (2, 10, 'RUB', 500, ''), (3, 11, 'RUB', 500, ''),
+            (4, 20, 'RUB', 700, ''), (5, 30, 'RUB', 900, ''),
+        ]
+        ledger = [
+            (1, 9, 'RUB', 500), (2, 11, 'RUB', 500), (3, 24, 'RUB', 700),
+            (4, 30, 'USD', 900),
+        ]
+        matches, lines, rows = reconciliation.match(entries, ledger, 1)
+        self.assertEqual(
+            sorted((entry[0], pk, kind) for entry, pk, kind in matches),
+            [(2, 1, 'fuzzy'), (3, 2, 'exact')]
+        )
+        self.assertEqual([entry[0] for entry in lines], [4, 5])
+        self.assertEqual([row[0] for row in rows], [3, 4])
+
+    def test_reconcile_job_marks_matched_rows(self):
+        reconciled = Status.objects.create(name='Сверено', tenant=self.tenant)
+        exact, fuzzy, extra = [
+            self.create_cashflows(1, start=datetime.date(2024, 1, day),
+                                  amount=Decimal(amount))[0]
+            for day, amount in ((10, '100.00'), (12, '250.00'), (20, '999.00'))
+        ]
+        self.create_cashflows(
+            1, start=datetime.date(2024, 1, 11), amount=Decimal('300.00'),
+            status=reconciled
+        )
+        statement = (
+            'date,amount,currency,description\n'
+            '2024-01-10,-100.00,RUB,Оплата\n'
+            '2024-01-14,"250,00",,Перевод\n'
+            '2024-01-11,300.00,RUB,Уже сверено\n'
+            '2024-01-25,77.00,RUB,Нет в учете\n'
+            '2024-01-26,abc,RUB,Ошибка\n'
+        )
+        upload = SimpleUploadedFile('statement.csv', statement.encode())
+        response = self.client.post('/api/jobs/', {
+            'kind': 'reconcile', 'inline': 'true', 'file': upload,
+            'params': json.dumps({'status': reconciled.pk}),
+        })
+        job = response.json()
+        self.assertEqual(job['state'], 'done', job['error'])
+        result = job['result']
+        self.assertEqual((result['exact'], result['fuzzy']), (1, 1))
+        self.assertEqual(result['unmatched_lines'], [4, 5])
+        self.assertEqual(result['unmatched_ledger'], [extra.pk])
+        self.assertEqual(result['error_lines'], [6])
+        self.assertEqual(
+            set(CashFlow.objects.filter(status=reconciled).values_list('pk', flat=True)),
+            {exact.pk, fuzzy.pk} | set(
+                CashFlow.objects.filter(amount=Decimal('300.00')).values_list('pk', flat=True)
+            )
+        )
+
+        response = self.client.get(f"/api/jobs/{job['id']}/download/")
+        report = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(report[0], ','.join(reconciliation.REPORT_HEADER))
+        self.assertEqual(
+            sorted(line.split(',')[0] for line in report[1:]),
+            ['exact', 'fuzzy', 'ledger', 'statement', 'statement']
+        )
+
+
+class ProfilingTests(CashFlowDataMixin, TestCase):
+    """Тесты профилирования запросов (?_profile=html|download)."""
+
+    def setUp(self):
+        profiling.profile_buffer().clear()
+        self.staff = get_user_model().objects.create_user(
+            'staff', password='password', is_staff=True
+        )
+        self.staff.cash_flow_tenants.add(self.tenant)
+        self.create_cashflows(3)
+
+    def test_staff_html_overlay(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('cashflow_list'), {'_profile': 'html'})
+        self.assertContains(response, 'id="request-profile"')
+        self.assertContains(response, 'FROM &quot;cash_flow_cashflow&quot;')
+        # SQLite: EXPLAIN QUERY PLAN
+        self.assertRegex(response.content.decode(), r'(SCAN|SEARCH) ')
+        self.assertEqual(len(profiling.profile_buffer()), 1)
+
+    def test_download_for_api_by_header(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/cashflows/', HTTP_X_PROFILE='download')
+        self.assertIn('attachment', response['Content-Disposition'])
+        profile = json.loads(response.content)
+        self.assertEqual(profile['status'], 200)
+        self.assertTrue(profile['queries'])
+        selects = [q for q in profile['queries'] if q['sql'].startswith('SELECT')]
+        self.assertTrue(all(q['explain'] for q in selects))
+        self.assertIn('cumulative', profile['stats'])
+
+    def test_explain_select_and_cte_only(self):
+        def query(sql):
+            return {
+                'alias': 'default', 'sql': sql, 'params': (), 'many': False,
+                'redacted': False,
+            }
+
+        self.assertRegex(
+            profiling.explain(query(
+                'WITH recent AS (SELECT id FROM cash_flow_cashflow) '
+                'SELECT * FROM recent'
+            )),
+            r'(SCAN|SEARCH) '
+        )
+        self.assertIsNone(profiling.explain(query('DELETE FROM django_session')))
+
+    def test_ignored_for_non_staff(self):
+        user = get_user_model().objects.create_user('user', password='password')
+        user.cash_flow_tenants.add(self.tenant)
+        self.client.force_login(user)
+        with mock.patch.object(profiling, 'profile_request') as profile_request:
+            response = self.client.get(
+                reverse('cashflow_list'), {'_profile': 'html'}
+            )
+        profile_request.assert_not_called()
+        self.assertNotContains(response, 'id="request-profile"')
+        self.assertEqual(
+            self.client.get(reverse('profile_list')).status_code, 403
+        )
+
+    @override_settings(CASH_FLOW_PROFILE_SAMPLE_RATE=1.0,
+                       CASH_FLOW_PROFILE_BUFFER_SIZE=2)
+    def test_sampling_into_ring_buffer(self):
+        # Буфер общий для всех организаций: сотрудникам он недоступен.
+        self.client.force_login(self.staff)
+        self.assertEqual(
+            self.client.get(reverse('profile_list')).status_code, 403
+        )
+        self.assertEqual(
+            self.client.get(reverse('profile_detail', args=[1])).status_code, 403
+        )
+        self.client.logout()
+
+        for _ in range(3):
+            response = self.client.get(reverse('cashflow_list'))
+            self.assertNotContains(response, 'id="request-profile"')
+        buffer = profiling.profile_buffer()
+        self.assertEqual(len(buffer), 2)
+        self.assertTrue(all(p['sampled'] and not p['explained'] for p in buffer))
+        profile = buffer[-1]
+        self.assertTrue(all(
+            query['params'] is None for query in profile['queries']
+        ))
+
+        admin = get_user_model().objects.create_superuser('admin', password='password')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('profile_list'))
+        self.assertContains(response, 'выборка')
+        response = self.client.get(reverse('profile_detail', args=[profile['id']]))
+        self.assertContains(response, 'cProfile')
+        self.assertContains(response, 'параметры скрыты')
+        self.assertTrue(profile['explained'])
+        selects = [q for q in profile['queries'] if q['sql'].startswith('SELECT')]
+        self.assertTrue(all(
+            q['explain'] and 'не выполнен' not in q['explain'] for q in selects
+        ))
+
+    def test_session_params_are_redacted(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/cashflows/', {
+            '_profile': 'download', 'status': self.status.pk,
+        })
+        cashflows = [
+            q for q in json.loads(response.content)['queries']
+            if 'FROM "cash_flow_cashflow"' in q['sql']
+        ]
+        self.assertTrue(cashflows)
+        self.assertTrue(any(str(self.status.pk) in q['params'] for q in cashflows))
+
+        session_key = self.client.session.session_key
+        response = self.client.post(
+            reverse('admin:logout'), HTTP_X_PROFILE='download'
+        )
+        self.assertNotIn(session_key, response.content.decode())
+        sessions = [
+            q for q in json.loads(response.content)['queries']
+            if 'django_session' in q['sql']
+        ]
+        self.assertTrue(sessions)
+        for query in sessions:
+            self.assertTrue(query['redacted'])
+            self.assertEqual(query['params'], [])
+
+
+@override_settings(STATIC_ROOT=tempfile.mkdtemp(prefix='cashflow-static-'))
+class StaticAssetsTests(CashFlowDataMixin, TestCase):
+    """Статика с хешем в имени, сжатыми копиями и заголовками кеширования."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def fetch(self, url, **headers):
+        response = self.client.get(url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_page_links_hashed_assets_served_compressed_and_immutable(self):
+        page = self.client.get(reverse('cashflow_list')).content.decode()
+        self.assertNotIn('cdn.jsdelivr.net', page)
+        self.assertNotIn('<script>', page)
+        url = re.search(r'/static/vendor/bootstrap/css/bootstrap\.min\.\w{12}\.css', page).group()
+        script = re.search(r'/static/js/dependent_dropdowns\.\w{12}\.js', page)
+        self.assertIsNotNone(script)
+
+        response, body = self.fetch(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(response['Content-Type'].startswith('text/css'))
+        with open(os.path.join(settings.STATIC_ROOT, url[len('/static/'):]), 'rb') as source:
+            original = source.read()
+        self.assertEqual(gzip.decompress(body), original)
+        self.assertLess(len(body), len(original) / 4)
+
+        response, body = self.fetch(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(body, original)
+
+        # Шрифты в CSS Font Awesome тоже ссылаются на имена с хешем.
+        css = re.search(r'/static/vendor/fontawesome/css/all\.min\.\w{12}\.css', page).group()
+        _, body = self.fetch(css)
+        self.assertRegex(body.decode(), r'webfonts/fa-solid-900\.\w{12}\.woff2')
+
+    def test_unhashed_asset_revalidates_with_etag(self):
+        url = '/static/css/base.css'
+        response, body = self.fetch(url)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertIn(b'.sidebar', body)
+
+        response, body = self.fetch(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+
+        self.assertEqual(self.client.get('/static/missing.css').status_code, 404)
+
+
+class QueryGuardrailTests(CashFlowDataMixin, TestCase):
+    """Тесты ограничений стоимости запросов к списку (guardrails)."""
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.create_cashflows(12, step_days=1)
+
+    def test_page_size_is_capped(self):
+        response = self.client.get('/api/cashflows/', {'page_size': 5})
+        self.assertEqual(len(response.json()['results']), 5)
+
+        with self.settings(CASH_FLOW_MAX_PAGE_SIZE=50):
+            response = self.client.get('/api/cashflows/', {'page_size': 51})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('page_size', response.json())
+
+        response = self.client.get(reverse('cashflow_list'), {'page_size': 11})
+        self.assertEqual(len(response.context['cashflows']), 11)
+        self.assertContains(response, 'page_size=11')
+        response = self.client.get(reverse('cashflow_list'), {'page_size': 'all'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(metrics.snapshot()['guardrails.rejected.page_size'], 2)
+
+    def test_unindexed_sort_and_search_need_short_range(self):
+        ok = self.client.get('/api/cashflows/', {'ordering': '-date_created'})
+        self.assertEqual(ok.status_code, 200)
+
+        response = self.client.get(
+            '/api/cashflows/', {'search': 'a', 'ordering': 'subcategory__name'}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'search', 'ordering'})
+        response = self.client.get('/api/cashflows/totals/', {
+            'ordering': 'amount', 'start_date': '2020-01-01', 'end_date': '2024-12-31',
+        })
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/api/cashflows/', {
+            'ordering': '-amount', 'search': 'a',
+            'start_date': '2024-01-01', 'end_date': '2024-01-31',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(metrics.snapshot(), {
+            'guardrails.rejected.ordering': 2,
+            'guardrails.rejected.search': 1,
+        })
+
+    def test_statement_timeout_returns_400_and_is_counted(self):
+        with mock.patch.object(guardrails, 'PROGRESS_STEPS', 1), \
+                self.settings(CASH_FLOW_STATEMENT_TIMEOUT=1e-9):
+            response = self.client.get('/api/cashflows/')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['detail'], guardrails.QueryTimeout.default_detail)
+
+            response = self.client.get(reverse('cashflow_list'))
+            self.assertEqual(response.status_code, 400)
+            self.assertContains(response, 'слишком долго', status_code=400)
+
+        # Соединение после прерывания остается рабочим.
+        self.assertEqual(CashFlow.objects.count(), 12)
+        self.assertEqual(self.client.get('/api/cashflows/').status_code, 200)
+        self.assertEqual(metrics.snapshot(), {
+            'guardrails.timeout.api': 1,
+            'guardrails.timeout.list': 1,
+        })
+
+        staff = get_user_model().objects.create_user('staff', is_staff=True)
+        self.client.force_login(staff)
+        counters = self.client.get(reverse('metrics')).json()['counters']
+        self.assertEqual(counters['guardrails.timeout.api'], 1)
+
+
+class ResultCacheTests(CashFlowDataMixin, TransactionTestCase):
+    """
+    Тесты кеша результатов. TransactionTestCase: кеш не используется
+    внутри транзакции, а версии меняются после фиксации.
+    """
+
+    def setUp(self):
+        self.setUpTestData()
+        caches['results'].clear()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.other = Subcategory.objects.create(name='Яндекс', category=self.category)
+        self.create_cashflows(3, start=datetime.date(2024, 1, 10), step_days=5)
+        self.create_cashflows(2, start=datetime.date(2024, 3, 10), subcategory=self.other)
+
+    def api(self, **params):
+        response = self.client.get('/api/cashflows/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_api_cache_is_invalidated_only_by_matching_writes(self):
+        january = {
+            'subcategory': self.subcategory.pk,
+            'start_date': '2024-01-01', 'end_date': '2024-01-31',
+        }
+        self.assertEqual(self.api(**january)['count'], 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.api(**january)['count'], 3)
+
+        # Другая подкатегория или другой месяц не сбрасывают результат.
+        values = {
+            'status': self.status, 'type': self.type,
+            'category': self.category, 'amount': Decimal('5.00'),
+        }
+        CashFlow.objects.create(
+            date_created=datetime.date(2024, 1, 15), subcategory=self.other, **values
+        )
+        row = CashFlow.objects.create(
+            date_created=datetime.date(2024, 2, 1), subcategory=self.subcategory, **values
+        )
+        with self.assertNumQueries(0):
+            self.api(**january)
+
+        # Запись, перенесенная в январь, сбрасывает его.
+        row.date_created = datetime.date(2024, 1, 20)
+        row.save()
+        self.assertEqual(self.api(**january)['count'], 4)
+        # ...и перенос обратно тоже (по состоянию до изменения).
+        row.date_created = datetime.date(2024, 2, 1)
+        row.save()
+        self.assertEqual(self.api(**january)['count'], 3)
+
+        # Массовое изменение сбрасывает все результаты организации.
+        CashFlow.objects.filter(subcategory=self.subcategory).update(comment='x')
+        data = self.api(**january)
+        self.assertEqual({item['comment'] for item in data['results']}, {'x'})
+
+        self.assertEqual(metrics.snapshot()['resultcache.api.hit'], 2)
+
+    def test_bulk_write_in_other_tenant_keeps_cached_results(self):
+        other = Tenant.objects.create(name='Другая')
+        status = Status.objects.create(name='Бизнес', tenant=other)
+        type_ = Type.objects.create(name='Списание', tenant=other)
+        category = Category.objects.create(name='Маркетинг', type=type_)
+        subcategory = Subcategory.objects.create(name='Avito', category=category)
+        self.create_cashflows(
+            2, status=status, type=type_, category=category,
+            subcategory=subcategory, tenant=other,
+        )
+        url = reverse('cashflow_list')
+        self.client.get(url)
+        self.api()
+
+        CashFlow.objects.for_tenant(other.pk).update(comment='x')
+        CashFlow.objects.for_tenant(other.pk).filter(
+            pk=CashFlow.objects.for_tenant(other.pk).first().pk
+        ).delete()
+        anomalies.detect(tenant_id=other.pk)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+            self.api()
+
+        CashFlow.objects.for_tenant(self.tenant.pk).update(comment='y')
+        self.assertEqual(
+            {item['comment'] for item in self.api()['results']}, {'y'}
+        )
+
+    def test_list_page_is_cached_and_hit_ratio_exposed(self):
+        url = reverse('cashflow_list')
+        params = {'start_date': '2024-03-01', 'end_date': '2024-03-31'}
+        first = self.client.get(url, params)
+        with self.assertNumQueries(0):
+            second = self.client.get(url, params)
+        self.assertEqual(first.content, second.content)
+
+        # Фасеты считаются по всем подкатегориям: запись другой
+        # подкатегории за март сбрасывает страницу и с фильтром.
+        filtered = {**params, 'subcategory': self.other.pk}
+        self.client.get(url, filtered)
+        self.create_cashflows(1, start=datetime.date(2024, 3, 20))
+        response = self.client.get(url, filtered)
+        self.assertEqual(response.context['cashflows'].count(), 2)
+        facets = {item.pk: item.facet['count'] for item in response.context['subcategories']}
+        self.assertEqual(facets[self.subcategory.pk], 1)
+
+        staff = get_user_model().objects.create_user('staff', is_staff=True)
+        self.client.force_login(staff)
+        ratio = self.client.get(reverse('metrics')).json()['result_cache']['list']
+        self.assertEqual(ratio, {'hits': 1, 'misses': 3, 'hit_ratio': 0.25})
+
+
+class TenantTests(CashFlowDataMixin, TestCase):
+    """Тесты разделения данных организаций."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.create_cashflows(3)
+        cls.other = Tenant.objects.create(name='Другая')
+        other_status = Status.objects.create(name='Бизнес', tenant=cls.other)
+        other_type = Type.objects.create(name='Списание', tenant=cls.other)
+        other_category = Category.objects.create(name='Маркетинг', type=other_type)
+        cls.other_subcategory = Subcategory.objects.create(
+            name='Avito', category=other_category
+        )
+        cls.other_row = CashFlow.objects.create(
+            date_created=datetime.date(2024, 1, 5), status=other_status,
+            type=other_type, category=other_category,
+            subcategory=cls.other_subcategory, amount=Decimal('7.00'),
+        )
+        User = get_user_model()
+        cls.member = User.objects.create_user('member', is_staff=True)
+        cls.member.cash_flow_tenants.add(cls.other)
+        cls.admin = User.objects.create_superuser('admin')
+
+    def test_hierarchy_inherits_tenant(self):
+        self.assertEqual(self.other_subcategory.tenant, self.other)
+        self.assertEqual(self.other_row.tenant, self.other)
+        self.assertEqual(
+            set(CashFlow.objects.values_list('tenant', flat=True)),
+            {self.tenant.pk, self.other.pk}
+        )
+
+    def test_list_and_api_show_only_own_tenant(self):
+        response = self.client.get(reverse('cashflow_list'))
+        self.assertEqual(len(response.context['cashflows']), 3)
+        self.assertEqual(self.client.get('/api/cashflows/').json()['count'], 3)
+        self.assertEqual(
+            self.client.get(f'/api/cashflows/{self.other_row.pk}/').status_code, 404
+        )
+
+        self.client.force_login(self.member)
+        data = self.client.get('/api/cashflows/').json()
+        self.assertEqual([item['id'] for item in data['results']], [self.other_row.pk])
+        self.assertEqual(
+            self.client.get(
+                reverse('cashflow_update', args=[
+                    CashFlow.objects.filter(tenant=self.tenant).first().pk
+                ])
+            ).status_code, 404
+        )
+        categories = self.client.get(
+            reverse('ajax_categories'), {'type_id': self.type.pk}
+        ).json()
+        self.assertEqual(categories, [])
+
+    def test_user_without_tenant_gets_no_default_tenant(self):
+        outsider = get_user_model().objects.create_user('outsider')
+        self.client.force_login(outsider)
+        self.assertIsNone(
+            tenancy.current_tenant_id(self.client.get('/api/').wsgi_request)
+        )
+        self.assertEqual(self.client.get(reverse('cashflow_list')).status_code, 403)
+        self.assertEqual(self.client.get('/api/cashflows/').status_code, 403)
+        self.assertEqual(
+            self.client.get(reverse('cashflow_batch'), {
+                'action': 'delete', 'select_all': '1',
+            }).status_code,
+            403
+        )
+        self.assertEqual(self.client.post('/api/jobs/', {'kind': 'export'}).status_code, 403)
+        self.assertEqual(CashFlow.objects.filter(tenant=self.tenant).count(), 3)
+
+    def test_superuser_selects_tenant(self):
+        self.client.force_login(self.admin)
+        data = self.client.get(
+            '/api/cashflows/', HTTP_X_TENANT=str(self.other.pk)
+        ).json()
+        self.assertEqual(data['count'], 1)
+
+        response = self.client.post(reverse('select_tenant'), {'tenant': self.other.pk})
+        self.assertRedirects(response, reverse('cashflow_list'))
+        self.assertEqual(self.client.get('/api/cashflows/').json()['count'], 1)
+
+        # Участник не может выбрать чужую организацию.
+        self.client.force_login(self.member)
+        self.client.post(reverse('select_tenant'), {'tenant': self.tenant.pk})
+        self.assertNotIn(tenancy.SESSION_KEY, self.client.session)
+        data = self.client.get('/api/cashflows/', HTTP_X_TENANT=str(self.tenant.pk)).json()
+        self.assertEqual(data['count'], 1)
+
+    def test_no_tenant_is_forbidden(self):
+        with self.settings(CASH_FLOW_DEFAULT_TENANT=None):
+            self.assertEqual(self.client.get('/api/cashflows/').status_code, 403)
+            self.assertEqual(
+                self.client.get(reverse('cashflow_list')).status_code, 403
+            )
+
+    def test_references_and_uniqueness_are_per_tenant(self):
+        response = self.client.post('/api/statuses/', {'name': 'Бизнес'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('name', response.json())
+
+        self.client.force_login(self.member)
+        response = self.client.post('/api/statuses/', {'name': 'Личное'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Status.objects.get(pk=response.json()['id']).tenant, self.other)
+
+        response = self.client.post('/api/cashflows/', {
+            'date_created': '2024-02-01', 'status': self.status.pk,
+            'type': self.other_row.type_id, 'category': self.other_row.category_id,
+            'subcategory': self.other_subcategory.pk, 'amount': '1.00',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', response.json())
+
+        response = self.client.post(reverse('status_create'), {'name': 'Бизнес'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+
+    def test_admin_limits_staff_to_tenant(self):
+        self.member.user_permissions.add(
+            *Permission.objects.filter(codename__endswith='_cashflow')
+        )
+        extra = Status.objects.create(name='Личное', tenant=self.other)
+        self.client.force_login(self.member)
+        response = self.client.get(reverse('admin:cash_flow_cashflow_changelist'))
+        self.assertEqual(
+            [row.pk for row in response.context['cl'].result_list], [self.other_row.pk]
+        )
+        status_filter = next(
+            spec for spec in response.context['cl'].filter_specs
+            if spec.field_path == 'status'
+        )
+        self.assertEqual(
+            {pk for pk, _ in status_filter.lookup_choices},
+            {self.other_row.status_id, extra.pk}
+        )
+
+        foreign = Category.objects.create(name='Чужая категория', type=self.type)
+        response = self.client.get(
+            reverse('admin:cash_flow_cashflow_changelist'),
+            {'category__id__exact': foreign.pk}
+        )
+        category_filter = next(
+            spec for spec in response.context['cl'].filter_specs
+            if spec.field_path == 'category'
+        )
+        self.assertEqual(category_filter.lookup_choices, [])
+        self.assertNotContains(response, 'Чужая категория')
+
+    def test_result_cache_keys_and_scopes_are_per_tenant(self):
+        params = {'start_date': '2024-01-01', 'end_date': '2024-01-31'}
+        names = resultcache.dependencies(params, self.tenant.pk)
+        self.assertIn(f't{self.tenant.pk}:month:2024-01', names)
+        self.assertFalse(set(names) & set(
+            resultcache.state_dependencies(
+                events.cashflow_state(self.other_row.__dict__), self.other.pk
+            )
+        ))
+
+    def test_events_are_delivered_per_tenant(self):
+        subscription = events.Subscription(tenant=self.tenant.pk)
+        own = events.cashflow_event(CashFlow.objects.filter(tenant=self.tenant).first(), 'update')
+        self.assertTrue(subscription.matches(own))
+        self.assertFalse(subscription.matches(events.cashflow_event(self.other_row, 'update')))
+        self.assertTrue(subscription.matches(
+            events.bulk_event('bulk_update', 0, 1, tenant=self.tenant.pk)
+        ))
+        self.assertFalse(subscription.matches(
+            events.bulk_event('bulk_update', 0, 1, tenant=self.other.pk)
+        ))
+        # Событие без организации — только подпискам без организации.
+        self.assertFalse(subscription.matches(events.bulk_event('bulk_update', 0, 1)))
+        self.assertTrue(events.Subscription().matches(events.bulk_event('bulk_update', 0, 1)))
+
+    def test_bulk_operations_publish_events_of_their_tenant(self):
+        published = []
+        with mock.patch.object(events, 'publish_on_commit',
+                               lambda event, using: published.append(event)):
+            CashFlow.objects.for_tenant(self.other.pk).update(comment='x')
+            CashFlow.objects.all().update(comment='y')
+            CashFlow.objects.bulk_create([
+                CashFlow(
+                    date_created=datetime.date(2024, 2, 1), status=self.status,
+                    type=self.type, category=self.category,
+                    subcategory=self.subcategory, amount=Decimal('1.00'),
+                )
+            ])
+        self.assertEqual(
+            [(event.op, event.tenant) for event in published],
+            [('bulk_update', self.other.pk),
+             ('bulk_update', self.tenant.pk), ('bulk_update', self.other.pk),
+             ('bulk_create', self.tenant.pk)]
+        )
+
+
+class WarmupTests(CashFlowDataMixin, TestCase):
+    """Тесты прогрева процесса."""
+
+    def test_warmup_runs_all_stages(self):
+        self.create_cashflows(2)
+        profile = warmup.warmup()
+        stages = {stage['stage']: stage['detail'] for stage in profile['stages']}
+        self.assertEqual(
+            list(stages),
+            ['imports', 'urls', 'templates', 'database', 'references', 'requests']
+        )
+        self.assertFalse([name for name, detail in stages.items() if 'error' in detail])
+        self.assertGreater(stages['templates']['compiled'], 0)
+        self.assertEqual(stages['references']['status'], 1)
+        self.assertEqual(
+            {result['status'] for result in stages['requests'].values()}, {200}
+        )
+
+        staff = get_user_model().objects.create_user('staff', is_staff=True)
+        self.client.force_login(staff)
+        data = self.client.get(reverse('metrics')).json()
+        self.assertEqual(data['warmup']['total'], profile['total'])
+
+    def test_warmup_command(self):
+        out = io.StringIO()
+        call_command('warmup', '--no-requests', stdout=out)
+        output = out.getvalue()
+        self.assertIn('templates', output)
+        self.assertNotIn('requests', output)
+        self.assertIn('Прогрев завершен', output)
+
+
+class GeneratedStream(io.RawIOBase):
+    """
+    Тело multipart-запроса с файлом size байт, которое генерируется при
+    чтении: в памяти теста его нет.
+    """
+    BOUNDARY = 'cashflowboundary'
+
+    def __init__(self, size, block):
+        self.head = (
+            f'--{self.BOUNDARY}\r\nContent-Disposition: form-data; '
+            f'name="file"; filename="scan.pdf"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n'
+        ).encode()
+        self.tail = f'\r\n--{self.BOUNDARY}--\r\n'.encode()
+        self.size = size
+        self.block = block
+        self.length = len(self.head) + size + len(self.tail)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        view = memoryview(buffer)
+        written = 0
+        while written < len(view) and self.position < self.length:
+            offset = self.position
+            if offset < len(self.head):
+                chunk = self.head[offset:]
+            elif offset < len(self.head) + self.size:
+                offset -= len(self.head)
+                chunk = self.block[offset % len(self.block):][:self.size - offset]
+            else:
+                chunk = self.tail[offset - len(self.head) - self.size:]
+            chunk = chunk[:len(view) - written]
+            view[written:written + len(chunk)] = chunk
+            written += len(chunk)
+            self.position += len(chunk)
+        return written
+
+
+class AttachmentTests(CashFlowDataMixin, TestCase):
+    """Тесты вложений: хранение по содержимому, диапазоны, очистка."""
+
+    def setUp(self):
+        root = tempfile.mkdtemp(prefix='cashflow-attachments-')
+        settings_override = override_settings(CASH_FLOW_ATTACHMENTS_ROOT=root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.rows = self.create_cashflows(2)
+        self.content = bytes(range(256)) * 40
+
+    def upload(self, row, content=None, name='receipt.pdf',
+               content_type='application/pdf'):
+        return self.client.post(
+            f'/api/cashflows/{row.pk}/attachments/',
+            {'file': SimpleUploadedFile(name, content or self.content, content_type)},
+        )
+
+    def stored_files(self):
+        return [
+            name for _, _, files in os.walk(attachments.attachments_root())
+            for name in files
+        ]
+
+    def test_same_content_stored_once(self):
+        first = self.upload(self.rows[0])
+        second = self.upload(self.rows[1], name='copy.pdf')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.json()['digest'], second.json()['digest'])
+        self.assertEqual(StoredFile.objects.count(), 1)
+        self.assertEqual(Attachment.objects.count(), 2)
+        self.assertEqual(self.stored_files(), [first.json()['digest']])
+
+        listed = self.client.get(f'/api/cashflows/{self.rows[1].pk}/attachments/').json()
+        self.assertEqual([item['name'] for item in listed], ['copy.pdf'])
+        self.assertEqual(listed[0]['size'], len(self.content))
+
+    def test_range_requests(self):
+        url = self.upload(self.rows[0]).json()['url']
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=100-1123')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:1124])
+        self.assertEqual(response['Content-Range'], f'bytes 100-1123/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '1024')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+        response = self.client.get(url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # If-Range с устаревшим ETag — весь файл.
+        response = self.client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unsafe_types_are_downloaded(self):
+        data = self.upload(
+            self.rows[0], b'<script>alert(1)</script>', 'page.html', 'text/html'
+        ).json()
+        response = self.client.get(data['url'])
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertTrue(response['Content-Disposition'].startswith('attachment'))
+
+    @override_settings(CASH_FLOW_ATTACHMENT_MAX_SIZE=1000)
+    def test_limits(self):
+        response = self.upload(self.rows[0])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file', response.json())
+        self.assertEqual(self.upload(self.rows[0], b'').status_code, 400)
+        self.assertEqual(StoredFile.objects.count(), 0)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_other_tenant_gets_404(self):
+        url = self.upload(self.rows[0]).json()['url']
+        attachment = Attachment.objects.get()
+        other = Tenant.objects.create(name='Другая')
+        member = get_user_model().objects.create_user('member', is_staff=True)
+        member.cash_flow_tenants.add(other)
+        self.client.force_login(member)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(
+            self.client.get(reverse('attachment_download', args=[attachment.pk])).status_code,
+            404
+        )
+
+    def test_html_upload_download_and_delete(self):
+        row = self.rows[0]
+        response = self.client.post(
+            reverse('attachment_upload', args=[row.pk]),
+            {'file': SimpleUploadedFile('scan.png', self.content, 'image/png')},
+        )
+        self.assertRedirects(response, reverse('cashflow_update', args=[row.pk]))
+        attachment = Attachment.objects.get()
+        page = self.client.get(reverse('cashflow_update', args=[row.pk]))
+        self.assertContains(page, 'scan.png')
+
+        response = self.client.get(
+            reverse('attachment_download', args=[attachment.pk]), {'download': '1'}
+        )
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response['Content-Disposition'].startswith('attachment'))
+
+        self.client.post(reverse('attachment_delete', args=[attachment.pk]))
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_collect_garbage(self):
+        self.upload(self.rows[0])
+        self.upload(self.rows[1], self.content[::-1])
+        CashFlow.objects.filter(pk=self.rows[1].pk).delete()
+
+        # Недавно использованные файлы не удаляются.
+        result = attachments.collect_garbage()
+        self.assertEqual(result, {'attachments': 1, 'files': 0, 'bytes': 0})
+        self.assertEqual(len(self.stored_files()), 2)
+
+        out = io.StringIO()
+        call_command('collect_attachments', '--grace-seconds', '0', stdout=out)
+        self.assertIn('файлов: 1', out.getvalue())
+        self.assertEqual(StoredFile.objects.count(), 1)
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_collect_garbage_sweeps_files_without_rows(self):
+        # Транзакция с вложением откатилась после переноса файла.
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                attachments.store(
+                    self.rows[0], SimpleUploadedFile('a.pdf', self.content)
+                )
+                raise RuntimeError
+        self.assertFalse(StoredFile.objects.exists())
+        self.upload(self.rows[1], self.content[::-1])
+        temp = attachments.attachments_root() / attachments.TEMP_DIR
+        (temp / 'crashed.upload').write_bytes(b'x' * 10)
+        self.assertEqual(len(self.stored_files()), 3)
+
+        result = attachments.collect_garbage()
+        self.assertEqual(result['files'], 0)
+        self.assertEqual(len(self.stored_files()), 3)
+
+        result = attachments.collect_garbage(grace_seconds=0)
+        self.assertEqual(
+            result, {'attachments': 0, 'files': 2, 'bytes': len(self.content) + 10}
+        )
+        # Файл с вложением остается.
+        self.assertEqual(
+            self.stored_files(), [StoredFile.objects.get().digest]
+        )
+
+    def test_large_upload_and_download_memory_is_bounded(self):
+        size = 32 * 2 ** 20
+        block = os.urandom(attachments.CHUNK_SIZE * 3 + 17)
+        stream = GeneratedStream(size, block)
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': f'/api/cashflows/{self.rows[0].pk}/attachments/',
+            'QUERY_STRING': '',
+            'CONTENT_TYPE': f'multipart/form-data; boundary={stream.BOUNDARY}',
+            'CONTENT_LENGTH': str(stream.length),
+            'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+            'HTTP_HOST': 'testserver', 'HTTP_ACCEPT': 'application/json',
+            'wsgi.input': io.BufferedReader(stream),
+            'wsgi.url_scheme': 'http', 'wsgi.errors': io.StringIO(),
+        }
+        handler = ClientHandler()
+        tracemalloc.start()
+        try:
+            response = handler(environ)
+            upload_peak = tracemalloc.get_traced_memory()[1]
+            self.assertEqual(response.status_code, 201, response.content)
+
+            attachment = Attachment.objects.select_related('file').get()
+            self.assertEqual(attachment.file.size, size)
+            url = json.loads(response.content)['url']
+            tracemalloc.reset_peak()
+            for extra in ({}, {'HTTP_RANGE': f'bytes=1000-{size - 1000}'}):
+                streamed = self.client.get(url, **extra)
+                received = sum(len(chunk) for chunk in streamed.streaming_content)
+                streamed.close()
+                self.assertGreater(received, size - 2000)
+            download_peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(upload_peak, 4 * 2 ** 20)
+        self.assertLess(download_peak, 4 * 2 ** 20)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='cashflow-rules-'))
+class CategorizationRuleTests(CashFlowDataMixin, TestCase):
+    """Тесты правил автоматической категоризации."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.income = Type.objects.create(name='Поступление', tenant=cls.tenant)
+        cls.transport = Category.objects.create(name='Транспорт', type=cls.type)
+        cls.taxi = Subcategory.objects.create(name='Такси', category=cls.transport)
+        cls.fuel = Subcategory.objects.create(name='Топливо', category=cls.transport)
+        cls.salary = Subcategory.objects.create(
+            name='Зарплата',
+            category=Category.objects.create(name='Доходы', type=cls.income)
+        )
+
+    def add_rule(self, subcategory, **kwargs):
+        return CategorizationRule.objects.create(
+            name=kwargs.get('keyword') or 'Правило', tenant=self.tenant,
+            subcategory=subcategory, **kwargs
+        )
+
+    def test_compiled_keywords_match_like_substring_search(self):
+        words = ['яндекс', 'яндекс такси', 'такси', 'кс', 'a.b', 'ab', 'abc', 'b']
+        compiled = rules.RuleMatcher([
+            CategorizationRule(keyword=word.upper(), subcategory=self.taxi)
+            for word in words
+        ])
+        rng = random.Random(5)
+        alphabet = 'яндекс таиab.c'
+        for _ in range(500):
+            text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+            expected = [index for index, word in enumerate(words) if word in text]
+            self.assertEqual(compiled.candidates(text), expected, text)
+
+    def test_priority_and_conditions(self):
+        self.add_rule(self.fuel, keyword='лукойл', max_amount=Decimal('5000'))
+        self.add_rule(self.taxi, pattern=r'yandex\s*go', currency='RUB')
+        self.add_rule(self.salary, min_amount=Decimal('100000'), priority=200)
+        self.add_rule(self.taxi, keyword='лукойл', is_active=False, priority=1)
+        compiled = rules.matcher(self.tenant.pk)
+        self.assertEqual(len(compiled), 3)
+
+        def subcategory(comment, amount, currency='RUB'):
+            rule = compiled.match(comment, Decimal(amount), currency)
+            return rule and rule.subcategory
+
+        self.assertEqual(subcategory('АЗС ЛУКОЙЛ №12', '2500'), self.fuel)
+        self.assertEqual(subcategory('АЗС Лукойл', '7000'), None)
+        self.assertEqual(subcategory('YANDEX GO trip', '300'), self.taxi)
+        self.assertEqual(subcategory('Yandex Go trip', '300', 'USD'), None)
+        self.assertEqual(subcategory(None, '150000'), self.salary)
+
+    def test_matcher_is_rebuilt_only_when_rules_change(self):
+        rule = self.add_rule(self.taxi, keyword='такси')
+        compiled = rules.matcher(self.tenant.pk)
+        with self.assertNumQueries(1):
+            self.assertIs(rules.matcher(self.tenant.pk), compiled)
+        rule.keyword = 'uber'
+        rule.save()
+        rebuilt = rules.matcher(self.tenant.pk)
+        self.assertIsNot(rebuilt, compiled)
+        self.assertIsNone(rebuilt.match('такси', Decimal('1')))
+
+        # Перенос подкатегории правила в другую категорию.
+        other = Category.objects.create(name='Разъезды', type=self.income)
+        Subcategory.objects.filter(pk=self.taxi.pk).update(category=other)
+        moved = rules.matcher(self.tenant.pk)
+        self.assertIsNot(moved, rebuilt)
+        self.assertEqual(
+            moved.match('uber', Decimal('1')).subcategory.category, other
+        )
+
+        # Массовое изменение правил.
+        CategorizationRule.objects.filter(pk=rule.pk).update(keyword='такси')
+        self.assertIsNotNone(
+            rules.matcher(self.tenant.pk).match('такси', Decimal('1'))
+        )
+
+    def test_form_assigns_categories_by_rule(self):
+        self.add_rule(self.taxi, keyword='такси')
+        data = {
+            'date_created': '2024-05-01', 'status': self.status.pk,
+            'amount': '350', 'currency': 'RUB', 'comment': 'Такси до офиса',
+        }
+        form = CashFlowForm(data, tenant_id=self.tenant.pk)
+        self.assertTrue(form.is_valid(), form.errors)
+        cashflow = form.save()
+        self.assertEqual(
+            (cashflow.type, cashflow.category, cashflow.subcategory),
+            (self.type, self.transport, self.taxi)
+        )
+
+        form = CashFlowForm({**data, 'comment': 'Кофе'}, tenant_id=self.tenant.pk)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['subcategory'], [rules.NO_RULE_MESSAGE])
+
+        # С указанной подкатегорией правила не загружаются.
+        form = CashFlowForm({
+            **data, 'comment': 'Кофе', 'type': self.type.pk,
+            'category': self.transport.pk, 'subcategory': self.fuel.pk,
+        }, tenant_id=self.tenant.pk)
+        with mock.patch.object(rules, 'matcher') as matcher:
+            self.assertTrue(form.is_valid(), form.errors)
+        matcher.assert_not_called()
+        self.assertEqual(form.cleaned_data['subcategory'], self.fuel)
+
+    def test_api_single_and_bulk_create(self):
+        self.add_rule(self.taxi, keyword='такси')
+        self.add_rule(self.salary, keyword='зарплата')
+        row = {'date_created': '2024-05-01', 'status': self.status.pk, 'amount': '10.00'}
+        response = self.client.post(
+            '/api/cashflows/', {**row, 'comment': 'Оплата такси'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201, response.json())
+        self.assertEqual(response.json()['subcategory'], self.taxi.pk)
+
+        bulk = [
+            {**row, 'comment': 'Зарплата за май'},
+            {**row, 'comment': 'Такси'},
+            {**row, 'subcategory': self.fuel.pk},
+        ]
+        response = self.client.post('/api/cashflows/', bulk, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.json())
+        self.assertEqual(
+            [(item['type'], item['subcategory']) for item in response.json()],
+            [(self.income.pk, self.salary.pk), (self.type.pk, self.taxi.pk),
+             (self.type.pk, self.fuel.pk)]
+        )
+        self.assertEqual(CashFlow.objects.count(), 4)
+
+        # Ошибка в одной строке — пакет не создается.
+        response = self.client.post(
+            '/api/cashflows/', [*bulk, {**row, 'comment': 'Кофе'}],
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[3]['subcategory'], [rules.NO_RULE_MESSAGE])
+        self.assertEqual(CashFlow.objects.count(), 4)
+
+    def test_rule_api_validates_pattern(self):
+        response = self.client.post('/api/rules/', {
+            'name': 'Ошибка', 'pattern': '(', 'subcategory': self.taxi.pk
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pattern', response.json())
+        response = self.client.post('/api/rules/', {
+            'name': 'Такси', 'keyword': 'такси', 'subcategory': self.taxi.pk
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(CategorizationRule.objects.get().tenant, self.tenant)
+
+        self.client.force_login(get_user_model().objects.create_superuser('admin'))
+        response = self.client.get(reverse('admin:cash_flow_categorizationrule_changelist'))
+        self.assertContains(response, 'такси')
+
+    def test_import_categorizes_rows_without_categories(self):
+        self.add_rule(self.fuel, keyword='азс')
+        content = (
+            'date_created,status,type,category,subcategory,amount,currency,comment\n'
+            '2024-01-02,Бизнес,,,,1500.00,RUB,АЗС 24\n'
+            '2024-01-03,Бизнес,,,,10.00,RUB,Кофе\n'
+            + f'2024-01-04,Бизнес,{self.type.name},{self.category.name},'
+              f'{self.subcategory.name},5.00,RUB,АЗС\n'
+        )
+        response = self.client.post('/api/jobs/', {
+            'kind': 'import', 'inline': 'true',
+            'file': SimpleUploadedFile('import.csv', content.encode()),
+        })
+        result = response.json()['result']
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['categorized'], 1)
+        self.assertEqual(result['error_lines'], [3])
+        self.assertEqual(
+            sorted(CashFlow.objects.values_list('subcategory', flat=True)),
+            sorted([self.fuel.pk, self.subcategory.pk])
+        )
+
+    def test_apply_rules_to_history(self):
+        rows = self.create_cashflows(5, comment='Такси')
+        self.create_cashflows(2, comment='Кофе')
+        self.add_rule(self.taxi, keyword='такси')
+        seqs = dict(CashFlow.objects.values_list('pk', 'change_seq'))
+
+        out = io.StringIO()
+        call_command('apply_rules', '--dry-run', stdout=out)
+        self.assertIn('изменится: 5', out.getvalue())
+        self.assertFalse(CashFlow.objects.filter(subcategory=self.taxi).exists())
+
+        call_command('apply_rules', '--batch-size', '3', stdout=out)
+        self.assertIn('Проверено записей: 7, изменено: 5', out.getvalue())
+        changed = CashFlow.objects.filter(subcategory=self.taxi)
+        self.assertEqual(
+            set(changed.values_list('pk', flat=True)), {row.pk for row in rows}
+        )
+        self.assertEqual(set(changed.values_list('category', 'type').distinct()),
+                         {(self.transport.pk, self.type.pk)})
+        self.assertTrue(all(
+            row.change_seq > seqs[row.pk] for row in changed
+        ))
+
+        job = submit_job(Job.Kind.CATEGORIZE, {}, inline=True, tenant_id=self.tenant.pk)
+        self.assertEqual(job.result, {'checked': 7, 'changed': 0})
+
+
+class CashFlowBatchTests(CashFlowDataMixin, TestCase):
+    """Тесты пакетных действий над записями списка."""
+
+    def setUp(self):
+        self.rows = self.create_cashflows(6)
+        self.done = Status.objects.create(name='Проведено', tenant=self.tenant)
+        self.transport = Category.objects.create(name='Транспорт', type=self.type)
+        self.taxi = Subcategory.objects.create(name='Такси', category=self.transport)
+
+    def confirmed(self, data):
+        """data с подтверждением, как со страницы сводки (GET)."""
+        summary = self.client.get(reverse('cashflow_batch'), data).context['summary']
+        return {
+            **data, 'confirmed_count': summary['count'],
+            'confirmed_seq': summary['last_seq'],
+        }
+
+    def test_status_for_marked_rows_after_confirmation(self):
+        marked = [self.rows[0].pk, self.rows[2].pk]
+        page = self.client.get(
+            reverse('cashflow_batch'), {'action': 'status', 'ids': marked}
+        )
+        self.assertContains(page, 'отмеченным записям')
+        self.assertEqual(page.context['summary']['count'], 2)
+        self.assertEqual(page.context['totals']['total'], Decimal('200.00'))
+        self.assertContains(page, 'csrfmiddlewaretoken')
+        self.assertContains(page, 'name="confirmed_count" value="2"')
+        self.assertEqual(CashFlow.objects.filter(status=self.done).count(), 0)
+
+        seqs = dict(CashFlow.objects.values_list('pk', 'change_seq'))
+        response = self.client.post(reverse('cashflow_batch'), {
+            'action': 'status', 'ids': marked, 'new_status': self.done.pk,
+            'confirmed_count': 2, 'confirmed_seq': max(seqs[pk] for pk in marked),
+        }, follow=True)
+        self.assertRedirects(response, reverse('cashflow_list') + '?')
+        self.assertContains(response, 'Изменено записей: 2.')
+        changed = CashFlow.objects.filter(status=self.done)
+        self.assertEqual(sorted(changed.values_list('pk', flat=True)), marked)
+        self.assertTrue(all(row.change_seq > seqs[row.pk] for row in changed))
+
+    def test_categorize_all_matching_filter_in_constant_queries(self):
+        self.create_cashflows(40, start=datetime.date(2025, 1, 1), step_days=1)
+        data = {
+            'action': 'categorize', 'select_all': '1',
+            'start_date': '2024-01-01', 'end_date': '2024-12-31',
+            'new_type': self.type.pk, 'new_category': self.transport.pk,
+            'new_subcategory': self.taxi.pk,
+        }
+        data = self.confirmed(data)
+        self.assertEqual(data['confirmed_count'], 6)
+        with self.assertNumQueries(14):
+            response = self.client.post(reverse('cashflow_batch'), data)
+        self.assertRedirects(
+            response,
+            reverse('cashflow_list') + '?start_date=2024-01-01&end_date=2024-12-31',
+            fetch_redirect_response=False
+        )
+        self.assertEqual(CashFlow.objects.filter(subcategory=self.taxi).count(), 6)
+        self.assertEqual(
+            CashFlow.objects.filter(
+                category=self.transport, date_created__gte='2025-01-01'
+            ).count(),
+            0
+        )
+
+        # Запрос тот же при любом числе выбранных записей.
+        data = self.confirmed({**data, 'start_date': '', 'end_date': ''})
+        with self.assertNumQueries(14):
+            self.client.post(reverse('cashflow_batch'), data)
+        self.assertEqual(CashFlow.objects.filter(subcategory=self.taxi).count(), 46)
+
+    def test_delete_writes_tombstones(self):
+        marked = [row.pk for row in self.rows[:3]]
+        response = self.client.post(reverse('cashflow_batch'), self.confirmed({
+            'action': 'delete', 'ids': marked,
+        }), follow=True)
+        self.assertContains(response, 'Удалено записей: 3.')
+        self.assertFalse(CashFlow.objects.filter(pk__in=marked).exists())
+        self.assertEqual(
+            sorted(CashFlowTombstone.objects.values_list('object_id', flat=True)),
+            marked
+        )
+
+    def test_selection_changed_after_confirmation_changes_nothing(self):
+        data = self.confirmed({
+            'action': 'delete', 'select_all': '1', 'status': self.status.pk,
+        })
+        # После подтверждения одна запись изменена, другая добавлена.
+        self.rows[0].comment = 'Исправлено'
+        self.rows[0].save()
+        self.create_cashflows(1)
+        response = self.client.post(reverse('cashflow_batch'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'изменились после подтверждения')
+        self.assertContains(response, 'name="confirmed_count" value="7"')
+        self.assertEqual(CashFlow.objects.count(), 7)
+
+        # Без подтверждения действие не выполняется.
+        response = self.client.post(reverse('cashflow_batch'), {
+            'action': 'delete', 'select_all': '1', 'status': self.status.pk,
+        })
+        self.assertContains(response, 'Подтвердите действие')
+        self.assertEqual(CashFlow.objects.count(), 7)
+
+        response = self.client.post(
+            reverse('cashflow_batch'), self.confirmed(data), follow=True
+        )
+        self.assertContains(response, 'Удалено записей: 7.')
+        self.assertFalse(CashFlow.objects.exists())
+
+    def test_invalid_selection_and_values_change_nothing(self):
+        other = Tenant.objects.create(name='Другая')
+        foreign = self.create_cashflows(1, tenant=other)[0]
+        response = self.client.post(reverse('cashflow_batch'), {
+            'action': 'delete', 'ids': [self.rows[0].pk, foreign.pk],
+        }, follow=True)
+        self.assertContains(response, 'Часть отмеченных записей не найдена')
+        response = self.client.get(
+            reverse('cashflow_batch'), {'action': 'status'}, follow=True
+        )
+        self.assertContains(response, 'Не выбрано ни одной записи.')
+
+        response = self.client.post(reverse('cashflow_batch'), {
+            'action': 'categorize', 'ids': [self.rows[0].pk],
+            'new_category': self.category.pk, 'new_subcategory': self.taxi.pk,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('new_subcategory', response.context['batch_form'].errors)
+        self.assertEqual(CashFlow.objects.count(), 7)
+        self.assertFalse(CashFlow.objects.filter(subcategory=self.taxi).exists())
+
+    def test_list_page_has_selection_without_csrf_token(self):
+        page = self.client.get(reverse('cashflow_list'), {'status': self.status.pk})
+        self.assertContains(page, 'name="ids"', count=6)
+        self.assertContains(page, 'name="select_all"')
+        self.assertContains(page, f'name="status" value="{self.status.pk}"')
+        # Токен CSRF отключил бы кеш результатов списка; он есть только
+        # на странице подтверждения.
+        self.assertNotContains(page, 'csrfmiddlewaretoken')
@@ -41,6 +41,7 @@ def crud_patterns(prefix, view_class_prefix, name_prefix):
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('tenant/', views.select_tenant, name='select_tenant'),
 ]
 
 # Добавляем URL-шаблоны для каждого ресурса
@@ -50,6 +51,54 @@ urlpatterns.extend(crud_patterns('type/', 'Type', 'type'))
 urlpatterns.extend(crud_patterns('category/', 'Category', 'category'))
 urlpatterns.extend(crud_patterns('subcategory/', 'Subcategory', 'subcategory'))
 
+urlpatterns.append(
+    path(
+        'cashflow/export/',
+        views.CashFlowExportView.as_view(),
+        name='cashflow_export'
+    )
+)
+
+urlpatterns.append(
+    path(
+        'cashflow/batch/',
+        views.CashFlowBatchView.as_view(),
+        name='cashflow_batch'
+    )
+)
+
+urlpatterns.append(
+    path('events/', views.cashflow_events, name='cashflow_events')
+)
+
+urlpatterns.extend([
+    path(
+        'cashflow/<int:pk>/attachments/',
+        views.upload_attachment,
+        name='attachment_upload'
+    ),
+    path(
+        'attachments/<int:pk>/',
+        views.download_attachment,
+        name='attachment_download'
+    ),
+    path(
+        'attachments/<int:pk>/delete/',
+        views.delete_attachment,
+        name='attachment_delete'
+    ),
+])
+
+urlpatterns.extend([
+    path('profiles/', views.ProfileListView.as_view(), name='profile_list'),
+    path(
+        'profiles/<int:pk>/',
+        views.ProfileDetailView.as_view(),
+        name='profile_detail'
+    ),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+])
+
 # AJAX URL-шаблоны
 urlpatterns.extend([
     path(
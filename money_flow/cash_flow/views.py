@@ -1,16 +1,36 @@
-from django.shortcuts import redirect
+import datetime
+
+from django.shortcuts import get_object_or_404, redirect
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
-from django.urls import reverse_lazy
-from django.http import JsonResponse
+from django.urls import reverse, reverse_lazy
+from asgiref.sync import sync_to_async
+from django.http import (
+    Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+)
 from django.contrib import messages
+from django.contrib.auth.mixins import UserPassesTestMixin
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_GET, require_POST
+from django.views.generic import TemplateView, View
 from django.views.generic.base import ContextMixin
 from typing import Optional, List
 
-from .models import CashFlow, Status, Type, Category, Subcategory
+from . import attachments, events, metrics, profiling, resultcache, tenancy, warmup
+from .exports import iter_cashflows_csv
+from .guardrails import GuardedListMixin
+from .jobs import submit_job
+from .tenancy import TenantViewMixin
+from .models import (
+    CashFlow, CashFlowFlag, CashFlowQuerySet, Status, Type, Category,
+    Subcategory, Job, Attachment, reporting_currency
+)
 from .forms import (
     CashFlowForm, StatusForm,
     TypeForm, CategoryForm,
-    SubcategoryForm
+    SubcategoryForm, AttachmentForm,
+    CashFlowSelectionForm, CashFlowBatchForm
 )
 
 
@@ -42,14 +62,18 @@ class FilterMixin(ContextMixin):
     filter_fields: List[str] = []
 
     def get_queryset(self):
+        """Применяет фильтры к базовому queryset на основе GET-параметров."""
+        return self.apply_filters(super().get_queryset())
+
+    def apply_filters(self, queryset, exclude=()):
         """
-        Применяет фильтры к базовому queryset на основе GET-параметров.
-        Если параметр находится в filter_fields и присутствует в GET-запросе,
-        применяет соответствующий фильтр к queryset.
+        Если параметр находится в filter_fields (и не в exclude) и
+        присутствует в GET-запросе, применяет соответствующий фильтр
+        к queryset.
         """
-        queryset = super().get_queryset()
-
         for field in self.filter_fields:
+            if field in exclude:
+                continue
             value = self.request.GET.get(field)
             if value:
                 filter_kwargs = {field: value}
@@ -71,10 +95,14 @@ class FilterMixin(ContextMixin):
         return context
 
 
-class CashFlowListView(FilterMixin, ListView):
+class CashFlowListView(resultcache.CachedListMixin, TenantViewMixin,
+                       GuardedListMixin, FilterMixin, ListView):
     """
     Представление для отображения списка записей о движении денежных средств.
-    Поддерживает фильтрацию по датам, статусу, типу, категории и подкатегории.
+    Поддерживает фильтрацию по датам, статусу, типу, категории и подкатегории;
+    размер страницы задается параметром page_size (см. guardrails).
+    Показываются записи текущей организации (см. tenancy); отрисованные
+    страницы кешируются (см. resultcache).
     """
     model = CashFlow
     template_name = 'cash_flow/cashflow_list.html'
@@ -82,12 +110,12 @@ class CashFlowListView(FilterMixin, ListView):
     paginate_by = 10
     filter_fields = ['status', 'type', 'category', 'subcategory']
 
-    def get_queryset(self):
+    def apply_filters(self, queryset, exclude=()):
         """
         Расширяет базовую фильтрацию, добавляя поддержку диапазонов дат,
         которые не могут быть обработаны стандартным способом в FilterMixin.
         """
-        queryset = super().get_queryset()
+        queryset = super().apply_filters(queryset, exclude)
 
         # Фильтрация по диапазону дат
         start_date = self.request.GET.get('start_date')
@@ -98,29 +126,93 @@ class CashFlowListView(FilterMixin, ListView):
         if end_date:
             queryset = queryset.filter(date_created__lte=end_date)
 
+        # Записи с отметкой задачи поиска дублей и выбросов
+        flag = self.request.GET.get('flag')
+        if flag in CashFlowFlag.Kind.values:
+            queryset = queryset.filter(flags__kind=flag)
+
         return queryset
 
+    def get_facets(self):
+        """
+        Счетчики и суммы для вариантов фильтров одним групповым запросом
+        (см. CashFlowQuerySet.facets).
+        """
+        queryset = self.apply_filters(
+            CashFlow.objects.for_tenant(self.tenant_id),
+            exclude=CashFlowQuerySet.facet_fields
+        )
+        return queryset.facets(self.request.GET)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
         # Добавляем списки для выпадающих меню фильтров
-        context['statuses'] = Status.objects.all()
-        context['types'] = Type.objects.all()
-        context['categories'] = Category.objects.all()
-        context['subcategories'] = Subcategory.objects.all()
+        context['statuses'] = Status.objects.for_tenant(self.tenant_id)
+        context['types'] = Type.objects.for_tenant(self.tenant_id)
+        context['categories'] = Category.objects.for_tenant(self.tenant_id)
+        context['subcategories'] = Subcategory.objects.for_tenant(self.tenant_id)
+
+        # Число записей и суммы для каждого варианта фильтров
+        facets = self.get_facets()
+        for name, field in (('statuses', 'status'), ('types', 'type'),
+                            ('categories', 'category'),
+                            ('subcategories', 'subcategory')):
+            for option in context[name]:
+                option.facet = facets[field].get(option.pk)
+
+        # Итог по всей отфильтрованной выборке в валюте отчетности
+        context['reporting_currency'] = reporting_currency()
+        context['totals'] = self.object_list.converted_total(
+            context['reporting_currency']
+        )
 
         # Добавляем параметры дат в контекст, т.к. они обрабатываются отдельно
         filters = context.get('filters', {})
         filters.update({
             'start_date': self.request.GET.get('start_date', ''),
             'end_date': self.request.GET.get('end_date', ''),
+            'flag': self.request.GET.get('flag', ''),
+            'page_size': self.request.GET.get('page_size', ''),
         })
         context['filters'] = filters
+        context['flag_choices'] = CashFlowFlag.Kind.choices
 
         return context
 
 
-class CashFlowCreateView(MessageMixin, CreateView):
+class CashFlowExportView(CashFlowListView):
+    """
+    Выгрузка отфильтрованных записей в CSV с пересчетом сумм в валюту
+    отчетности. Файл отдается потоком; с параметром background=1 выгрузка
+    ставится в очередь фоновых задач.
+    """
+    result_cache_scope = None
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('background'):
+            query = request.GET.copy()
+            query.pop('background')
+            job = submit_job(
+                Job.Kind.EXPORT, query.dict(), tenant_id=self.tenant_id
+            )
+            messages.info(
+                request,
+                f'Экспорт поставлен в очередь (задача #{job.pk}). '
+                f'Состояние: /api/jobs/{job.pk}/, '
+                f'файл: /api/jobs/{job.pk}/download/'
+            )
+            return redirect(f"{reverse('cashflow_list')}?{query.urlencode()}")
+
+        response = StreamingHttpResponse(
+            iter_cashflows_csv(self.get_queryset()),
+            content_type='text/csv; charset=utf-8'
+        )
+        response['Content-Disposition'] = 'attachment; filename="cashflows.csv"'
+        return response
+
+
+class CashFlowCreateView(TenantViewMixin, MessageMixin, CreateView):
     """Представление для создания новой записи о движении денежных средств."""
     model = CashFlow
     form_class = CashFlowForm
@@ -129,16 +221,81 @@ class CashFlowCreateView(MessageMixin, CreateView):
     success_message = 'Запись успешно создана.'
 
 
-class CashFlowUpdateView(MessageMixin, UpdateView):
-    """Представление для редактирования записи о движении денежных средств."""
+class CashFlowUpdateView(TenantViewMixin, MessageMixin, UpdateView):
+    """
+    Представление для редактирования записи о движении денежных средств.
+    На странице также список вложений записи и форма загрузки.
+    """
     model = CashFlow
     form_class = CashFlowForm
     template_name = 'cash_flow/cashflow_form.html'
     success_url = reverse_lazy('cashflow_list')
     success_message = 'Запись успешно обновлена.'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['attachments'] = Attachment.objects.for_tenant(
+            self.tenant_id
+        ).filter(cashflow=self.object).select_related('file')
+        context['attachment_form'] = AttachmentForm()
+        return context
+
 
-class CashFlowDeleteView(MessageMixin, DeleteView):
+@csrf_exempt
+@require_POST
+def upload_attachment(request, pk):
+    """
+    Загружает вложение к записи pk. Обработчик загрузки (файл на диск
+    частями с подсчетом хеша) задается до того, как тело запроса прочтет
+    проверка CSRF, поэтому она выполняется внутри (_upload_attachment).
+    """
+    request.upload_handlers = attachments.upload_handlers(request)
+    return _upload_attachment(request, pk)
+
+
+@csrf_protect
+def _upload_attachment(request, pk):
+    cashflow = get_object_or_404(
+        CashFlow.objects.for_tenant(tenancy.require_tenant_id(request)), pk=pk
+    )
+    form = AttachmentForm(files=request.FILES)
+    if form.is_valid():
+        attachments.store(cashflow, form.cleaned_data['file'])
+        messages.success(request, 'Файл прикреплен.')
+    else:
+        for error in form.errors.get('file', ()):
+            messages.error(request, error)
+    return redirect('cashflow_update', pk=pk)
+
+
+@require_GET
+def download_attachment(request, pk):
+    """Содержимое вложения (с поддержкой Range; ?download=1 — как файл)."""
+    attachment = get_object_or_404(
+        Attachment.objects.for_tenant(
+            tenancy.require_tenant_id(request)
+        ).select_related('file'),
+        pk=pk
+    )
+    return attachments.file_response(
+        request, attachment,
+        as_attachment=request.GET.get('download') in ('1', 'true')
+    )
+
+
+@require_POST
+def delete_attachment(request, pk):
+    """Удаляет вложение; содержимое удалит attachments.collect_garbage()."""
+    attachment = get_object_or_404(
+        Attachment.objects.for_tenant(tenancy.require_tenant_id(request)),
+        pk=pk
+    )
+    attachment.delete()
+    messages.success(request, 'Вложение удалено.')
+    return redirect('cashflow_update', pk=attachment.cashflow_id)
+
+
+class CashFlowDeleteView(TenantViewMixin, MessageMixin, DeleteView):
     """Представление для удаления записи о движении денежных средств."""
     model = CashFlow
     template_name = 'cash_flow/cashflow_confirm_delete.html'
@@ -146,14 +303,109 @@ class CashFlowDeleteView(MessageMixin, DeleteView):
     success_message = 'Запись успешно удалена.'
 
 
-class StatusListView(ListView):
+class CashFlowBatchView(TenantViewMixin, TemplateView):
+    """
+    Пакетное действие над записями списка. GET показывает сводку
+    выбранных записей (число, период, итог, первые строки) и форму
+    действия, POST выполняет действие одним UPDATE или DELETE в
+    транзакции. Записи не загружаются: выборка — условие по отмеченным id
+    или фильтрам списка (CashFlowSelectionForm), а номера изменений и
+    надгробия пишут массовые операции CashFlowQuerySet.
+
+    Действие применяется только к записям, которые видел пользователь на
+    странице подтверждения: если с тех пор записи выборки добавились,
+    изменились или удалены (другие число или наибольший номер изменения),
+    POST ничего не меняет и снова показывает сводку.
+    """
+    template_name = 'cash_flow/cashflow_batch.html'
+    preview_rows = 10
+
+    def get(self, request, *args, **kwargs):
+        return self.handle(request.GET, execute=False)
+
+    def post(self, request, *args, **kwargs):
+        return self.handle(request.POST, execute=True)
+
+    def handle(self, data, execute):
+        selection_form = CashFlowSelectionForm(data, tenant_id=self.tenant_id)
+        list_url = reverse('cashflow_list')
+        if not selection_form.is_valid():
+            for errors in selection_form.errors.values():
+                for error in errors:
+                    messages.error(self.request, error)
+            return redirect(f'{list_url}?{selection_form.filter_query()}')
+        list_url = f'{list_url}?{selection_form.filter_query()}'
+
+        if execute:
+            batch_form = CashFlowBatchForm(data, tenant_id=self.tenant_id)
+        elif data.get('action') in dict(CashFlowBatchForm.ACTIONS):
+            batch_form = CashFlowBatchForm(
+                initial={'action': data['action']}, tenant_id=self.tenant_id
+            )
+        else:
+            messages.error(self.request, 'Выберите действие.')
+            return redirect(list_url)
+
+        selection = selection_form.selection()
+        if execute and batch_form.is_valid():
+            cleaned_data = batch_form.cleaned_data
+            confirmed_seq = cleaned_data['confirmed_seq']
+            with transaction.atomic():
+                current = selection.aggregate(
+                    count=Count('pk'), last_seq=Max('change_seq')
+                )
+                if (current['count'], current['last_seq']) == (
+                        cleaned_data['confirmed_count'], confirmed_seq):
+                    # Ограничение по номеру не дает задеть записи, измененные
+                    # после проверки.
+                    confirmed = selection.filter(change_seq__lte=confirmed_seq)
+                    if cleaned_data['action'] == CashFlowBatchForm.DELETE:
+                        _, deleted = confirmed.delete()
+                        count = deleted.get(CashFlow._meta.label, 0)
+                        message = f'Удалено записей: {count}.'
+                    else:
+                        count = confirmed.update(**batch_form.changes())
+                        message = f'Изменено записей: {count}.'
+                    messages.success(self.request, message)
+                    return redirect(list_url)
+            messages.warning(
+                self.request,
+                'Выбранные записи изменились после подтверждения. '
+                'Проверьте сводку и подтвердите действие еще раз.'
+            )
+
+        summary = selection.aggregate(
+            count=Count('pk'), first=Min('date_created'),
+            last=Max('date_created'), last_seq=Max('change_seq'),
+        )
+        if not summary['count']:
+            messages.warning(self.request, 'Нет записей для действия.')
+            return redirect(list_url)
+        currency = reporting_currency()
+        action = batch_form['action'].value()
+        return self.render_to_response(self.get_context_data(
+            selection_form=selection_form,
+            batch_form=batch_form,
+            action=action,
+            action_label=dict(CashFlowBatchForm.ACTIONS).get(action),
+            summary=summary,
+            totals=selection.converted_total(currency),
+            reporting_currency=currency,
+            preview=selection.select_related(
+                'status', 'type', 'category', 'subcategory'
+            ).order_by('-date_created', '-pk')[:self.preview_rows],
+            list_url=list_url,
+        ))
+
+
+class StatusListView(TenantViewMixin, ListView):
     """Представление для отображения списка статусов."""
     model = Status
     template_name = 'cash_flow/status_list.html'
     context_object_name = 'statuses'
 
 
-class StatusCreateView(MessageMixin, CreateView):
+class StatusCreateView(TenantViewMixin, MessageMixin, CreateView):
     """Представление для создания нового статуса."""
     model = Status
     form_class = StatusForm
@@ -162,7 +414,7 @@ class StatusCreateView(MessageMixin, CreateView):
     success_message = 'Статус успешно создан.'
 
 
-class StatusUpdateView(MessageMixin, UpdateView):
+class StatusUpdateView(TenantViewMixin, MessageMixin, UpdateView):
     """Представление для редактирования статуса."""
     model = Status
     form_class = StatusForm
@@ -171,7 +423,7 @@ class StatusUpdateView(MessageMixin, UpdateView):
     success_message = 'Статус успешно обновлен.'
 
 
-class StatusDeleteView(MessageMixin, DeleteView):
+class StatusDeleteView(TenantViewMixin, MessageMixin, DeleteView):
     """Представление для удаления статуса."""
     model = Status
     template_name = 'cash_flow/status_confirm_delete.html'
@@ -179,14 +431,14 @@ class StatusDeleteView(MessageMixin, DeleteView):
     success_message = 'Статус успешно удален.'
 
 
-class TypeListView(ListView):
+class TypeListView(TenantViewMixin, ListView):
     """Представление для отображения списка типов."""
     model = Type
     template_name = 'cash_flow/type_list.html'
     context_object_name = 'types'
 
 
-class TypeCreateView(MessageMixin, CreateView):
+class TypeCreateView(TenantViewMixin, MessageMixin, CreateView):
     """Представление для создания нового типа."""
     model = Type
     form_class = TypeForm
@@ -195,7 +447,7 @@ class TypeCreateView(MessageMixin, CreateView):
     success_message = 'Тип успешно создан.'
 
 
-class TypeUpdateView(MessageMixin, UpdateView):
+class TypeUpdateView(TenantViewMixin, MessageMixin, UpdateView):
     """Представление для редактирования типа."""
     model = Type
     form_class = TypeForm
@@ -204,7 +456,7 @@ class TypeUpdateView(MessageMixin, UpdateView):
     success_message = 'Тип успешно обновлен.'
 
 
-class TypeDeleteView(MessageMixin, DeleteView):
+class TypeDeleteView(TenantViewMixin, MessageMixin, DeleteView):
     """Представление для удаления типа."""
     model = Type
     template_name = 'cash_flow/type_confirm_delete.html'
@@ -212,7 +464,7 @@ class TypeDeleteView(MessageMixin, DeleteView):
     success_message = 'Тип успешно удален.'
 
 
-class CategoryListView(ListView):
+class CategoryListView(TenantViewMixin, ListView):
     """Представление для отображения списка категорий."""
     model = Category
     template_name = 'cash_flow/category_list.html'
@@ -220,10 +472,10 @@ class CategoryListView(ListView):
 
     def get_queryset(self):
         """Оптимизация запроса с использованием select_related."""
-        return Category.objects.select_related('type').all()
+        return super().get_queryset().select_related('type')
 
 
-class CategoryCreateView(MessageMixin, CreateView):
+class CategoryCreateView(TenantViewMixin, MessageMixin, CreateView):
     """Представление для создания новой категории."""
     model = Category
     form_class = CategoryForm
@@ -232,7 +484,7 @@ class CategoryCreateView(MessageMixin, CreateView):
     success_message = 'Категория успешно создана.'
 
 
-class CategoryUpdateView(MessageMixin, UpdateView):
+class CategoryUpdateView(TenantViewMixin, MessageMixin, UpdateView):
     """Представление для редактирования категории."""
     model = Category
     form_class = CategoryForm
@@ -241,7 +493,7 @@ class CategoryUpdateView(MessageMixin, UpdateView):
     success_message = 'Категория успешно обновлена.'
 
 
-class CategoryDeleteView(MessageMixin, DeleteView):
+class CategoryDeleteView(TenantViewMixin, MessageMixin, DeleteView):
     """Представление для удаления категории."""
     model = Category
     template_name = 'cash_flow/category_confirm_delete.html'
@@ -249,19 +501,19 @@ class CategoryDeleteView(MessageMixin, DeleteView):
     success_message = 'Категория успешно удалена.'
 
 
-class SubcategoryListView(ListView):
+class SubcategoryListView(TenantViewMixin, ListView):
     """Представление для отображения списка подкатегорий."""
     model = Subcategory
     template_name = 'cash_flow/subcategory_list.html'
     context_object_name = 'subcategories'
 
     def get_queryset(self):
-        return Subcategory.objects.select_related(
+        return super().get_queryset().select_related(
             'category', 'category__type'
-        ).all()
+        )
 
 
-class SubcategoryCreateView(MessageMixin, CreateView):
+class SubcategoryCreateView(TenantViewMixin, MessageMixin, CreateView):
     """Представление для создания новой подкатегории."""
     model = Subcategory
     form_class = SubcategoryForm
@@ -270,7 +522,7 @@ class SubcategoryCreateView(MessageMixin, CreateView):
     success_message = 'Подкатегория успешно создана.'
 
 
-class SubcategoryUpdateView(MessageMixin, UpdateView):
+class SubcategoryUpdateView(TenantViewMixin, MessageMixin, UpdateView):
     """Представление для редактирования подкатегории."""
     model = Subcategory
     form_class = SubcategoryForm
@@ -279,7 +531,7 @@ class SubcategoryUpdateView(MessageMixin, UpdateView):
     success_message = 'Подкатегория успешно обновлена.'
 
 
-class SubcategoryDeleteView(MessageMixin, DeleteView):
+class SubcategoryDeleteView(TenantViewMixin, MessageMixin, DeleteView):
     """Представление для удаления подкатегории."""
     model = Subcategory
     template_name = 'cash_flow/subcategory_confirm_delete.html'
@@ -296,7 +548,9 @@ def get_categories_by_type(request):
     при изменении типа в формах.
     """
     type_id = request.GET.get('type_id')
-    categories = Category.objects.filter(type_id=type_id).values('id', 'name')
+    categories = Category.objects.for_tenant(
+        tenancy.require_tenant_id(request)
+    ).filter(type_id=type_id).values('id', 'name')
     return JsonResponse(list(categories), safe=False)
 
 
@@ -308,11 +562,132 @@ def get_subcategories_by_category(request):
     при изменении категории в формах.
     """
     category_id = request.GET.get('category_id')
-    subcategories = Subcategory.objects.filter(
-        category_id=category_id
-    ).values('id', 'name')
+    subcategories = Subcategory.objects.for_tenant(
+        tenancy.require_tenant_id(request)
+    ).filter(category_id=category_id).values('id', 'name')
     return JsonResponse(list(subcategories), safe=False)
 
 
 def index(request):
     return redirect('cashflow_list')
+
+
+@require_POST
+def select_tenant(request):
+    """
+    Сохраняет в сессии организацию tenant, с которой работает пользователь
+    (одну из его организаций, см. tenancy).
+    """
+    request.session[tenancy.SESSION_KEY] = request.POST.get('tenant', '')
+    request.__dict__.pop('_cash_flow_tenant_id', None)
+    if str(tenancy.current_tenant_id(request)) != request.POST.get('tenant'):
+        request.session.pop(tenancy.SESSION_KEY)
+        messages.error(request, 'Организация недоступна.')
+    return redirect('cashflow_list')
+
+
+# Интервал комментариев-пингов в потоке событий, с.
+EVENTS_HEARTBEAT = 15
+
+
+async def cashflow_events(request):
+    """
+    Поток событий (text/event-stream) о создании, изменении и удалении
+    движений ДС и справочников. Работает под ASGI (money_flow.asgi).
+
+    Фильтры status, type, category, subcategory, start_date и end_date
+    такие же, как у списка; models — список моделей через запятую.
+    Приходят события только текущей организации (см. tenancy).
+    id события — номер изменения: пропущенное догружается через
+    /api/cashflows/changes/?since=<id>.
+    """
+    tenant_id = await sync_to_async(tenancy.require_tenant_id)(request)
+    filters = {}
+    for field in events.FILTER_FIELDS:
+        value = request.GET.get(field)
+        if value:
+            if not value.isdigit():
+                return HttpResponseBadRequest(f'Неверное значение {field}.')
+            filters[field] = int(value)
+    for field in ('start_date', 'end_date'):
+        value = request.GET.get(field)
+        if value:
+            try:
+                filters[field] = datetime.date.fromisoformat(value).isoformat()
+            except ValueError:
+                return HttpResponseBadRequest(f'Неверная дата {field}.')
+    models = None
+    if request.GET.get('models'):
+        models = request.GET['models'].split(',')
+        if not set(models) <= set(events.MODELS):
+            return HttpResponseBadRequest('Неизвестная модель.')
+
+    subscription = events.broker.subscribe(filters, models, tenant=tenant_id)
+    stream = events.EventStream(subscription, heartbeat=EVENTS_HEARTBEAT)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class StaffRequiredMixin(UserPassesTestMixin):
+    """Доступ только сотрудникам (is_staff)."""
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+
+class SuperuserRequiredMixin(UserPassesTestMixin):
+    """
+    Доступ только суперпользователям: буфер профилей общий для процесса и
+    содержит запросы всех организаций.
+    """
+
+    def test_func(self):
+        return self.request.user.is_superuser
+
+
+class ProfileListView(SuperuserRequiredMixin, TemplateView):
+    """Профили запросов из кольцевого буфера процесса (новые сверху)."""
+    template_name = 'cash_flow/profile_list.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['profiles'] = list(reversed(profiling.profile_buffer()))
+        return context
+
+
+class ProfileDetailView(SuperuserRequiredMixin, TemplateView):
+    """
+    Отчет по профилю из буфера; ?download=1 — JSON-файлом. Планы EXPLAIN
+    для профилей из выборки строятся при первом просмотре.
+    """
+    template_name = 'cash_flow/profile_detail.html'
+
+    def get(self, request, *args, **kwargs):
+        self.profile = profiling.get_profile(kwargs['pk'])
+        if self.profile is None:
+            raise Http404('Профиль не найден или вытеснен из буфера.')
+        profiling.add_explains(self.profile)
+        if request.GET.get('download'):
+            return profiling.download_response(self.profile)
+        return super().get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['profile'] = self.profile
+        return context
+
+
+class MetricsView(StaffRequiredMixin, View):
+    """
+    Счетчики процесса (cash_flow.metrics), доля попаданий в кеш и профиль
+    прогрева процесса в JSON.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({
+            'counters': metrics.snapshot(),
+            'result_cache': resultcache.hit_ratios(),
+            'warmup': warmup.last_profile(),
+        })
@@ -0,0 +1,266 @@
+"""
+Прогрев процесса после деплоя или перезапуска воркера: чтобы первые
+запросы пользователей не платили за ленивую инициализацию.
+
+Этапы warmup():
+- imports — импорт модулей cash_flow и классов из настроек REST_FRAMEWORK
+  (рендереры, парсеры, пагинация, фильтры), время импорта по модулям;
+- urls — заполнение URL-резолвера (crud_patterns, роутер API, админка);
+- templates — компиляция шаблонов всех каталогов в кеш загрузчика;
+- database — соединения со всеми базами (для SQLite — с включением WAL);
+- references — кеш ContentType и чтение справочников организации по
+  умолчанию (страницы БД попадают в кеш);
+- requests — GET-запросы WARMUP_URLS через тот же обработчик, что
+  обслуживает пользователей: инициализируются middleware, сериализаторы
+  и фильтры, в кеш результатов попадают первые страницы списка и API.
+
+Запуск при импорте money_flow.wsgi и money_flow.asgi включает
+CASH_FLOW_WARMUP; профиль последнего прогрева — last_profile() и
+/cash_flow/metrics/ (warmup). Команда manage.py warmup выполняет те же
+этапы в отдельном процессе и печатает профиль.
+
+Соединение с БД принадлежит потоку, открывшему его, и переживает первый
+запрос только при CONN_MAX_AGE > 0; иначе этап database лишь проверяет
+доступность базы.
+"""
+import asyncio
+import importlib
+import io
+import os
+import pkgutil
+import sys
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+from django.db import connections
+from django.template import TemplateSyntaxError, engines
+from django.urls import get_resolver, reverse
+from rest_framework.settings import IMPORT_STRINGS, api_settings
+
+
+# (имя URL, Accept) — страницы, открываемые первыми после деплоя.
+WARMUP_URLS = (
+    ('cashflow_list', 'text/html'),
+    ('cashflow_create', 'text/html'),
+    ('api-root', 'application/json'),
+    ('cashflow-list', 'application/json'),
+    ('status-list', 'application/json'),
+    ('admin:login', 'text/html'),
+)
+TEMPLATE_EXTENSIONS = ('.html', '.txt')
+# Столько самых долгих импортов попадает в профиль.
+SLOWEST_IMPORTS = 10
+SKIPPED_MODULES = ('tests', 'migrations', 'management')
+
+_lock = threading.Lock()
+_last_profile = None
+
+
+def enabled():
+    return getattr(settings, 'CASH_FLOW_WARMUP', False)
+
+
+def last_profile():
+    """Профиль последнего прогрева процесса или None."""
+    with _lock:
+        return _last_profile
+
+
+def import_modules():
+    """
+    Импортирует модули cash_flow (кроме тестов, миграций и команд) и классы из
+    настроек REST_FRAMEWORK. Возвращает время импорта самых долгих
+    модулей (включая их зависимости).
+    """
+    package = importlib.import_module('cash_flow')
+    names = [
+        info.name
+        for info in pkgutil.walk_packages(package.__path__, 'cash_flow.')
+        if not any(part in SKIPPED_MODULES for part in info.name.split('.'))
+    ]
+    timings = {}
+    for name in names:
+        if name in sys.modules:
+            continue
+        started = time.perf_counter()
+        importlib.import_module(name)
+        timings[name] = time.perf_counter() - started
+    for setting in IMPORT_STRINGS:
+        if setting in api_settings.__dict__:
+            # Уже импортировано и закешировано api_settings.
+            continue
+        started = time.perf_counter()
+        getattr(api_settings, setting)
+        timings[f'REST_FRAMEWORK.{setting}'] = time.perf_counter() - started
+    slowest = sorted(timings.items(), key=lambda item: -item[1])[:SLOWEST_IMPORTS]
+    return {
+        'modules': len(timings),
+        'slowest': {name: round(seconds, 4) for name, seconds in slowest},
+    }
+
+
+def populate_urls():
+    resolver = get_resolver()
+    # reverse_dict заполняет резолвер и все вложенные include().
+    return {'names': len(resolver.reverse_dict)}
+
+
+def compile_templates():
+    """Компилирует шаблоны всех каталогов в кеш загрузчиков движков."""
+    compiled = failed = 0
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            directory = str(directory)
+            for path in sorted(_template_files(directory)):
+                name = path[len(directory):].lstrip('/')
+                try:
+                    engine.get_template(name)
+                except TemplateSyntaxError:
+                    failed += 1
+                else:
+                    compiled += 1
+    return {'compiled': compiled, 'failed': failed}
+
+
+def _template_files(directory):
+    for root, _, files in os.walk(directory):
+        for file_name in files:
+            if file_name.endswith(TEMPLATE_EXTENSIONS):
+                yield os.path.join(root, file_name)
+
+
+def open_connections():
+    vendors = {}
+    for connection in connections.all():
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        vendors[connection.alias] = connection.vendor
+    return vendors
+
+
+def prime_references():
+    """Кеш ContentType (админка, права) и справочники организации по умолчанию."""
+    from .models import Category, Status, Subcategory, Type
+    from .tenancy import default_tenant_id
+
+    ContentType.objects.get_for_models(*apps.get_models())
+    tenant_id = default_tenant_id()
+    rows = {}
+    for model in (Status, Type, Category, Subcategory):
+        rows[model._meta.model_name] = len(
+            model.objects.for_tenant(tenant_id).values_list('pk', 'name')
+        )
+    return rows
+
+
+def _host():
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*' and not host.startswith('.'):
+            return host
+    return 'localhost'
+
+
+def _request(path, accept):
+    host = _host()
+    return WSGIRequest({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'HTTP_HOST': host,
+        'HTTP_ACCEPT': accept,
+        'wsgi.input': io.BytesIO(),
+        'wsgi.url_scheme': 'http',
+    })
+
+
+def send_requests(handler=None, urls=WARMUP_URLS):
+    """
+    GET-запросы urls через handler (WSGIHandler или ASGIHandler
+    приложения; по умолчанию — новый WSGIHandler). Возвращает статус и
+    время каждого запроса.
+    """
+    if handler is None:
+        handler = WSGIHandler()
+    if isinstance(handler, ASGIHandler):
+        get_response = async_to_sync(handler.get_response_async)
+    else:
+        get_response = handler.get_response
+    results = {}
+    for name, accept in urls:
+        path = reverse(name)
+        started = time.perf_counter()
+        response = get_response(_request(path, accept))
+        results[path] = {
+            'status': response.status_code,
+            'seconds': round(time.perf_counter() - started, 4),
+        }
+    return results
+
+
+STAGES = (
+    ('imports', import_modules),
+    ('urls', populate_urls),
+    ('templates', compile_templates),
+    ('database', open_connections),
+    ('references', prime_references),
+)
+
+
+def warmup(handler=None, requests=True):
+    """
+    Выполняет этапы прогрева (см. модуль) и возвращает профиль: список
+    {'stage', 'seconds', 'detail'} и итог total. Ошибка этапа не
+    прерывает прогрев и записывается в detail.
+
+    Если в потоке уже работает цикл событий (ASGI-сервер импортирует
+    приложение внутри него), синхронный ORM там недоступен, и прогрев
+    выполняется в отдельном потоке.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return _warmup(handler, requests)
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.append(_warmup(handler, requests)),
+        name='cash-flow-warmup',
+    )
+    thread.start()
+    thread.join()
+    return result[0] if result else None
+
+
+def _warmup(handler, requests):
+    global _last_profile
+    stages = list(STAGES)
+    if requests:
+        stages.append(('requests', lambda: send_requests(handler)))
+    profile = []
+    started = time.perf_counter()
+    for stage, run in stages:
+        stage_started = time.perf_counter()
+        try:
+            detail = run()
+        except Exception as error:
+            detail = {'error': f'{type(error).__name__}: {error}'}
+        profile.append({
+            'stage': stage,
+            'seconds': round(time.perf_counter() - stage_started, 4),
+            'detail': detail,
+        })
+    result = {
+        'stages': profile,
+        'total': round(time.perf_counter() - started, 4),
+    }
+    with _lock:
+        _last_profile = result
+    return result
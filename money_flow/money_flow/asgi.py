@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'money_flow.settings')
 
 application = get_asgi_application()
+
+# Warm the process up before the first request (CASH_FLOW_WARMUP, see
+# cash_flow.warmup).
+from cash_flow import warmup  # noqa: E402
+
+if warmup.enabled():
+    warmup.warmup(application)
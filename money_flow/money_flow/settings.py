@@ -42,12 +42,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'cash_flow.assets.StaticAssetsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'cash_flow.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'money_flow.urls'
@@ -118,6 +120,19 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# collectstatic gives files content-hashed names and writes .gz (and .br when
+# the brotli package is installed) next to them; StaticAssetsMiddleware serves
+# them from STATIC_ROOT with far-future cache headers.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'cash_flow.assets.PrecompressedManifestStaticFilesStorage',
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -129,6 +144,64 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'cash_flow.guardrails.GuardedPagination',
     'PAGE_SIZE': 10
 }
+
+# Currency that list totals, exports and aggregates are converted to
+CASH_FLOW_REPORTING_CURRENCY = 'RUB'
+
+# Files produced and consumed by background jobs (exports, imports)
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Receipt attachments are stored once per content hash under this directory
+# (see cash_flow.attachments); larger uploads are rejected
+CASH_FLOW_ATTACHMENTS_ROOT = MEDIA_ROOT / 'attachments'
+CASH_FLOW_ATTACHMENT_MAX_SIZE = 50 * 1024 * 1024
+
+# Share of requests profiled into the in-process ring buffer (0 disables
+# sampling; staff can still profile a request with ?_profile=html|download)
+CASH_FLOW_PROFILE_SAMPLE_RATE = 0.0
+CASH_FLOW_PROFILE_BUFFER_SIZE = 50
+
+# Query cost limits for the cash flow list and API (see cash_flow.guardrails):
+# largest page_size a client may request, per-statement timeout in seconds
+# (0 disables) and the longest date range that allows unindexed sorts and
+# comment search
+CASH_FLOW_MAX_PAGE_SIZE = 100
+CASH_FLOW_STATEMENT_TIMEOUT = 2.0
+CASH_FLOW_NARROW_RANGE_DAYS = 31
+
+# Rendered list pages and /api/cashflows/ payloads are cached in this cache
+# alias (None disables) and invalidated per date range and reference value
+# on writes (see cash_flow.resultcache). LocMemCache evicts least recently
+# used entries past MAX_ENTRIES; use a shared backend such as RedisCache when
+# several processes or job workers write.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cash-flow-results',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+CASH_FLOW_RESULT_CACHE = 'results'
+
+# Tenant used by anonymous requests and by superusers who are not members of
+# any tenant (see cash_flow.tenancy); other logged-in users without a tenant
+# get none. The migration creates tenant 1. None makes tenant membership
+# mandatory.
+CASH_FLOW_DEFAULT_TENANT = 1
+
+# Largest number of in-memory ledger snapshots (one per database and
+# tenant) kept by cash_flow.analytics; least recently used ones are dropped
+CASH_FLOW_SNAPSHOT_LIMIT = 16
+
+# Warm the process up when money_flow.wsgi / money_flow.asgi is imported:
+# import modules, compile templates, open DB connections and send a few GET
+# requests through the application (see cash_flow.warmup). Enable in
+# production; left off here so runserver reloads stay fast.
+CASH_FLOW_WARMUP = False
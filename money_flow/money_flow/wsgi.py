@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'money_flow.settings')
 
 application = get_wsgi_application()
+
+# Warm the process up before the first request (CASH_FLOW_WARMUP, see
+# cash_flow.warmup).
+from cash_flow import warmup  # noqa: E402
+
+if warmup.enabled():
+    warmup.warmup(application)
@@ -0,0 +1,19 @@
+/**
+ * Переход по выбранному значению в autocomplete-фильтрах списка админки
+ */
+'use strict';
+{
+    const $ = django.jQuery;
+
+    $(document).on('change', 'select[data-autocomplete-filter]', function() {
+        const lookup = $(this).data('autocomplete-filter');
+        const base = $(this).data('base-url') || '?';
+        const value = $(this).val();
+        if (!value) {
+            window.location.search = base;
+            return;
+        }
+        const separator = base === '?' ? '' : '&';
+        window.location.search = base + separator + encodeURIComponent(lookup) + '=' + encodeURIComponent(value);
+    });
+}
@@ -0,0 +1,39 @@
+/**
+ * Скрипт для отметки записей списка под пакетные действия.
+ *
+ * Форма с data-batch-select содержит флажки записей (data-batch-row),
+ * флажок страницы (data-batch-page), флажок «все по фильтру»
+ * (data-batch-all), счетчик отмеченных (data-batch-count) и кнопки
+ * действий (data-batch-action), доступные, только когда что-то выбрано.
+ * При выборе всех записей по фильтру отметки строк не отправляются.
+ */
+$(document).ready(function() {
+    $('form[data-batch-select]').each(function() {
+        var form = $(this);
+        var rows = form.find('[data-batch-row]');
+        var page = form.find('[data-batch-page]');
+        var all = form.find('[data-batch-all]');
+
+        function refresh() {
+            var checked = rows.filter(':checked').length;
+            var selectAll = all.prop('checked');
+            rows.prop('disabled', selectAll);
+            page.prop('disabled', selectAll);
+            page.prop('checked', checked > 0 && checked === rows.length);
+            form.find('[data-batch-count]').text(
+                selectAll ? all.next('label').text().trim() : checked
+            );
+            form.find('[data-batch-action]').prop(
+                'disabled', !selectAll && checked === 0
+            );
+        }
+
+        page.change(function() {
+            rows.prop('checked', $(this).prop('checked'));
+            refresh();
+        });
+        rows.change(refresh);
+        all.change(refresh);
+        refresh();
+    });
+});
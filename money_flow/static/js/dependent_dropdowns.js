@@ -1,50 +1,66 @@
 /**
- * Скрипт для обработки зависимых выпадающих списков
+ * Скрипт для обработки зависимых выпадающих списков.
+ *
+ * Настраивается атрибутами формы с data-dependent-selects:
+ * data-categories-url и data-subcategories-url — адреса AJAX-запросов,
+ * data-type, data-category, data-subcategory — селекторы списков,
+ * data-empty-category и data-empty-subcategory — подписи пустого варианта.
  */
 $(document).ready(function() {
-    // Обработка изменения типа для фильтрации категорий
-    $('#id_type').change(function() {
-        var typeId = $(this).val();
-        if (typeId) {
-            $.ajax({
-                url: "/cash_flow/ajax/categories/",
-                data: {
-                    'type_id': typeId
-                },
-                dataType: 'json',
-                success: function(data) {
-                    $('#id_category').html('<option value="">---------</option>');
-                    $('#id_subcategory').html('<option value="">---------</option>');
-                    $.each(data, function(key, value) {
-                        $('#id_category').append('<option value="' + value.id + '">' + value.name + '</option>');
-                    });
-                }
-            });
-        } else {
-            $('#id_category').html('<option value="">---------</option>');
-            $('#id_subcategory').html('<option value="">---------</option>');
+    $('form[data-dependent-selects]').each(function() {
+        var form = $(this);
+        var type = $(form.data('type'));
+        var category = $(form.data('category'));
+        var subcategory = $(form.data('subcategory'));
+
+        function reset(select, label) {
+            select.empty().append($('<option>').val('').text(label));
         }
-    });
 
-    // Обработка изменения категории для фильтрации подкатегорий
-    $('#id_category').change(function() {
-        var categoryId = $(this).val();
-        if (categoryId) {
-            $.ajax({
-                url: "/cash_flow/ajax/subcategories/",
-                data: {
-                    'category_id': categoryId
-                },
-                dataType: 'json',
-                success: function(data) {
-                    $('#id_subcategory').html('<option value="">---------</option>');
-                    $.each(data, function(key, value) {
-                        $('#id_subcategory').append('<option value="' + value.id + '">' + value.name + '</option>');
-                    });
-                }
+        function fill(select, label, data) {
+            reset(select, label);
+            $.each(data, function(key, value) {
+                select.append($('<option>').val(value.id).text(value.name));
             });
-        } else {
-            $('#id_subcategory').html('<option value="">---------</option>');
         }
+
+        // Обработка изменения типа для фильтрации категорий
+        type.change(function() {
+            var typeId = $(this).val();
+            reset(subcategory, form.data('empty-subcategory'));
+            if (typeId) {
+                $.ajax({
+                    url: form.data('categories-url'),
+                    data: {
+                        'type_id': typeId
+                    },
+                    dataType: 'json',
+                    success: function(data) {
+                        fill(category, form.data('empty-category'), data);
+                    }
+                });
+            } else {
+                reset(category, form.data('empty-category'));
+            }
+        });
+
+        // Обработка изменения категории для фильтрации подкатегорий
+        category.change(function() {
+            var categoryId = $(this).val();
+            if (categoryId) {
+                $.ajax({
+                    url: form.data('subcategories-url'),
+                    data: {
+                        'category_id': categoryId
+                    },
+                    dataType: 'json',
+                    success: function(data) {
+                        fill(subcategory, form.data('empty-subcategory'), data);
+                    }
+                });
+            } else {
+                reset(subcategory, form.data('empty-subcategory'));
+            }
+        });
     });
-});
\ No newline at end of file
+});